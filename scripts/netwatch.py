@@ -19,12 +19,97 @@
   целей (по умолчанию 1.1.1.1 и 8.8.8.8), DNS для основного хоста,
   HTTP/HTTPS‑запрос к основному сервису (по умолчанию api.openai.com) и
   дополнительные тестовые URL (``generate_204`` и др.).
-* **Отслеживание трафика**: при наличии ``psutil`` выводит скорость по
-  всем интерфейсам с усреднением на интервале опроса.
+* **Параллельные проверки**: все проверки итерации выполняются в
+  ограниченном пуле потоков (``--workers``), поэтому итерация длится
+  столько, сколько самая медленная проверка, а не сумму задержек.
+* **Asyncio‑движок**: ``--engine async`` выполняет проверки неблокирующим
+  вводом‑выводом с единым дедлайном итерации (``--tick-budget``);
+  опоздавшие проверки отменяются и помечаются ``timeout``.
+* **Бюджет итерации**: ``--tick-budget`` ограничивает итерацию и в пуле
+  потоков; после долгой итерации просроченные такты пропускаются
+  (``--missed-ticks skip``) или выполняются подряд (``catchup``).
+  Отставание старта, длительность, перерасходы и пропущенные такты видны
+  на панели, в файле статуса (``loop``) и в метриках, а перерасход
+  пишется в лог строкой ``LOOP OVERRUN``.
+* **Встроенный ICMP**: ping выполняется без запуска утилиты — через
+  непривилегированный ``SOCK_DGRAM``/``IPPROTO_ICMP`` или raw‑сокет, все
+  цели на одном сокете; при недоступности — системный ``ping``
+  (``--ping-mode``). Режим ``stream`` держит постоянный ``ping -i`` на
+  каждую цель и считает потери по потоку ответов.
+* **Keep-alive HTTP**: ``--http-keepalive`` держит соединения HTTP‑проверок
+  открытыми между итерациями и показывает задержку по «холодному» и
+  переиспользованному соединению отдельно.
+* **Прямой опрос DNS**: ``--dns-resolvers system,1.1.1.1,8.8.8.8`` шлёт
+  запросы A/AAAA сразу всем резолверам по неблокирующему UDP (с откатом на
+  TCP для усечённых ответов) и показывает задержку, rcode и ответы каждого.
+* **События линков**: на Linux netlink‑слушатель следит за линками,
+  адресами и маршрутом по умолчанию; изменение сразу запускает внеочередную
+  итерацию, а локальный IP в остальное время берётся из кэша
+  (``--no-netlink`` отключает).
+* **Фазы HTTP**: для основной и дополнительных HTTP‑проверок отдельно
+  замеряются DNS, TCP‑connect, TLS, время до первого байта и общее время;
+  они попадают в состояние, JSON‑файл статуса и на панель.
+* **Планировщик проверок**: ``--probe-interval NAME=SEC`` задаёт свой
+  интервал группе или отдельной проверке (например, ``primary=1``,
+  ``services=30``); проверки разнесены по фазе и слегка «дрожат»
+  (``--jitter``), а панель показывает последние результаты.
+* **Адаптивная частота**: ``--adaptive`` растягивает интервал, пока связь
+  стабильна, и резко сжимает его при первом сбое или всплеске RTT —
+  границы простоя фиксируются точнее при меньшем числе проверок.
+* **Фоновая запись лога**: строки лога копятся в очереди и пишутся
+  отдельным потоком пачками (``--log-flush-lines``/``--log-flush-ms``,
+  ``--log-fsync``); при переполнении очереди считаются потерянные строки.
+* **Ротация логов**: ``--log-max-mb``/``--log-rotate`` режут runlog на
+  сегменты ``runlog_*.log.NNN``, которые сжимаются в фоне
+  (``--log-compress``) и удаляются по ``--log-keep-mb``/``--log-keep-days``.
+* **Отчёт по логам**: ``netwatch.py report`` потоково читает runlog (в том
+  числе сжатые) и считает доступность проверок, окна простоя, MTTR и
+  p50/p95/p99 RTT при постоянном расходе памяти.
+* **Агенты и агрегатор**: ``--push udp://host:port`` (или ``tcp://``)
+  отправляет компактное состояние каждой итерации процессу
+  ``netwatch.py aggregate``, который сводит потоки многих хостов, держит
+  окна доступности по каждому и отличает сбой всей площадки от поломки
+  отдельной машины.
+* **Двоичные ряды замеров**: с ``--samples`` каждая проверка пишется в
+  свой файл ``scripts/netlog/samples/*.nws`` записями фиксированного размера
+  (время, ok, RTT, HTTP‑статус) с заголовком‑схемой; запись идёт в фоновом
+  потоке, а записи старше ``--samples-keep-days`` регулярно отрезаются.
+  ``netwatch.py samples`` читает ряды через ``mmap`` бинарным поиском по
+  времени. Текстовые STATUS‑строки можно отключить (``--no-status-log``).
+* **База SQLite**: ``--sqlite`` пишет замеры пачками (одна транзакция на
+  ``--sqlite-batch`` итераций, WAL, индекс ``(probe, ts)``) и в фоне
+  поддерживает свёртки по минутам и часам (count, сбои, min/avg/max/p95
+  RTT); сырые замеры старше ``--sqlite-keep-days`` удаляются. Запросы —
+  ``netwatch.py db``.
+* **Разностный лог**: ``--status-delta`` пишет полный STATUS раз в
+  ``--keyframe-minutes`` (и после ротации), а в остальные итерации — DELTA
+  только с изменившимися полями (RTT — с допуском ``--delta-rtt-tolerance``);
+  ``report`` и ``netwatch.py show --at`` восстанавливают полное состояние.
+* **Индекс runlog**: рядом с логом ведётся ``runlog_*.log.idx`` — на каждую
+  минуту смещение первой строки и последнего полного STATUS. ``show
+  --at``/``--since`` и ``report --since`` находят нужную минуту бинарным
+  поиском и читают лог через ``mmap`` с этого места, а не с начала файла.
+* **Дифференциальная отрисовка**: кадр панели собирается в памяти, и в
+  терминал одной записью уходят только изменившиеся строки — без мерцания
+  при коротком интервале, по SSH и в tmux.
+* **Скользящие перцентили**: для каждой цели ping и HTTP‑проверки ведутся
+  гистограммы задержек за 1 мин / 15 мин / 1 ч с постоянной памятью;
+  p50/p95/p99, min/max и джиттер видны на панели и в файле статуса.
+* **Отслеживание трафика**: фоновый поток читает счётчики каждого
+  интерфейса (``psutil`` или ``/proc/net/dev``) с периодом
+  ``--throughput-sample`` по монотонным часам и показывает суммарную
+  скорость, а также EWMA и пик по каждому интерфейсу.
 * **Самовосстановление**: любые ошибки внутри цикла ловятся и не
   останавливают работу; можно оставить скрипт работать автономно.
 * **JSON‑снимок состояния**: последняя сводка сохраняется в
   ``scripts/netlog/last_status.json`` или в путь из ``--status-file``.
+  Файл заменяется атомарно (временный файл + rename), переписывается только
+  при изменении содержимого (или раз в ``--status-heartbeat`` секунд) и
+  содержит порядковый номер ``seq``.
+* **Метрики Prometheus**: с ``--metrics-port`` встроенный HTTP‑сервер отдаёт
+  ``/metrics`` в формате OpenMetrics (доступность и RTT‑гистограммы проверок,
+  HTTP‑статусы, простой, длительность итерации, трафик). Снимок готовится раз
+  в итерацию, поэтому опрос не запускает проверок.
 
 Запуск
 ------
@@ -32,6 +117,16 @@
     python scripts/netwatch.py
     python scripts/netwatch.py --interval 1 --new-console
     python scripts/netwatch.py --plain --services google.com/generate_204
+    python scripts/netwatch.py report --since 24h
+    python scripts/netwatch.py --samples --samples-keep-days 14
+    python scripts/netwatch.py samples ping/8.8.8.8 --since 24h
+    python scripts/netwatch.py --sqlite
+    python scripts/netwatch.py --status-delta --keyframe-minutes 10
+    python scripts/netwatch.py show --at 2025-01-31T03:12
+    python scripts/netwatch.py show --since 2025-01-31T03:10 --until 2025-01-31T03:15
+    python scripts/netwatch.py db primary --since 7d --resolution 1h
+    python scripts/netwatch.py --push udp://monitor:9787 --agent-name web-1
+    python scripts/netwatch.py aggregate --listen 0.0.0.0:9787
 
 Логи пишутся в ``scripts/netlog``, а в терминал выводится обновляемая
 панель.
@@ -40,19 +135,40 @@
 from __future__ import annotations
 
 import argparse
+import array
+import asyncio
+import concurrent.futures
 import datetime
+import gzip
+import hashlib
+import heapq
 import http.client
+import http.server
+import itertools
 import json
 import logging
+import lzma
+import math
+import mmap
 import os
+import queue
+import random
+import re
+import select
+import selectors
+import shutil
 import signal
+import sqlite3
 import socket
+import ssl
+import struct
 import subprocess
 import sys
 import threading
 import time
+from collections import deque
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Deque, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
 
 try:
     import psutil  # type: ignore
@@ -172,661 +288,5736 @@ def enable_windows_ansi() -> bool:
         return False
 
 
+def summary_is_up(summary: str) -> bool:
+    """Считается ли сводка состоянием «связь есть» (как в ``_update_downtime``)."""
+
+    return summary.startswith(("OK", "ОК", "Интернет"))
+
+
+def read_tail(path: Path, size: int = 8192) -> str:
+    """Прочитать последние ``size`` байт файла (обратным seek от конца)."""
+
+    with path.open("rb") as fh:
+        fh.seek(0, os.SEEK_END)
+        end = fh.tell()
+        fh.seek(max(0, end - size))
+        return fh.read().decode("utf-8", errors="ignore")
+
+
 def check_previous_run(log_dir: Path) -> None:
     """Inspect the most recent log file and append a termination record if needed.
 
     When the script starts it checks the latest ``runlog_*.log`` file in
-    ``log_dir``. If that file does not contain a ``NETWATCH STOP`` marker
+    ``log_dir``. If that file does not end with a ``NETWATCH STOP`` marker
     (indicating that the previous run did not terminate gracefully),
     appends a line noting that the previous session ended unexpectedly
     along with the file’s modification time.
+
+    Only the last few KB are read (the marker is always the final record),
+    so startup time does not depend on how large the previous log grew.
     """
 
     try:
-        logs = [p for p in log_dir.iterdir() if p.is_file() and p.name.startswith("runlog_")]
+        # Ротированные сегменты (runlog_*.log.NNN[.gz]) закрыты писателем;
+        # маркер остановки ищем только в активных файлах запусков
+        logs = [p for p in log_dir.iterdir() if p.is_file() and p.name.startswith("runlog_") and p.suffix == ".log"]
         if not logs:
             return
         last_log = max(logs, key=lambda p: p.stat().st_mtime)
-        with last_log.open("r+", encoding="utf-8") as fh:
-            content = fh.read()
-            if "NETWATCH STOP" not in content:
-                mtime = datetime.datetime.fromtimestamp(last_log.stat().st_mtime)
+        if "NETWATCH STOP" not in read_tail(last_log):
+            mtime = datetime.datetime.fromtimestamp(last_log.stat().st_mtime)
+            with last_log.open("a", encoding="utf-8") as fh:
                 fh.write(f"\n=== NETWATCH STOP (previous run incomplete) {mtime.isoformat()} ===\n")
     except Exception:
         # If any error occurs during inspection, silently ignore it.
         pass
 
 
+def ping_command(host: str, timeout: float) -> List[str]:
+    """Собрать командную строку системного ``ping`` для одного эхо‑запроса."""
+
+    if os.name == "nt":
+        # Windows: -n 1 sends one echo, -w expects timeout in ms
+        return ["ping", "-n", "1", "-w", str(int(timeout * 1000)), host]
+    # POSIX: -c 1 sends one packet, -W waits timeout seconds
+    return ["ping", "-c", "1", "-W", str(int(timeout)), host]
+
+
+def parse_ping_reply(returncode: int, output: str) -> Dict[str, Optional[object]]:
+    """Разобрать вывод ``ping`` в словарь ``ok``/``rtt_ms``/``error``."""
+
+    result: Dict[str, Optional[object]] = {"ok": False, "rtt_ms": None, "error": None}
+    if returncode == 0:
+        result["ok"] = True
+        # Attempt to parse RTT from the output, which typically contains
+        # something like "time=23ms" or "time=23.4 ms". We search
+        # case‑insensitively for "time=".
+        match = re.search(r"time[=<]\s*(\d+\.?\d*)\s*ms", output, re.IGNORECASE)
+        if match:
+            result["rtt_ms"] = float(match.group(1))
+    else:
+        # Non‑zero return codes usually indicate timeouts or network
+        # unreachable errors. Provide stderr as error message.
+        result["error"] = output.strip() or f"ping вернул код {returncode}"
+    return result
+
+
+def split_host_port(host: str, default_port: int) -> Tuple[str, int]:
+    """Разделить ``host[:port]`` так же, как это делает ``http.client``."""
+
+    if host.startswith("["):
+        # IPv6 в квадратных скобках: [::1]:8080
+        addr, _, rest = host[1:].partition("]")
+        port = rest[1:] if rest.startswith(":") and rest[1:].isdigit() else ""
+        return addr, int(port) if port else default_port
+    if host.count(":") == 1:
+        name, port = host.split(":", 1)
+        if port.isdigit():
+            return name, int(port)
+    return host, default_port
+
+
+def timeout_result(kind: str) -> Dict[str, Optional[object]]:
+    """Результат проверки, снятой по дедлайну итерации, в форме её обычного ответа."""
+
+    if kind == "ip":
+        return {"ip": None, "error": "timeout", "timeout": True}
+    result: Dict[str, Optional[object]] = {"ok": False, "error": "timeout", "timeout": True}
+    if kind == "ping":
+        result["rtt_ms"] = None
+    elif kind == "dns":
+        result["addresses"] = None
+    else:
+        result["status"] = None
+    return result
+
+
 ###############################################################################
-# NetWatch implementation
+# Latency statistics
 ###############################################################################
 
 
-class NetWatch:
-    """Monitor network connectivity and write logs.
+class LatencyHistogram:
+    """Гистограмма задержек с логарифмическими корзинами и постоянной памятью.
 
-    This class encapsulates the state and behaviour of the network monitor.
+    Границы корзин растут геометрически (по умолчанию на 10 %) от
+    ``min_ms`` до ``max_ms``, поэтому перцентили считаются с относительной
+    ошибкой не больше шага корзины при любом числе замеров. Значения вне
+    диапазона попадают в крайние корзины; точные ``min``/``max`` хранятся
+    отдельно. Счётчики лежат в ``array`` (4 байта на корзину).
     """
 
-    def __init__(
-        self,
-        interval: float,
-        log_file: Path,
-        ping_targets: List[str],
-        service_endpoints: List[Tuple[str, str, str]],
-        throughput_enabled: bool,
-        plain_output: bool,
-        primary_host: str,
-        primary_path: str,
-        primary_scheme: str,
-        primary_method: str,
-        ping_timeout: float,
-        http_timeout: float,
-        status_file: Optional[Path],
-        logger: logging.Logger,
-    ) -> None:
-        self.interval = max(0.5, interval)
-        self.log_file = log_file
-        self.ping_targets = ping_targets
-        # service_endpoints: list of (domain, path, scheme) entries
-        self.service_endpoints = service_endpoints
-        self.throughput_enabled = throughput_enabled and psutil is not None
-        self.plain_output = plain_output
-        self.primary_host = primary_host
-        self.primary_path = primary_path if primary_path.startswith("/") else f"/{primary_path}"
-        self.primary_scheme = primary_scheme.lower() or "https"
-        self.primary_method = primary_method.upper()
-        self.ping_timeout = max(0.2, ping_timeout)
-        self.http_timeout = max(1.0, http_timeout)
-        self.status_file = status_file
-        self.logger = logger
-        self._ansi_enabled = False
+    def __init__(self, growth: float = 1.1, min_ms: float = 0.01, max_ms: float = 600000.0) -> None:
+        self.growth = growth
+        self.min_ms = min_ms
+        self._log_growth = math.log(growth)
+        self.size = int(math.ceil(math.log(max_ms / min_ms) / self._log_growth)) + 1
+        self.counts = array.array("I", [0]) * self.size
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
 
-        # Internal state for throughput computation
-        self._last_net_io: Optional[Tuple[int, int]] = None
-        # Track downtime intervals
-        self._downtime_start: Optional[datetime.datetime] = None
-        self._downtime_total: datetime.timedelta = datetime.timedelta()
-        self._started_at: datetime.datetime = datetime.datetime.now()
-        # Stop flag for the main loop
-        self._stop_event = threading.Event()
-        # Try to enable ANSI/VT sequences on Windows consoles for proper clearing
-        self._configure_console()
+    def _index(self, value: float) -> int:
+        if value <= self.min_ms:
+            return 0
+        return min(self.size - 1, int(math.log(value / self.min_ms) / self._log_growth) + 1)
 
-    # -------------------------------------------------------------------------
-    # State gathering helpers
-    # -------------------------------------------------------------------------
+    def upper_bound(self, index: int) -> float:
+        """Верхняя граница корзины ``index`` (мс)."""
 
-    def get_local_ip(self) -> Dict[str, Optional[str]]:
-        """Return a mapping with your outward‑facing IP address.
+        return self.min_ms * self.growth ** index
 
-        The method opens an unbound UDP socket and connects it to a public
-        resolver (8.8.8.8:80). The OS routing table determines which
-        interface and address will be used for this connection. No data is
-        actually sent over the network, but ``socket.getsockname`` returns
-        the local endpoint of the socket. If any error occurs, ``ip`` is
-        ``None`` and ``error`` will contain a human readable message.
-        """
+    def add(self, value: float) -> None:
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
 
-        result: Dict[str, Optional[str]] = {"ip": None, "error": None}
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            # The address below need not be reachable; it's only used to choose
-            # the correct outbound interface. See e.g. RFC 1122 for details.
-            sock.connect(("8.8.8.8", 80))
-            result["ip"] = sock.getsockname()[0]
-        except Exception as exc:
-            result["error"] = str(exc)
-        finally:
-            try:
-                sock.close()
-            except Exception:
-                pass
-        return result
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Добавить замеры другой гистограммы с той же сеткой корзин."""
 
-    def ping_host(self, host: str, timeout: Optional[float] = None) -> Dict[str, Optional[object]]:
-        """Ping an IPv4 host using the system ``ping`` command.
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
 
-        ICMP echo requests normally require elevated privileges to send raw
-        packets. To avoid requiring administrative rights, this function
-        delegates to the platform’s ``ping`` utility via ``subprocess``. On
-        Windows a single echo request is sent using ``ping -n 1 -w
-        timeout_ms``; on POSIX systems ``ping -c 1 -W timeout`` is used.
+    def reset(self) -> None:
+        self.counts = array.array("I", [0]) * self.size
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
 
-        Returns a dictionary with keys ``ok`` (bool), ``rtt_ms`` (float or
-        ``None``) and ``error`` (string or ``None``).
-        """
+    def percentile(self, q: float) -> Optional[float]:
+        """Оценка перцентиля ``q`` (0–100) по корзинам, ``None`` без данных."""
 
-        result: Dict[str, Optional[object]] = {
-            "ok": False,
-            "rtt_ms": None,
-            "error": None,
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * q / 100.0)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # Середина корзины в логарифмической шкале, в пределах min/max
+                estimate = self.upper_bound(index) / math.sqrt(self.growth) if index else self.min_ms
+                return round(min(max(estimate, self.min or estimate), self.max or estimate), 3)
+        return self.max
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """Сводка для отчёта/файла статуса."""
+
+        return {
+            "count": self.count,
+            "min": round(self.min, 3) if self.min is not None else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": round(self.max, 3) if self.max is not None else None,
+            "avg": round(self.total / self.count, 3) if self.count else None,
         }
-        timeout = self.ping_timeout if timeout is None else timeout
-        try:
-            if os.name == "nt":
-                # Windows: -n 1 sends one echo, -w expects timeout in ms
-                cmd = ["ping", "-n", "1", "-w", str(int(timeout * 1000)), host]
-            else:
-                # POSIX: -c 1 sends one packet, -W waits timeout seconds
-                cmd = ["ping", "-c", "1", "-W", str(int(timeout)), host]
-            proc = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="ignore")
-            output = proc.stdout + proc.stderr
-            if proc.returncode == 0:
-                result["ok"] = True
-                # Attempt to parse RTT from the output, which typically contains
-                # something like "time=23ms" or "time=23.4 ms". We search
-                # case‑insensitively for "time=".
-                import re
-
-                match = re.search(r"time[=<]\s*(\d+\.?\d*)\s*ms", output, re.IGNORECASE)
-                if match:
-                    result["rtt_ms"] = float(match.group(1))
-            else:
-                # Non‑zero return codes usually indicate timeouts or network
-                # unreachable errors. Provide stderr as error message.
-                result["error"] = output.strip() or f"ping вернул код {proc.returncode}"
-        except FileNotFoundError:
-            # If the ping utility is not available, we cannot perform the test.
-            result["error"] = "ping не найден"
-        except Exception as exc:
-            result["error"] = str(exc)
-        return result
 
-    def resolve_host(self, host: str) -> Dict[str, Optional[object]]:
-        """Разрешить домен через DNS.
 
-        Возвращает словарь ``ok`` (bool), ``addresses`` (list[str]) и
-        ``error``. Ошибка резолва фиксируется как ``ok=False``.
-        """
+class RollingLatency:
+    """Скользящие окна задержек (1 мин / 15 мин / 1 ч) и джиттер одной проверки.
 
-        result: Dict[str, Optional[object]] = {
-            "ok": False,
-            "addresses": None,
-            "error": None,
-        }
-        try:
-            infos = socket.getaddrinfo(host, 443, proto=socket.IPPROTO_TCP)
-            addresses = []
-            for info in infos:
-                addr = info[4][0]
-                if addr not in addresses:
-                    addresses.append(addr)
-            result["addresses"] = addresses
-            result["ok"] = bool(addresses)
-        except Exception as exc:
-            result["error"] = str(exc)
-        return result
+    Каждое окно — кольцо из нескольких гистограмм‑слотов фиксированной
+    длины; при переходе в новый слот самый старый обнуляется, а запрос
+    окна сливает актуальные слоты. Память на проверку постоянна (по
+    умолчанию 33 гистограммы с шагом корзин 25 %), поэтому так можно вести
+    тысячи целей. Джиттер — сглаженное среднее модуля разницы соседних
+    замеров, как в RFC 3550.
+    """
 
-    def check_primary_http(self) -> Dict[str, Optional[object]]:
-        """Проверить основной HTTP/HTTPS‑хост HEAD/GET запросом."""
+    # имя окна → (длина окна, число слотов)
+    WINDOWS: Tuple[Tuple[str, float, int], ...] = (("1m", 60.0, 6), ("15m", 900.0, 15), ("1h", 3600.0, 12))
+    GROWTH = 1.25
 
-        result: Dict[str, Optional[object]] = {
-            "ok": False,
-            "status": None,
-            "error": None,
-        }
-        conn: Optional[http.client.HTTPConnection] = None
-        try:
-            cls = http.client.HTTPSConnection if self.primary_scheme == "https" else http.client.HTTPConnection
-            conn = cls(self.primary_host, timeout=self.http_timeout)
-            conn.request(self.primary_method, self.primary_path)
-            resp = conn.getresponse()
-            result["status"] = resp.status
-            # Любой ответ от сервера значит, что соединение и TLS установились
-            result["ok"] = True
-        except Exception as exc:
-            result["error"] = str(exc)
-        finally:
-            try:
-                if conn is not None:
-                    conn.close()
-            except Exception:
-                pass
-        return result
+    def __init__(self) -> None:
+        self._rings: Dict[str, Tuple[float, List[LatencyHistogram], List[int]]] = {}
+        for name, length, slots in self.WINDOWS:
+            hists = [LatencyHistogram(growth=self.GROWTH) for _ in range(slots)]
+            self._rings[name] = (length / slots, hists, [-1] * slots)
+        self.jitter_ms: Optional[float] = None
+        self._last: Optional[float] = None
 
-    def check_service(self, host: str, path: str, scheme: str) -> Dict[str, Optional[object]]:
-        """Check a given HTTP/HTTPS endpoint for network reachability.
+    def add(self, value: float, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        for slot_len, hists, epochs in self._rings.values():
+            epoch = int(now // slot_len)
+            index = epoch % len(hists)
+            if epochs[index] != epoch:
+                hists[index].reset()
+                epochs[index] = epoch
+            hists[index].add(value)
+        if self._last is not None:
+            delta = abs(value - self._last)
+            self.jitter_ms = delta if self.jitter_ms is None else self.jitter_ms + (delta - self.jitter_ms) / 16.0
+        self._last = value
 
-        The function performs a GET request to the specified host and path.
-        A response status of 204 (No Content) or 200 is treated as
-        success. These endpoints are commonly used by operating systems
-        and browsers to detect captive portals: if the request is
-        redirected to a login page or times out, ``ok`` will be False.
-        See for example the connectivity test URLs documented in May 2025
-        by Anton Zhiyanov【971457281900871†L14-L31】.
+    def window(self, name: str, now: Optional[float] = None) -> LatencyHistogram:
+        """Слить слоты окна ``name`` в одну гистограмму."""
 
-        :param host: Domain name to contact, e.g. ``google.com``.
-        :param path: URL path to request, e.g. ``/generate_204``.
-        :param scheme: Either ``http`` or ``https``.
-        :returns: dict with ``ok`` (bool), ``status`` (int or None) and
-                  ``error`` (str or None).
-        """
+        now = time.monotonic() if now is None else now
+        slot_len, hists, epochs = self._rings[name]
+        current = int(now // slot_len)
+        merged = LatencyHistogram(growth=self.GROWTH)
+        for hist, epoch in zip(hists, epochs):
+            if epoch >= 0 and current - epoch < len(hists):
+                merged.merge(hist)
+        return merged
 
-        result: Dict[str, Optional[object]] = {
-            "ok": False,
-            "status": None,
-            "error": None,
-        }
-        conn: Optional[http.client.HTTPConnection] = None
-        try:
-            cls = http.client.HTTPSConnection if scheme.lower() == "https" else http.client.HTTPConnection
-            conn = cls(host, timeout=5.0)
-            conn.request("GET", path)
-            resp = conn.getresponse()
-            result["status"] = resp.status
-            # For captive portal detection endpoints we accept 200 and 204
-            if resp.status in (200, 204):
-                result["ok"] = True
-        except Exception as exc:
-            result["error"] = str(exc)
-        finally:
-            try:
-                if conn is not None:
-                    conn.close()
-            except Exception:
-                pass
+    def summary(self, now: Optional[float] = None) -> Dict[str, object]:
+        """p50/p95/p99, min/max по каждому окну и текущий джиттер."""
+
+        result: Dict[str, object] = {}
+        for name, _length, _slots in self.WINDOWS:
+            stats = self.window(name, now).summary()
+            result[name] = {key: stats[key] for key in ("count", "min", "p50", "p95", "p99", "max")}
+        result["jitter_ms"] = round(self.jitter_ms, 3) if self.jitter_ms is not None else None
         return result
 
-    def measure_throughput(self) -> Dict[str, Optional[float]]:
-        """Measure aggregate bytes per second in and out.
 
-        Utilises the ``psutil`` library to read cumulative counters for
-        all network interfaces. The difference between successive calls
-        divided by the monitoring interval yields a bytes‑per‑second
-        estimate. If throughput monitoring is disabled or ``psutil`` is
-        missing, both values will be ``None``.
-        """
+###############################################################################
+# In-process ICMP echo
+###############################################################################
 
-        if not self.throughput_enabled or psutil is None:
-            return {"in_bps": None, "out_bps": None}
-        io = psutil.net_io_counters()
-        sent = io.bytes_sent
-        recv = io.bytes_recv
-        if self._last_net_io is None:
-            self._last_net_io = (sent, recv)
-            return {"in_bps": None, "out_bps": None}
-        last_sent, last_recv = self._last_net_io
-        self._last_net_io = (sent, recv)
-        # Compute per second rates based on configured interval
-        in_bps = (recv - last_recv) / self.interval
-        out_bps = (sent - last_sent) / self.interval
-        return {"in_bps": max(in_bps, 0.0), "out_bps": max(out_bps, 0.0)}
 
-    def _update_downtime(self, summary: str, now_dt: datetime.datetime) -> datetime.timedelta:
-        """Зафиксировать длительность простоя/аптайма и вернуть накопленный простой."""
+def icmp_checksum(data: bytes) -> int:
+    """Контрольная сумма Интернета (RFC 1071) для ICMP‑пакета."""
 
-        is_up = summary.startswith(("OK", "ОК", "Интернет"))
-        if not is_up:
-            if self._downtime_start is None:
-                self._downtime_start = now_dt
-        else:
-            if self._downtime_start is not None:
-                duration = now_dt - self._downtime_start
-                self._downtime_total += duration
-                human_duration = str(duration).split(".")[0]
-                self._write_log(f"DOWNTIME {human_duration}")
-                self._downtime_start = None
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
 
-        if self._downtime_start is not None:
-            return self._downtime_total + (now_dt - self._downtime_start)
-        return self._downtime_total
 
-    def _log_inline_error(self, message: object) -> None:
-        """Записать ошибку в текущий лог, не прерывая работу."""
+class IcmpProber:
+    """ICMP echo без запуска ``ping``: один сокет на все цели.
 
-        self._write_log(f"{message}", level="ERROR")
+    Сначала пробуется непривилегированный Linux‑сокет
+    ``SOCK_DGRAM``/``IPPROTO_ICMP`` (нужен ``net.ipv4.ping_group_range``),
+    затем ``SOCK_RAW`` (root или ``CAP_NET_RAW``). Если ни один не открылся,
+    :meth:`create` возвращает ``None`` и монитор остаётся на системном
+    ``ping``. Запросы ко всем целям отправляются сразу, ответы собираются
+    через ``selectors`` (epoll на Linux) до общего таймаута. Результат по
+    каждой цели — тот же словарь ``ok``/``rtt_ms``/``error``, что и у
+    :meth:`NetWatch.ping_host`.
+    """
 
-    def _write_status_file(self, state: Dict[str, object]) -> None:
-        """Сохранить последний статус в JSON (для внешнего мониторинга)."""
+    ECHO_REQUEST = 8
+    ECHO_REPLY = 0
 
-        if not self.status_file:
-            return
-        try:
-            self.status_file.parent.mkdir(parents=True, exist_ok=True)
-            with self.status_file.open("w", encoding="utf-8") as fh:
-                json.dump(state, fh, ensure_ascii=False, indent=2)
-        except Exception as exc:
-            # Не шумим в консоли, только тихий лог
-            self.logger.debug("Не удалось записать файл статуса: %s", exc, exc_info=False)
+    def __init__(self, sock: socket.socket, kind: str) -> None:
+        self.kind = kind  # "dgram" или "raw"
+        self._sock = sock
+        self._sock.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        # Для dgram‑сокета ядро само подставляет идентификатор (порт сокета)
+        # и отдаёт нам только свои ответы; для raw фильтруем по ident.
+        self._ident = random.randrange(1, 0xFFFF)
+        self._seq = itertools.count(random.randrange(0, 0xFFFF))
+        self._lock = threading.Lock()
 
-    def _write_log(self, message: str, level: str = "INFO") -> None:
-        """Единый формат логов, совпадающий с исходным netwatch.cpp."""
+    @classmethod
+    def create(cls) -> Optional["IcmpProber"]:
+        """Открыть лучший доступный ICMP‑сокет или вернуть ``None``."""
+
+        for kind, sock_type in (("dgram", socket.SOCK_DGRAM), ("raw", socket.SOCK_RAW)):
+            try:
+                sock = socket.socket(socket.AF_INET, sock_type, socket.IPPROTO_ICMP)
+            except (OSError, AttributeError):
+                continue
+            return cls(sock, kind)
+        return None
+
+    def close(self) -> None:
+        """Закрыть сокет и селектор."""
 
-        ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        line = f"{ts} | {level.upper():<5} | {message}\n"
         try:
-            with self.log_file.open("a", encoding="utf-8") as fh:
-                fh.write(line)
-        except Exception:
-            pass
+            self._selector.close()
+        finally:
+            self._sock.close()
 
-    def _configure_console(self) -> None:
-        """Включить ANSI при возможности и подготовить функции очистки."""
+    def _build_request(self, seq: int) -> bytes:
+        payload = struct.pack("!d", time.time()) + b"netwatch"
+        header = struct.pack("!BBHHH", self.ECHO_REQUEST, 0, 0, self._ident, seq)
+        checksum = icmp_checksum(header + payload)
+        return struct.pack("!BBHHH", self.ECHO_REQUEST, 0, checksum, self._ident, seq) + payload
 
-        if self.plain_output:
-            self._ansi_enabled = False
-            return
-        if sys.stdout.isatty() and enable_windows_ansi():
-            self._ansi_enabled = True
-        else:
-            self._ansi_enabled = False
+    def _parse_reply(self, data: bytes) -> Optional[int]:
+        """Вернуть sequence эхо‑ответа или ``None`` для чужих пакетов."""
 
-    def _clear_screen(self) -> None:
-        """Очистить экран, учитывая поддержку ANSI."""
+        if self.kind == "raw":
+            # Raw‑сокет отдаёт пакет вместе с IPv4‑заголовком
+            if not data:
+                return None
+            data = data[(data[0] & 0x0F) * 4 :]
+        if len(data) < 8:
+            return None
+        icmp_type, _code, _checksum, ident, seq = struct.unpack("!BBHHH", data[:8])
+        if icmp_type != self.ECHO_REPLY:
+            return None
+        if self.kind == "raw" and ident != self._ident:
+            return None
+        return seq
 
-        if self.plain_output:
-            return
-        if self._ansi_enabled:
-            sys.stdout.write("\x1b[2J\x1b[H")
-            return
-        # Fallback: системная команда очистки, чтобы не печатать коды в логи
-        try:
-            if os.name == "nt":
+    def ping_many(self, hosts: List[str], timeout: float) -> Dict[str, Dict[str, Optional[object]]]:
+        """Отправить по одному эхо‑запросу каждой цели и дождаться ответов."""
+
+        results: Dict[str, Dict[str, Optional[object]]] = {
+            host: {"ok": False, "rtt_ms": None, "error": None} for host in hosts
+        }
+        with self._lock:
+            # Ответы, опоздавшие с прошлой итерации, не должны сбить сопоставление
+            self._drain(None)
+            pending: Dict[int, Tuple[str, float]] = {}
+            for host in hosts:
+                try:
+                    addr = socket.getaddrinfo(host, None, socket.AF_INET)[0][4][0]
+                except Exception as exc:
+                    results[host]["error"] = str(exc)
+                    continue
+                seq = next(self._seq) & 0xFFFF
+                try:
+                    self._sock.sendto(self._build_request(seq), (addr, 0))
+                except OSError as exc:
+                    results[host]["error"] = str(exc)
+                    continue
+                pending[seq] = (host, time.perf_counter())
+            deadline = time.monotonic() + timeout
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._selector.select(remaining):
+                    break
+                self._drain(pending, results)
+            for host, _sent in pending.values():
+                results[host]["error"] = "тайм-аут"
+        return results
+
+    def _drain(
+        self,
+        pending: Optional[Dict[int, Tuple[str, float]]],
+        results: Optional[Dict[str, Dict[str, Optional[object]]]] = None,
+    ) -> None:
+        """Вычитать все готовые пакеты, отмечая ответы из ``pending``."""
+
+        while True:
+            try:
+                data, _addr = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # ICMP‑ошибки (например, unreachable) на dgram‑сокете
+                continue
+            received = time.perf_counter()
+            if pending is None or results is None:
+                continue
+            seq = self._parse_reply(data)
+            entry = pending.pop(seq, None) if seq is not None else None
+            if entry is None:
+                continue
+            host, sent = entry
+            results[host]["ok"] = True
+            results[host]["rtt_ms"] = round((received - sent) * 1000.0, 3)
+
+
+###############################################################################
+# Direct DNS probing
+###############################################################################
+
+
+DNS_TYPE_A = 1
+DNS_TYPE_AAAA = 28
+DNS_RCODES = {0: "NOERROR", 1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP", 5: "REFUSED"}
+
+
+def system_nameservers(path: Path = Path("/etc/resolv.conf")) -> List[str]:
+    """Адреса ``nameserver`` из resolv.conf (пустой список, если файла нет)."""
+
+    servers: List[str] = []
+    try:
+        with path.open("r", encoding="utf-8", errors="ignore") as fh:
+            for line in fh:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    servers.append(parts[1].split("%", 1)[0])
+    except OSError:
+        pass
+    return servers
+
+
+def dns_query(qid: int, name: str, qtype: int) -> bytes:
+    """Собрать DNS‑запрос (RD=1) одного вопроса класса IN."""
+
+    labels = [label for label in name.rstrip(".").encode("idna").split(b".") if label]
+    qname = b"".join(bytes([len(label)]) + label for label in labels) + b"\x00"
+    return struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack("!HH", qtype, 1)
+
+
+def _skip_dns_name(data: bytes, offset: int) -> int:
+    """Пропустить имя (с учётом сжатия) и вернуть смещение за ним."""
+
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+
+def parse_dns_response(data: bytes) -> Tuple[int, int, bool, List[str]]:
+    """Разобрать ответ: ``(id, rcode, усечён ли (TC), адреса A/AAAA)``.
+
+    Для повреждённого пакета поднимает ``ValueError``.
+    """
+
+    try:
+        qid, flags, qdcount, ancount, _ns, _ar = struct.unpack("!HHHHHH", data[:12])
+        if not flags & 0x8000:
+            raise ValueError("не ответ DNS")
+        offset = 12
+        for _ in range(qdcount):
+            offset = _skip_dns_name(data, offset) + 4
+        addresses: List[str] = []
+        for _ in range(ancount):
+            offset = _skip_dns_name(data, offset)
+            rtype, _rclass, _ttl, rdlength = struct.unpack("!HHIH", data[offset : offset + 10])
+            offset += 10
+            rdata = data[offset : offset + rdlength]
+            offset += rdlength
+            if rtype == DNS_TYPE_A and rdlength == 4:
+                addresses.append(socket.inet_ntop(socket.AF_INET, rdata))
+            elif rtype == DNS_TYPE_AAAA and rdlength == 16:
+                addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+    except (IndexError, struct.error) as exc:
+        raise ValueError(f"повреждённый ответ DNS: {exc}") from exc
+    return qid, flags & 0x000F, bool(flags & 0x0200), addresses
+
+
+class DnsProber:
+    """Минимальный DNS‑клиент для проверки нескольких резолверов сразу.
+
+    Для каждого резолвера из ``--dns-resolvers`` (``system`` — первый
+    ``nameserver`` из resolv.conf, иначе ``addr[:port]``) отправляются
+    запросы A и AAAA через неблокирующие UDP‑сокеты; ответы собираются через
+    ``selectors`` до общего таймаута, так что медленный резолвер не задерживает
+    остальные. Усечённый (TC) ответ повторяется по TCP в пределах того же
+    таймаута. По каждому резолверу возвращаются ``ok``, ``rtt_ms`` (до
+    ответа на оба запроса), ``rcode``, ``addresses``, ``transport`` и ``error``.
+    """
+
+    QTYPES = (DNS_TYPE_A, DNS_TYPE_AAAA)
+
+    def __init__(self, resolvers: Iterable[str]) -> None:
+        self.resolvers: List[Tuple[str, Optional[Tuple[str, int]]]] = []
+        for entry in resolvers:
+            if entry == "system":
+                servers = system_nameservers()
+                self.resolvers.append((entry, (servers[0], 53) if servers else None))
+            else:
+                self.resolvers.append((entry, split_host_port(entry, 53)))
+
+    def resolve(self, host: str, timeout: float) -> Dict[str, Dict[str, Optional[object]]]:
+        """Опросить все резолверы параллельно и вернуть результат по каждому."""
+
+        results: Dict[str, Dict[str, Optional[object]]] = {}
+        selector = selectors.DefaultSelector()
+        # (резолвер, id запроса) → (тип запроса, время отправки, запрос)
+        pending: Dict[Tuple[str, int], Tuple[int, float, bytes]] = {}
+        # Повторы по TCP идут в своих потоках, не задерживая чтение UDP
+        fallbacks: List[Tuple[str, float, threading.Thread, List[object]]] = []
+        sockets: List[socket.socket] = []
+        deadline = time.monotonic() + timeout
+        try:
+            for label, address in self.resolvers:
+                res: Dict[str, Optional[object]] = {
+                    "ok": False, "rtt_ms": None, "rcode": None, "addresses": [], "transport": "udp", "error": None,
+                }
+                results[label] = res
+                if address is None:
+                    res["error"] = "nameserver не найден в resolv.conf"
+                    continue
+                try:
+                    family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+                    sock = socket.socket(family, socket.SOCK_DGRAM)
+                    sockets.append(sock)
+                    sock.setblocking(False)
+                    # connect(): чужие датаграммы отсекает ядро, ICMP unreachable виден как ошибка
+                    sock.connect(address)
+                    selector.register(sock, selectors.EVENT_READ, label)
+                    for qtype in self.QTYPES:
+                        qid = random.randrange(0, 0x10000)
+                        query = dns_query(qid, host, qtype)
+                        sock.send(query)
+                        pending[(label, qid)] = (qtype, time.perf_counter(), query)
+                except (OSError, UnicodeError) as exc:
+                    res["error"] = str(exc)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _mask in selector.select(remaining):
+                    self._read(key.fileobj, key.data, pending, fallbacks, deadline, results)  # type: ignore[arg-type]
+            for label, sent, thread, outcome in fallbacks:
+                thread.join(max(0.0, deadline - time.monotonic()))
+                if not outcome:
+                    results[label]["error"] = "тайм-аут (TCP)"
+                elif isinstance(outcome[0], Exception):
+                    results[label]["error"] = f"TCP: {outcome[0]}"
+                else:
+                    rcode, addresses, received = outcome  # type: ignore[misc]
+                    self._record(results[label], rcode, addresses, received - sent, "tcp")  # type: ignore[arg-type]
+            for (label, _qid) in pending:
+                res = results[label]
+                if res["error"] is None and not res["addresses"]:
+                    res["error"] = "тайм-аут"
+        finally:
+            selector.close()
+            for sock in sockets:
+                sock.close()
+        for res in results.values():
+            res["ok"] = res["rcode"] == "NOERROR" and bool(res["addresses"])
+            if not res["ok"] and res["error"] is None:
+                res["error"] = res["rcode"] if res["rcode"] and res["rcode"] != "NOERROR" else "нет адресов"
+        return results
+
+    @staticmethod
+    def _record(
+        res: Dict[str, Optional[object]], rcode: int, addresses: List[str], elapsed: float, transport: str
+    ) -> None:
+        rtt = round(elapsed * 1000.0, 3)
+        res["rtt_ms"] = max(rtt, res["rtt_ms"] or 0.0)  # type: ignore[type-var]
+        name = DNS_RCODES.get(rcode, str(rcode))
+        # Значимее код ошибки любого из двух ответов
+        if res["rcode"] in (None, "NOERROR"):
+            res["rcode"] = name
+        known = res["addresses"]
+        assert isinstance(known, list)
+        known.extend(addr for addr in addresses if addr not in known)
+        res["transport"] = transport
+
+    def _read(
+        self,
+        sock: socket.socket,
+        label: str,
+        pending: Dict[Tuple[str, int], Tuple[int, float, bytes]],
+        fallbacks: List[Tuple[str, float, threading.Thread, List[object]]],
+        deadline: float,
+        results: Dict[str, Dict[str, Optional[object]]],
+    ) -> None:
+        while True:
+            try:
+                data = sock.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                # Например, ICMP port unreachable: резолвер не слушает
+                results[label]["error"] = str(exc)
+                for key in [key for key in pending if key[0] == label]:
+                    del pending[key]
+                return
+            try:
+                qid, rcode, tc, addresses = parse_dns_response(data)
+            except ValueError:
+                continue
+            entry = pending.pop((label, qid), None)
+            if entry is None:
+                continue
+            _qtype, sent, query = entry
+            if tc:
+                outcome: List[object] = []
+                thread = threading.Thread(
+                    target=self._query_tcp,
+                    args=(sock.getpeername()[:2], query, deadline, outcome),
+                    name="netwatch-dns-tcp",
+                    daemon=True,
+                )
+                thread.start()
+                fallbacks.append((label, sent, thread, outcome))
+                continue
+            self._record(results[label], rcode, addresses, time.perf_counter() - sent, "udp")
+
+    @staticmethod
+    def _query_tcp(address: Tuple[str, int], query: bytes, deadline: float, outcome: List[object]) -> None:
+        """Повторить усечённый запрос по TCP (длина сообщения — 2 байта впереди).
+
+        В ``outcome`` кладётся ``(rcode, адреса, время ответа)`` или исключение.
+        """
+
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("тайм-аут")
+            with socket.create_connection(address, timeout=remaining) as conn:
+                conn.sendall(struct.pack("!H", len(query)) + query)
+                data = b""
+                while len(data) < 2 or len(data) < 2 + struct.unpack("!H", data[:2])[0]:
+                    chunk = conn.recv(65535)
+                    if not chunk:
+                        raise ConnectionError("соединение закрыто")
+                    data += chunk
+            received = time.perf_counter()
+            _qid, rcode, _tc, addresses = parse_dns_response(data[2:])
+            outcome.extend((rcode, addresses, received))
+        except (OSError, ValueError) as exc:
+            outcome.append(exc)
+
+
+###############################################################################
+# Link and route events (Linux netlink)
+###############################################################################
+
+
+class LinkMonitor:
+    """Слушатель событий rtnetlink: состояние линков, адресов и маршрута по умолчанию.
+
+    Сокет ``AF_NETLINK``/``NETLINK_ROUTE`` подписан на группы
+    ``RTMGRP_LINK``, ``RTMGRP_IPV4_IFADDR`` и ``RTMGRP_IPV4_ROUTE``; при
+    старте состояние линков снимается дампом ``RTM_GETLINK``, дальше
+    обновляется по событиям. Значимое изменение (линк поднялся/упал, адрес
+    или маршрут по умолчанию добавлен/удалён) увеличивает ``generation`` и
+    вызывает ``on_change(описание)`` из фонового потока. Повторные
+    ``RTM_NEWLINK`` без смены флагов изменением не считаются. Вне Linux
+    :meth:`create` возвращает ``None``.
+    """
+
+    RTMGRP_LINK = 0x1
+    RTMGRP_IPV4_IFADDR = 0x10
+    RTMGRP_IPV4_ROUTE = 0x40
+    RTM_NEWLINK, RTM_DELLINK, RTM_GETLINK = 16, 17, 18
+    RTM_NEWADDR, RTM_DELADDR = 20, 21
+    RTM_NEWROUTE, RTM_DELROUTE = 24, 25
+    NLMSG_DONE = 3
+    IFLA_IFNAME = 3
+    IFA_ADDRESS, IFA_LOCAL = 1, 2
+    RTA_OIF, RTA_GATEWAY = 4, 5
+    RT_TABLE_MAIN = 254
+    IFF_LOOPBACK = 0x8
+    IFF_LOWER_UP = 0x10000
+    IFF_UP = 0x1
+
+    def __init__(self, sock: socket.socket, on_change: Callable[[str], None]) -> None:
+        self._sock = sock
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        # index → (имя, поднят ли, loopback)
+        self.links: Dict[int, Tuple[str, bool, bool]] = {}
+        # Линки, бывшие поднятыми за время работы: выключенные изначально
+        # (например, ifb0) упавшими не считаются
+        self._seen_up: set = set()
+        self.generation = 0
+        self.events = 0
+        self.last_event: Optional[str] = None
+        self.last_event_at: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def create(cls, on_change: Callable[[str], None]) -> Optional["LinkMonitor"]:
+        """Открыть netlink‑сокет или вернуть ``None`` (не Linux, нет прав)."""
+
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, cls.RTMGRP_LINK | cls.RTMGRP_IPV4_IFADDR | cls.RTMGRP_IPV4_ROUTE))
+        except (OSError, AttributeError):
+            return None
+        monitor = cls(sock, on_change)
+        monitor._dump_links()
+        return monitor
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="netwatch-netlink", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self._sock.close()
+
+    def snapshot(self) -> Dict[str, object]:
+        """Сводка для состояния: упавшие линки и последнее событие."""
+
+        with self._lock:
+            down = sorted(
+                name for index, (name, up, loopback) in self.links.items()
+                if not up and not loopback and index in self._seen_up
+            )
+            return {
+                "down": down,
+                "events": self.events,
+                "last_event": self.last_event,
+                "last_event_at": self.last_event_at,
+            }
+
+    def _dump_links(self) -> None:
+        """Снять начальное состояние линков запросом ``RTM_GETLINK`` с ``NLM_F_DUMP``."""
+
+        try:
+            with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE) as sock:
+                sock.settimeout(2.0)
+                # NLM_F_REQUEST | NLM_F_DUMP; тело — пустой ifinfomsg
+                request = struct.pack("=IHHII", 32, self.RTM_GETLINK, 0x301, 1, 0) + struct.pack("=BxHiII", 0, 0, 0, 0, 0)
+                sock.send(request)
+                done = False
+                while not done:
+                    data = sock.recv(65536)
+                    if not data:
+                        break
+                    for msg_type, payload in self._messages(data):
+                        if msg_type == self.NLMSG_DONE:
+                            done = True
+                        elif msg_type == self.RTM_NEWLINK:
+                            self._handle_link(msg_type, payload)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _messages(data: bytes) -> Iterator[Tuple[int, bytes]]:
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msg_type, _flags, _seq, _pid = struct.unpack_from("=IHHII", data, offset)
+            if length < 16:
+                return
+            yield msg_type, data[offset + 16 : offset + length]
+            offset += (length + 3) & ~3
+
+    @staticmethod
+    def _attributes(data: bytes, offset: int) -> Dict[int, bytes]:
+        attrs: Dict[int, bytes] = {}
+        while offset + 4 <= len(data):
+            length, attr_type = struct.unpack_from("=HH", data, offset)
+            if length < 4:
+                break
+            attrs[attr_type] = data[offset + 4 : offset + length]
+            offset += (length + 3) & ~3
+        return attrs
+
+    def _link_name(self, index: int) -> str:
+        entry = self.links.get(index)
+        return entry[0] if entry else f"if{index}"
+
+    def _handle_link(self, msg_type: int, payload: bytes) -> Optional[str]:
+        _family, _type, index, flags, _change = struct.unpack_from("=BxHiII", payload)
+        name_raw = self._attributes(payload, 16).get(self.IFLA_IFNAME, b"")
+        name = name_raw.split(b"\x00", 1)[0].decode("utf-8", "replace") or self._link_name(index)
+        up = bool(flags & self.IFF_UP) and bool(flags & self.IFF_LOWER_UP)
+        loopback = bool(flags & self.IFF_LOOPBACK)
+        with self._lock:
+            previous = self.links.get(index)
+            if msg_type == self.RTM_DELLINK:
+                self.links.pop(index, None)
+                self._seen_up.discard(index)
+                return f"линк {name} удалён"
+            self.links[index] = (name, up, loopback)
+            if up:
+                self._seen_up.add(index)
+        if previous is not None and previous[1] == up:
+            return None
+        return f"линк {name} {'up' if up else 'down'}"
+
+    def _handle_addr(self, msg_type: int, payload: bytes) -> Optional[str]:
+        family, _prefix, _flags, _scope, index = struct.unpack_from("=BBBBI", payload)
+        attrs = self._attributes(payload, 8)
+        raw = attrs.get(self.IFA_LOCAL) or attrs.get(self.IFA_ADDRESS)
+        if family != socket.AF_INET or raw is None or len(raw) != 4:
+            return None
+        action = "добавлен" if msg_type == self.RTM_NEWADDR else "удалён"
+        return f"адрес {socket.inet_ntoa(raw)} ({self._link_name(index)}) {action}"
+
+    def _handle_route(self, msg_type: int, payload: bytes) -> Optional[str]:
+        _family, dst_len, _src, _tos, table, _proto, _scope, _rtype, _flags = struct.unpack_from("=BBBBBBBBI", payload)
+        # Интересен только маршрут по умолчанию основной таблицы
+        if dst_len != 0 or table != self.RT_TABLE_MAIN:
+            return None
+        attrs = self._attributes(payload, 12)
+        text = "маршрут по умолчанию"
+        if self.RTA_GATEWAY in attrs and len(attrs[self.RTA_GATEWAY]) == 4:
+            text += f" via {socket.inet_ntoa(attrs[self.RTA_GATEWAY])}"
+        if self.RTA_OIF in attrs:
+            text += f" dev {self._link_name(struct.unpack('=I', attrs[self.RTA_OIF][:4])[0])}"
+        return f"{text} {'добавлен' if msg_type == self.RTM_NEWROUTE else 'удалён'}"
+
+    def feed(self, data: bytes) -> List[str]:
+        """Разобрать пачку netlink‑сообщений и вернуть значимые изменения."""
+
+        changes: List[str] = []
+        for msg_type, payload in self._messages(data):
+            try:
+                if msg_type in (self.RTM_NEWLINK, self.RTM_DELLINK):
+                    change = self._handle_link(msg_type, payload)
+                elif msg_type in (self.RTM_NEWADDR, self.RTM_DELADDR):
+                    change = self._handle_addr(msg_type, payload)
+                elif msg_type in (self.RTM_NEWROUTE, self.RTM_DELROUTE):
+                    change = self._handle_route(msg_type, payload)
+                else:
+                    change = None
+            except struct.error:
+                continue
+            if change is not None:
+                changes.append(change)
+        if changes:
+            with self._lock:
+                self.generation += 1
+                self.events += len(changes)
+                self.last_event = changes[-1]
+                self.last_event_at = datetime.datetime.now().isoformat(timespec="milliseconds")
+        return changes
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                ready, _w, _x = select.select([self._sock], [], [], 0.5)
+                if not ready:
+                    continue
+                data = self._sock.recv(65536)
+            except OSError:
+                if self._stop.is_set():
+                    return
+                # ENOBUFS: часть событий потеряна — считаем это изменением
+                with self._lock:
+                    self.generation += 1
+                self._on_change("буфер netlink переполнен")
+                continue
+            changes = self.feed(data)
+            if changes:
+                self._on_change("; ".join(changes))
+
+
+###############################################################################
+# Traffic sampler
+###############################################################################
+
+
+def read_proc_net_dev(path: Path = Path("/proc/net/dev")) -> Optional[Dict[str, Tuple[int, int]]]:
+    """Счётчики ``(принято, отправлено)`` байт по интерфейсам из /proc/net/dev."""
+
+    try:
+        with path.open("r", encoding="ascii", errors="ignore") as fh:
+            lines = fh.readlines()[2:]
+    except OSError:
+        return None
+    counters: Dict[str, Tuple[int, int]] = {}
+    for line in lines:
+        name, sep, rest = line.partition(":")
+        fields = rest.split()
+        if not sep or len(fields) < 9:
+            continue
+        counters[name.strip()] = (int(fields[0]), int(fields[8]))
+    return counters
+
+
+def nic_counters() -> Optional[Dict[str, Tuple[int, int]]]:
+    """Счётчики по интерфейсам: ``psutil`` (``pernic``), иначе /proc/net/dev."""
+
+    if psutil is not None:
+        try:
+            return {name: (io.bytes_recv, io.bytes_sent) for name, io in psutil.net_io_counters(pernic=True).items()}
+        except Exception:
+            pass
+    return read_proc_net_dev()
+
+
+class ThroughputSampler:
+    """Фоновый замер трафика по интерфейсам с частотой ``period``.
+
+    Скорость считается по монотонным меткам времени между соседними
+    чтениями счётчиков, поэтому медленная итерация монитора её не искажает.
+    По каждому интерфейсу хранятся мгновенная скорость, EWMA с постоянной
+    времени ``tau`` и пик с момента запуска. Сброс счётчика (перезапуск
+    интерфейса) пропускается. :meth:`snapshot` возвращает суммарную среднюю
+    скорость с прошлого снимка (``in_bps``/``out_bps``) и ``interfaces``.
+    """
+
+    def __init__(self, period: float = 0.5, tau: float = 5.0) -> None:
+        self.period = max(0.05, period)
+        self.tau = max(self.period, tau)
+        self._lock = threading.Lock()
+        self._last: Dict[str, Tuple[int, int]] = {}
+        self._last_at: Optional[float] = None
+        # интерфейс → [in, out, ewma_in, ewma_out, peak_in, peak_out]
+        self._rates: Dict[str, List[float]] = {}
+        # Накопленные байты (вход, выход) и время прошлого снимка
+        self._totals = [0, 0]
+        self._snapshot_totals = (0, 0)
+        self._snapshot_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self.sample()
+            self._thread = threading.Thread(target=self._loop, name="netwatch-throughput", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.period):
+            self.sample()
+
+    def sample(self) -> None:
+        """Прочитать счётчики и обновить скорости."""
+
+        counters = nic_counters()
+        now = time.monotonic()
+        if counters is None:
+            return
+        with self._lock:
+            elapsed = now - self._last_at if self._last_at is not None else None
+            alpha = 1.0 - math.exp(-elapsed / self.tau) if elapsed else None
+            for name, (recv, sent) in counters.items():
+                previous = self._last.get(name)
+                if previous is None or elapsed is None or elapsed <= 0:
+                    continue
+                d_in, d_out = recv - previous[0], sent - previous[1]
+                if d_in < 0 or d_out < 0:
+                    continue
+                self._totals[0] += d_in
+                self._totals[1] += d_out
+                rate_in, rate_out = d_in / elapsed, d_out / elapsed
+                rates = self._rates.get(name)
+                if rates is None:
+                    self._rates[name] = [rate_in, rate_out, rate_in, rate_out, rate_in, rate_out]
+                    continue
+                rates[0], rates[1] = rate_in, rate_out
+                rates[2] += alpha * (rate_in - rates[2])  # type: ignore[operator]
+                rates[3] += alpha * (rate_out - rates[3])  # type: ignore[operator]
+                rates[4] = max(rates[4], rate_in)
+                rates[5] = max(rates[5], rate_out)
+            self._last = counters
+            self._last_at = now
+            # Исчезнувшие интерфейсы больше не показываем
+            for name in [name for name in self._rates if name not in counters]:
+                del self._rates[name]
+
+    def snapshot(self) -> Dict[str, object]:
+        """Суммарная скорость с прошлого снимка и сводка по интерфейсам."""
+
+        if not self.running:
+            self.sample()
+        with self._lock:
+            now = time.monotonic()
+            totals = (self._totals[0], self._totals[1])
+            in_bps: Optional[float] = None
+            out_bps: Optional[float] = None
+            if self._snapshot_at is not None and now > self._snapshot_at:
+                elapsed = now - self._snapshot_at
+                in_bps = (totals[0] - self._snapshot_totals[0]) / elapsed
+                out_bps = (totals[1] - self._snapshot_totals[1]) / elapsed
+            self._snapshot_totals = totals
+            self._snapshot_at = now
+            interfaces = {
+                name: {
+                    "in_bps": round(rates[0], 1),
+                    "out_bps": round(rates[1], 1),
+                    "ewma_in_bps": round(rates[2], 1),
+                    "ewma_out_bps": round(rates[3], 1),
+                    "peak_in_bps": round(rates[4], 1),
+                    "peak_out_bps": round(rates[5], 1),
+                }
+                for name, rates in sorted(self._rates.items())
+            }
+        return {"in_bps": in_bps, "out_bps": out_bps, "interfaces": interfaces}
+
+
+###############################################################################
+# Persistent ping workers
+###############################################################################
+
+
+class PingStream:
+    """Долгоживущий ``ping -i <interval>`` для одной цели.
+
+    Процесс запускается один раз, отдельный поток читает его вывод построчно
+    и обновляет последний RTT, счётчики отправленных/потерянных пакетов и
+    выборку RTT с момента последнего чтения. :meth:`snapshot` отдаёт это как
+    результат ``ok``/``rtt_ms``/``error`` без порождения процесса на каждой
+    итерации. Дочерний процесс работает с ``LC_ALL=C``, чтобы его вывод не
+    зависел от локали. Завершившийся ``ping`` перезапускается не чаще раза в
+    ``restart_delay`` секунд; новый процесс нумерует запросы заново, поэтому
+    счётчики прежних процессов копятся отдельно.
+    """
+
+    _SEQ_RE = re.compile(r"icmp_seq=(\d+)", re.IGNORECASE)
+    _TIME_RE = re.compile(r"time[=<]\s*(\d+\.?\d*)\s*ms", re.IGNORECASE)
+    _LOSS_MARKERS = ("no answer yet", "request timed out", "unreachable", "ttl expired", "general failure")
+
+    def __init__(self, host: str, interval: float, timeout: float, restart_delay: float = 5.0) -> None:
+        self.host = host
+        # Непривилегированный iputils ping не разрешает интервал меньше 0.2 с
+        self.interval = max(0.2, interval)
+        self.timeout = timeout
+        self.restart_delay = restart_delay
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._reader: Optional[threading.Thread] = None
+        self._started_mono = 0.0
+        self._last_rtt: Optional[float] = None
+        self._last_reply_mono: Optional[float] = None
+        self._last_event_ok = False
+        self._last_error: Optional[str] = None
+        # Счётчики текущего процесса ping и сумма по завершившимся
+        self._received = 0
+        self._lost = 0
+        self._max_seq = 0
+        self._prior_sent = 0
+        self._prior_lost = 0
+        self._window: List[float] = []
+
+    def command(self) -> List[str]:
+        """Командная строка непрерывного ping для текущей платформы."""
+
+        if os.name == "nt":
+            # Windows: -t бесконечно, интервал фиксирован (1 с)
+            return ["ping", "-t", "-w", str(int(self.timeout * 1000)), self.host]
+        cmd = ["ping", "-n", "-i", f"{self.interval:g}", "-W", str(max(1, int(round(self.timeout)))), self.host]
+        if sys.platform.startswith("linux"):
+            # iputils: сообщать о неотвеченных запросах до прихода следующего
+            cmd.insert(1, "-O")
+        return cmd
+
+    def start(self) -> None:
+        """Запустить процесс ping и поток чтения."""
+
+        env = dict(os.environ, LC_ALL="C", LANG="C")
+        self._started_mono = time.monotonic()
+        with self._lock:
+            sent, lost = self._process_counts()
+            self._prior_sent += sent
+            self._prior_lost += lost
+            self._received = self._lost = self._max_seq = 0
+        try:
+            proc = subprocess.Popen(
+                self.command(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+                text=True,
+                encoding="utf-8",
+                errors="ignore",
+                bufsize=1,
+                env=env,
+            )
+        except FileNotFoundError:
+            with self._lock:
+                self._last_error = "ping не найден"
+            return
+        except Exception as exc:
+            with self._lock:
+                self._last_error = str(exc)
+            return
+        self._proc = proc
+        self._reader = threading.Thread(target=self._read_loop, args=(proc,), name=f"ping-{self.host}", daemon=True)
+        self._reader.start()
+
+    def stop(self) -> None:
+        """Остановить процесс ping."""
+
+        proc = self._proc
+        self._proc = None
+        if proc is not None and proc.poll() is None:
+            try:
+                proc.terminate()
+                proc.wait(timeout=2)
+            except Exception:
+                try:
+                    proc.kill()
+                except Exception:
+                    pass
+
+    def _read_loop(self, proc: subprocess.Popen) -> None:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            if self._proc is not proc:
+                # Хвост остановленного процесса не должен попасть в счётчики нового
+                return
+            self.feed_line(line)
+
+    def _process_counts(self) -> Tuple[int, int]:
+        """Отправлено и потеряно текущим процессом (вызывать под ``_lock``)."""
+
+        sent = max(self._max_seq, self._received + self._lost)
+        lost = max(0, sent - self._received) if self._max_seq else self._lost
+        return sent, lost
+
+    def feed_line(self, line: str) -> None:
+        """Учесть одну строку вывода ping."""
+
+        text = line.strip()
+        if not text:
+            return
+        lowered = text.lower()
+        seq_match = self._SEQ_RE.search(text)
+        time_match = self._TIME_RE.search(text)
+        now = time.monotonic()
+        with self._lock:
+            if seq_match:
+                self._max_seq = max(self._max_seq, int(seq_match.group(1)))
+            if time_match:
+                rtt = float(time_match.group(1))
+                self._received += 1
+                self._last_rtt = rtt
+                self._last_reply_mono = now
+                self._last_event_ok = True
+                self._last_error = None
+                self._window.append(rtt)
+            elif any(marker in lowered for marker in self._LOSS_MARKERS):
+                if not seq_match:
+                    # Windows не печатает номер запроса — считаем потерю явно
+                    self._lost += 1
+                self._last_event_ok = False
+                self._last_error = text
+            elif lowered.startswith(("ping:", "usage")) or "unknown host" in lowered:
+                self._last_event_ok = False
+                self._last_error = text
+
+    def snapshot(self) -> Dict[str, Optional[object]]:
+        """Последний замер в форме результата ``ping_host`` плюс счётчики потерь."""
+
+        now = time.monotonic()
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            if now - self._started_mono >= self.restart_delay:
+                self.stop()
+                self.start()
+        with self._lock:
+            # Ответ считается свежим, пока не прошло два интервала ping и таймаут
+            fresh = (
+                self._last_reply_mono is not None
+                and now - self._last_reply_mono <= 2 * self.interval + self.timeout
+            )
+            ok = fresh and self._last_event_ok
+            sent, lost = self._process_counts()
+            sent += self._prior_sent
+            lost += self._prior_lost
+            window = self._window
+            self._window = []
+            error = None
+            if not ok:
+                error = self._last_error or ("тайм-аут" if self._last_reply_mono is not None else "нет ответов")
+            return {
+                "ok": ok,
+                "rtt_ms": self._last_rtt if ok else None,
+                "error": error,
+                "samples": len(window),
+                "rtt_avg_ms": round(sum(window) / len(window), 3) if window else None,
+                "rtt_max_ms": max(window) if window else None,
+                "sent": sent,
+                "lost": lost,
+                "loss_pct": round(100.0 * lost / sent, 2) if sent else None,
+            }
+
+
+###############################################################################
+# HTTP checks: phase timing and keep-alive pool
+###############################################################################
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000.0, 3)
+
+
+class TimedHTTPConnection(http.client.HTTPConnection):
+    """``HTTPConnection``, который замеряет разрешение имени и TCP‑connect.
+
+    Фазы складываются в ``self.phases`` по мере выполнения, поэтому при
+    ошибке (например, тайм‑ауте connect) уже измеренные фазы сохраняются.
+    """
+
+    def __init__(self, *args: object, **kwargs: object) -> None:
+        super().__init__(*args, **kwargs)  # type: ignore[arg-type]
+        self.phases: Dict[str, Optional[float]] = {}
+
+    def _connect_tcp(self) -> None:
+        self.phases = {"dns_ms": None, "connect_ms": None, "tls_ms": None}
+        started = time.perf_counter()
+        infos = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)
+        self.phases["dns_ms"] = _elapsed_ms(started)
+        started = time.perf_counter()
+        last_exc: Optional[BaseException] = None
+        for family, sock_type, proto, _name, addr in infos:
+            sock = socket.socket(family, sock_type, proto)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(addr)
+            except OSError as exc:
+                sock.close()
+                last_exc = exc
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock = sock
+            self.phases["connect_ms"] = _elapsed_ms(started)
+            return
+        raise last_exc or OSError(f"нет адресов для {self.host}")
+
+    def connect(self) -> None:
+        self._connect_tcp()
+
+
+class TimedHTTPSConnection(http.client.HTTPSConnection, TimedHTTPConnection):
+    """``HTTPSConnection`` с отдельным замером TLS‑рукопожатия."""
+
+    def connect(self) -> None:
+        self._connect_tcp()
+        started = time.perf_counter()
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.host)  # type: ignore[attr-defined]
+        self.phases["tls_ms"] = _elapsed_ms(started)
+
+
+def timed_http_connection(scheme: str, host: str, timeout: float) -> http.client.HTTPConnection:
+    """Создать соединение с замером фаз для схемы ``http``/``https``."""
+
+    cls = TimedHTTPSConnection if scheme.lower() == "https" else TimedHTTPConnection
+    return cls(host, timeout=timeout)
+
+
+def http_exchange(
+    conn: http.client.HTTPConnection,
+    method: str,
+    path: str,
+    timing: Dict[str, Optional[float]],
+    headers: Optional[Dict[str, str]] = None,
+    max_body: int = 256 * 1024,
+) -> Tuple[http.client.HTTPResponse, bytes]:
+    """Выполнить запрос, раскладывая время по фазам в ``timing``.
+
+    ``timing`` получает ``dns_ms``, ``connect_ms``, ``tls_ms`` (``None`` для
+    уже открытого соединения), ``ttfb_ms`` — от отправки запроса до
+    разобранных заголовков ответа — и ``total_ms`` на весь обмен с чтением
+    тела (не более ``max_body + 1`` байт). Заполняется по мере выполнения,
+    так что при исключении в нём остаются успевшие фазы.
+    """
+
+    timing.update({"dns_ms": None, "connect_ms": None, "tls_ms": None, "ttfb_ms": None, "total_ms": None})
+    started = time.perf_counter()
+    if conn.sock is None:
+        try:
+            conn.connect()
+        finally:
+            timing.update(getattr(conn, "phases", {}))
+    sent = time.perf_counter()
+    conn.request(method, path, headers=headers or {})
+    resp = conn.getresponse()
+    timing["ttfb_ms"] = _elapsed_ms(sent)
+    body = resp.read(max_body + 1)
+    timing["total_ms"] = _elapsed_ms(started)
+    return resp, body
+
+
+class HttpConnectionPool:
+    """Пул keep‑alive соединений для HTTP‑проверок, по ключу ``(scheme, host)``.
+
+    Соединение берётся из пула на время одного запроса и возвращается
+    обратно, если сервер не просил его закрыть. Перед повторным
+    использованием сокет проверяется ``select``: читаемый простаивающий
+    сокет означает, что сервер его закрыл (или прислал мусор), и такое
+    соединение отбрасывается. Если запрос по повторно использованному
+    соединению упал так, как падает закрытое сервером соединение (сброс,
+    разрыв, пустой ответ до заголовков), он один раз повторяется по новому;
+    тайм‑аут не повторяется, чтобы зависший сервер не удваивал ожидание.
+
+    В результат добавляются ``connection`` (``"reused"``/``"cold"``),
+    ``latency_ms`` этого запроса и последние ``cold_ms``/``reused_ms`` для
+    ключа, чтобы стоимость TCP/TLS‑рукопожатия была видна отдельно от
+    задержки самого запроса.
+    """
+
+    # Тело ответа дочитывается, чтобы соединение можно было переиспользовать;
+    # слишком большие ответы проще не держать в пуле.
+    MAX_BODY = 256 * 1024
+    # Ошибки «сервер уже закрыл соединение»; RemoteDisconnected — подкласс BadStatusLine
+    STALE_ERRORS = (http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, max_idle_per_key: int = 2) -> None:
+        self.max_idle_per_key = max_idle_per_key
+        self._idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self._last_ms: Dict[Tuple[str, str], Dict[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_dead(conn: http.client.HTTPConnection) -> bool:
+        sock = conn.sock
+        if sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _acquire(self, key: Tuple[str, str], timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn = idle.pop()
+                if self._is_dead(conn):
+                    conn.close()
+                    continue
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+        scheme, host = key
+        return timed_http_connection(scheme, host, timeout), False
+
+    def _release(self, key: Tuple[str, str], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_key:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """Закрыть все простаивающие соединения."""
+
+        with self._lock:
+            conns = [conn for idle in self._idle.values() for conn in idle]
+            self._idle.clear()
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def check(
+        self,
+        scheme: str,
+        host: str,
+        method: str,
+        path: str,
+        timeout: float,
+        accept: Optional[Tuple[int, ...]] = None,
+    ) -> Dict[str, Optional[object]]:
+        """Выполнить запрос через пул; ``accept=None`` — успех при любом ответе."""
+
+        key = (scheme.lower(), host)
+        result: Dict[str, Optional[object]] = {"ok": False, "status": None, "error": None}
+        for attempt in range(2):
+            conn, reused = self._acquire(key, timeout)
+            timing: Dict[str, Optional[float]] = {}
+            try:
+                resp, body = http_exchange(
+                    conn, method, path, timing, headers={"Connection": "keep-alive"}, max_body=self.MAX_BODY
+                )
+            except Exception as exc:
+                conn.close()
+                stale = isinstance(exc, self.STALE_ERRORS) and timing.get("ttfb_ms") is None
+                if reused and attempt == 0 and stale:
+                    # Сервер закрыл соединение между итерациями — повторяем по новому
+                    continue
+                result["error"] = str(exc)
+                result["connection"] = "reused" if reused else "cold"
+                result["timing"] = timing
+                return result
+            latency_ms = timing["total_ms"]
+            if resp.will_close or len(body) > self.MAX_BODY:
+                conn.close()
+            else:
+                self._release(key, conn)
+            kind = "reused" if reused else "cold"
+            with self._lock:
+                last = self._last_ms.setdefault(key, {"cold_ms": None, "reused_ms": None})
+                last[f"{kind}_ms"] = latency_ms
+                last_snapshot = dict(last)
+            result["status"] = resp.status
+            result["ok"] = accept is None or resp.status in accept
+            result["connection"] = kind
+            result["latency_ms"] = latency_ms
+            result["timing"] = timing
+            result.update(last_snapshot)
+            return result
+        return result
+
+
+###############################################################################
+# Per-probe scheduler
+###############################################################################
+
+
+def probe_names(key: Hashable) -> Tuple[str, Optional[str]]:
+    """Имя группы проверки и её точное имя для ключа из ``_probe_jobs``.
+
+    ``("ping", "8.8.8.8")`` → ``("ping", "8.8.8.8")``,
+    ``("service", "http://google.com/generate_204")`` → ``("services", ...)``,
+    ``("primary",)`` → ``("primary", None)``.
+    """
+
+    assert isinstance(key, tuple)
+    kind = {"service": "services", "ping_all": "ping"}.get(key[0], key[0])
+    exact = key[1] if len(key) > 1 else None
+    return kind, exact
+
+
+def probe_health(result: Dict[str, object]) -> Tuple[bool, Optional[float]]:
+    """Успех и задержка (мс) для результата любой проверки.
+
+    Понимает результаты ``get_local_ip`` (есть ``ip``), ping/DNS/HTTP (есть
+    ``ok``; задержка из ``rtt_ms`` или ``timing.total_ms``) и пакетный
+    ``ping_all`` (словарь по целям: успех, если ответили все).
+    """
+
+    if "ok" in result or ("error" in result and "ip" not in result):
+        rtt = result.get("rtt_ms")
+        timing = result.get("timing")
+        if rtt is None and isinstance(timing, dict):
+            rtt = timing.get("total_ms")
+        return bool(result.get("ok")), rtt if isinstance(rtt, (int, float)) else None
+    if "ip" in result:
+        return result.get("ip") is not None, None
+    rtts = []
+    for res in result.values():
+        if not isinstance(res, dict) or not res.get("ok"):
+            return False, None
+        if isinstance(res.get("rtt_ms"), (int, float)):
+            rtts.append(float(res["rtt_ms"]))
+    return True, max(rtts) if rtts else None
+
+
+class AdaptiveInterval:
+    """Адаптивный интервал: реже, пока всё стабильно, чаще после сбоя.
+
+    После ``stable_after`` подряд успешных замеров интервал растёт в
+    ``growth`` раз до ``base·max_factor``. Первый же сбой или всплеск RTT
+    (больше ``spike_ratio`` сглаженного значения и хотя бы на
+    ``spike_min_ms``) сразу сжимает его до ``base·burst_factor`` — так
+    моменты начала и конца простоя фиксируются точнее, а в спокойное время
+    проверок на порядок меньше.
+    """
+
+    def __init__(
+        self,
+        base: float,
+        max_factor: float = 8.0,
+        burst_factor: float = 0.25,
+        min_interval: float = 0.5,
+        growth: float = 1.5,
+        stable_after: int = 3,
+        spike_ratio: float = 3.0,
+        spike_min_ms: float = 20.0,
+    ) -> None:
+        self.base = base
+        self.max_interval = base * max(1.0, max_factor)
+        self.burst_interval = max(min_interval, base * min(1.0, burst_factor))
+        self.growth = growth
+        self.stable_after = stable_after
+        self.spike_ratio = spike_ratio
+        self.spike_min_ms = spike_min_ms
+        self.current = base
+        self._streak = 0
+        self._rtt_ewma: Optional[float] = None
+
+    def burst(self) -> float:
+        """Перейти на частый опрос (вызывается и извне — при начале простоя)."""
+
+        self.current = self.burst_interval
+        self._streak = 0
+        return self.current
+
+    def observe(self, ok: bool, rtt_ms: Optional[float] = None) -> float:
+        """Учесть очередной замер и вернуть новый интервал."""
+
+        spike = False
+        if rtt_ms is not None:
+            if self._rtt_ewma is not None:
+                spike = rtt_ms > self._rtt_ewma * self.spike_ratio and rtt_ms - self._rtt_ewma >= self.spike_min_ms
+            # Всплеск почти не сдвигает базу, чтобы следующий тоже распознался
+            weight = 0.05 if spike else 0.2
+            self._rtt_ewma = rtt_ms if self._rtt_ewma is None else self._rtt_ewma + weight * (rtt_ms - self._rtt_ewma)
+        if not ok or spike:
+            return self.burst()
+        self._streak += 1
+        if self._streak >= self.stable_after:
+            self.current = min(self.max_interval, self.current * self.growth)
+        return self.current
+
+
+class TickClock:
+    """Расписание итераций основного цикла с бюджетом и учётом отставания.
+
+    Каждая итерация назначена на ``due``. :meth:`begin` фиксирует, насколько
+    поздно она стартовала (``lag``), :meth:`end` — сколько она длилась и
+    вышла ли за ``budget``. Если к концу итерации срок следующей уже прошёл,
+    дальше действует ``policy``: ``"skip"`` — просроченные такты
+    пропускаются (и считаются в ``missed``), следующая итерация ждёт
+    ближайшего такта сетки; ``"catchup"`` — просроченные такты выполняются
+    подряд без паузы, но не больше ``MAX_CATCHUP`` (после зависания или сна
+    машины остальные считаются пропущенными).
+
+    Расписание отсчитывается от :meth:`reset` перед первой итерацией, чтобы
+    запуск компонентов не считался отставанием; отставание первой итерации
+    в ``max_lag`` не попадает.
+    """
+
+    MAX_CATCHUP = 10
+
+    def __init__(self, budget: float, policy: str = "skip") -> None:
+        self.budget = budget
+        self.policy = policy
+        self.due = time.monotonic()
+        self.started = self.due
+        self.lag = 0.0
+        self.max_lag = 0.0
+        # Длительность предыдущей итерации целиком (сбор + публикация)
+        self.duration: Optional[float] = None
+        self.overruns = 0
+        self.missed = 0
+        self._ticks = 0
+
+    def reset(self) -> None:
+        """Начать расписание заново с текущего момента (старт цикла)."""
+
+        self.due = time.monotonic()
+        self.started = self.due
+        self.lag = 0.0
+        self._ticks = 0
+
+    def begin(self) -> float:
+        """Начало итерации: запомнить время старта и отставание от расписания."""
+
+        self.started = time.monotonic()
+        self.lag = max(0.0, self.started - self.due)
+        if self._ticks:
+            self.max_lag = max(self.max_lag, self.lag)
+        self._ticks += 1
+        return self.started
+
+    def end(self, interval: float) -> float:
+        """Конец итерации: учесть длительность и вернуть паузу до следующей."""
+
+        now = time.monotonic()
+        self.duration = now - self.started
+        if self.duration > self.budget:
+            self.overruns += 1
+        self.due += interval
+        if now > self.due:
+            behind = int((now - self.due) // interval) + 1
+            keep = 0 if self.policy == "skip" else min(behind, self.MAX_CATCHUP)
+            self.missed += behind - keep
+            self.due += (behind - keep) * interval
+        return max(0.0, self.due - now)
+
+    def wake(self) -> None:
+        """Внеочередная итерация (событие линка): расписание отсчитывается заново."""
+
+        self.due = time.monotonic()
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "lag_ms": round(self.lag * 1000.0, 1),
+            "max_lag_ms": round(self.max_lag * 1000.0, 1),
+            "last_duration_ms": round(self.duration * 1000.0, 1) if self.duration is not None else None,
+            "budget_ms": round(self.budget * 1000.0, 1),
+            "overruns": self.overruns,
+            "missed_ticks": self.missed,
+            "policy": self.policy,
+        }
+
+
+class ScheduledProbe:
+    """Одна проверка в расписании: свой интервал, фаза и последний результат."""
+
+    def __init__(
+        self,
+        key: Hashable,
+        job: Callable[[], Dict[str, Optional[object]]],
+        interval: float,
+        policy: Optional[AdaptiveInterval] = None,
+    ) -> None:
+        self.key = key
+        self.job = job
+        self.policy = policy
+        self.base_interval = interval
+        self.interval = interval
+        self.due = 0.0
+        self.running = False
+        self.result: Optional[Dict[str, Optional[object]]] = None
+        self.completed_at: Optional[float] = None
+
+
+class ProbeScheduler:
+    """Планировщик проверок на таймер‑куче (``heapq``).
+
+    Каждая проверка запускается по своему интервалу; стартовые фазы
+    равномерно разнесены по первому интервалу опроса, а к каждому следующему
+    сроку добавляется случайный сдвиг ``±jitter·interval``, чтобы дешёвые
+    и дорогие проверки не срабатывали в один момент. Запуск идёт в общем
+    пуле потоков монитора; проверка, которая ещё не завершилась к своему
+    сроку, пропускает его. :meth:`latest` отдаёт последний результат каждой
+    проверки — этим пользуется ``NetWatch._collect_state``.
+
+    Если передана фабрика ``adaptive``, у каждой проверки своя
+    :class:`AdaptiveInterval`, и её интервал меняется после каждого замера.
+    """
+
+    def __init__(
+        self,
+        jobs: Dict[Hashable, Callable[[], Dict[str, Optional[object]]]],
+        intervals: Dict[Hashable, float],
+        executor: concurrent.futures.Executor,
+        spread: float,
+        jitter: float = 0.1,
+        adaptive: Optional[Callable[[float], AdaptiveInterval]] = None,
+    ) -> None:
+        self.jitter = max(0.0, min(jitter, 0.5))
+        self._executor = executor
+        self._probes: Dict[Hashable, ScheduledProbe] = {
+            key: ScheduledProbe(key, job, intervals[key], adaptive(intervals[key]) if adaptive else None)
+            for key, job in jobs.items()
+        }
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        now = time.monotonic()
+        count = max(1, len(self._probes))
+        for index, probe in enumerate(self._probes.values()):
+            probe.due = now + spread * index / count
+            heapq.heappush(self._heap, (probe.due, next(self._counter), probe.key))
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="netwatch-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def probes(self) -> Dict[Hashable, ScheduledProbe]:
+        return self._probes
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Дождаться первого результата каждой проверки (не дольше ``timeout``)."""
+
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while any(probe.result is None for probe in self._probes.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def trigger_all(self) -> None:
+        """Запустить все проверки вне расписания (кроме уже выполняющихся)."""
+
+        with self._cond:
+            now = time.monotonic()
+            for probe in self._probes.values():
+                self._reschedule(probe, now)
+            self._cond.notify_all()
+
+    def burst_all(self) -> None:
+        """Перевести все адаптивные проверки на частый опрос немедленно."""
+
+        with self._cond:
+            now = time.monotonic()
+            for probe in self._probes.values():
+                if probe.policy is None:
+                    continue
+                probe.interval = probe.policy.burst()
+                self._reschedule(probe, min(probe.due, now + probe.interval))
+            self._cond.notify_all()
+
+    def intervals(self) -> Dict[Hashable, float]:
+        """Текущие интервалы проверок."""
+
+        with self._cond:
+            return {key: probe.interval for key, probe in self._probes.items()}
+
+    def _reschedule(self, probe: ScheduledProbe, due: float) -> None:
+        # Старая запись в куче остаётся и отбрасывается при извлечении
+        probe.due = due
+        heapq.heappush(self._heap, (due, next(self._counter), probe.key))
+
+    def latest(self) -> Dict[Hashable, Dict[str, Optional[object]]]:
+        """Последние результаты; для ещё не выполненных — заглушка ``pending``."""
+
+        with self._cond:
+            results: Dict[Hashable, Dict[str, Optional[object]]] = {}
+            for key, probe in self._probes.items():
+                if probe.result is not None:
+                    results[key] = probe.result
+                else:
+                    results[key] = {"ok": False, "error": "ожидание первого замера", "pending": True}
+            return results
+
+    def _next_due(self, probe: ScheduledProbe, now: float) -> float:
+        spread = probe.interval * self.jitter
+        due = probe.due + probe.interval + (random.uniform(-spread, spread) if spread else 0.0)
+        # После паузы (например, сна ноутбука) не догоняем пропущенные сроки
+        return due if due > now else now + probe.interval
+
+    def _loop(self) -> None:
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, key = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                probe = self._probes[key]
+                if due != probe.due:
+                    # Устаревшая запись после перепланирования
+                    continue
+                if not probe.running:
+                    probe.running = True
+                    try:
+                        future = self._executor.submit(probe.job)
+                    except RuntimeError:
+                        # Пул уже остановлен — монитор завершается
+                        return
+                    future.add_done_callback(lambda fut, probe=probe: self._complete(probe, fut))
+                probe.due = self._next_due(probe, now)
+                heapq.heappush(self._heap, (probe.due, next(self._counter), key))
+
+    def _complete(self, probe: ScheduledProbe, future: concurrent.futures.Future) -> None:
+        try:
+            result = future.result()
+        except Exception as exc:
+            result = {"ok": False, "error": str(exc)}
+        with self._cond:
+            probe.result = result
+            probe.completed_at = time.monotonic()
+            probe.running = False
+            self._cond.notify_all()
+            if probe.policy is not None:
+                ok, rtt = probe_health(result)
+                probe.interval = probe.policy.observe(ok, rtt)
+                # Интервал сжался — следующий замер нужен раньше запланированного
+                earliest = probe.completed_at + probe.interval
+                if earliest < probe.due:
+                    self._reschedule(probe, earliest)
+                    self._cond.notify_all()
+
+
+###############################################################################
+# Buffered log writer
+###############################################################################
+
+
+RUNLOG_SEGMENT_RE = re.compile(r"^runlog_(?P<stamp>.+?)\.log(?:\.(?P<segment>\d+))?(?P<ext>\.gz|\.xz)?$")
+
+
+def runlog_sort_key(path: Path) -> Tuple[datetime.datetime, float]:
+    """Ключ сортировки runlog: время запуска из имени, затем номер сегмента.
+
+    Активный файл запуска (``runlog_<ts>.log``) идёт после своих
+    ротированных сегментов (``runlog_<ts>.log.001[.gz|.xz]``).
+    """
+
+    match = RUNLOG_SEGMENT_RE.match(path.name)
+    if not match:
+        return datetime.datetime.fromtimestamp(path.stat().st_mtime), float("inf")
+    try:
+        started = datetime.datetime.strptime(match.group("stamp"), "%d.%m.%y_%H-%M-%S")
+    except ValueError:
+        started = datetime.datetime.fromtimestamp(path.stat().st_mtime)
+    segment = match.group("segment")
+    return started, float(segment) if segment else float("inf")
+
+
+def runlog_files(log_dir: Path) -> List[Path]:
+    """Все runlog в каталоге (включая сжатые сегменты) в хронологическом порядке."""
+
+    files = [p for p in log_dir.iterdir() if p.is_file() and RUNLOG_SEGMENT_RE.match(p.name)]
+    return sorted(files, key=runlog_sort_key)
+
+
+def open_runlog(path: Path) -> "object":
+    """Открыть runlog для чтения текста, прозрачно распаковывая ``.gz``/``.xz``."""
+
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="ignore")
+    if path.suffix == ".xz":
+        return lzma.open(path, "rt", encoding="utf-8", errors="ignore")
+    return path.open("r", encoding="utf-8", errors="ignore")
+
+
+def compress_file(path: Path, method: str) -> Path:
+    """Сжать файл в ``<path>.gz``/``<path>.xz`` и удалить исходный.
+
+    Пишется во временный файл и переименовывается по готовности, так что
+    прерванное сжатие оставляет только исходный (читаемый) сегмент.
+    """
+
+    suffix = ".gz" if method == "gzip" else ".xz"
+    target = path.with_name(path.name + suffix)
+    tmp = path.with_name(path.name + suffix + ".tmp")
+    opener = gzip.open if method == "gzip" else lzma.open
+    try:
+        with path.open("rb") as src, opener(tmp, "wb") as dst:  # type: ignore[operator]
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+    os.replace(tmp, target)
+    path.unlink()
+    return target
+
+
+class RunlogIndex:
+    """Поминутный индекс runlog ``<файл>.idx``: время → смещение в байтах.
+
+    Файл начинается с заголовка (магия ``NWIX``, версия, размер записи), за
+    ним — записи ``minute`` (int64, Unix‑время начала минуты), ``offset``
+    (uint64, первая строка этой минуты) и ``keyframe`` (uint64, последняя
+    полная STATUS‑строка не позже ``offset``; :attr:`NONE` — её в файле ещё
+    не было). Записи идут по возрастанию минут, поэтому поиск момента —
+    бинарный поиск по ``mmap`` индекса, независимо от размера лога. Пишет
+    индекс :class:`LogWriter`; сжатые сегменты индекса не имеют.
+    """
+
+    MAGIC = b"NWIX"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHH")
+    ENTRY = struct.Struct("<qQQ")
+    NONE = 0xFFFFFFFFFFFFFFFF
+
+    def __init__(self, log: Path) -> None:
+        self.log = log
+        self.path = self.path_for(log)
+        self._fh: Optional[object] = None
+        self._map: Optional[mmap.mmap] = None
+
+    @staticmethod
+    def path_for(log: Path) -> Path:
+        return log.with_name(log.name + ".idx")
+
+    @classmethod
+    def header(cls) -> bytes:
+        return cls.HEADER.pack(cls.MAGIC, cls.VERSION, cls.ENTRY.size)
+
+    def open(self) -> "RunlogIndex":
+        with self.path.open("rb") as fh:
+            prefix = fh.read(self.HEADER.size)
+        if len(prefix) < self.HEADER.size:
+            raise ValueError(f"{self.path}: обрезанный индекс")
+        magic, _version, entry_size = self.HEADER.unpack(prefix)
+        if magic != self.MAGIC or entry_size != self.ENTRY.size:
+            raise ValueError(f"{self.path}: не индекс runlog NetWatch")
+        if self.path.stat().st_size >= self.HEADER.size + self.ENTRY.size:
+            self._fh = self.path.open("rb")
+            self._map = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)  # type: ignore[attr-defined]
+        return self
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fh is not None:
+            self._fh.close()  # type: ignore[attr-defined]
+            self._fh = None
+
+    def __enter__(self) -> "RunlogIndex":
+        return self.open()
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        if self._map is None:
+            return 0
+        # Недописанная последняя запись (обрыв при сбое) не учитывается
+        return (len(self._map) - self.HEADER.size) // self.ENTRY.size
+
+    def entry(self, index: int) -> Tuple[int, int, int]:
+        assert self._map is not None
+        return self.ENTRY.unpack_from(self._map, self.HEADER.size + index * self.ENTRY.size)  # type: ignore[return-value]
+
+    def start_offset(self, when: datetime.datetime) -> int:
+        """Смещение в логе, начиная с которого читается состояние на ``when``.
+
+        Это последний полный STATUS перед минутой ``when`` — от него
+        DELTA‑строки разворачиваются без чтения начала файла. ``0`` — читать
+        с начала (момент раньше индекса или ключевого кадра в файле нет).
+        """
+
+        minute = int(when.replace(second=0, microsecond=0).timestamp())
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0] <= minute:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return 0
+        _minute, _offset, keyframe = self.entry(lo - 1)
+        return 0 if keyframe == self.NONE else keyframe
+
+
+def runlog_start_offset(path: Path, when: datetime.datetime) -> int:
+    """Смещение в runlog по его индексу (``0`` — индекса нет или он не подходит)."""
+
+    try:
+        with RunlogIndex(path) as index:
+            offset = index.start_offset(when)
+        if offset <= 0:
+            return 0
+        # Индекс от другого файла или лог обрезан — смещение должно попадать на начало строки
+        with path.open("rb") as fh:
+            fh.seek(offset - 1)
+            return offset if fh.read(1) == b"\n" else 0
+    except (OSError, ValueError):
+        return 0
+
+
+def iter_mapped_lines(path: Path, start: int) -> Iterator[str]:
+    """Строки runlog начиная с байта ``start`` через ``mmap`` (без чтения начала файла)."""
+
+    with path.open("rb") as fh:
+        if os.fstat(fh.fileno()).st_size <= start:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            size = len(mapped)
+            pos = start
+            while pos < size:
+                end = mapped.find(b"\n", pos)
+                end = size if end < 0 else end + 1
+                yield mapped[pos:end].decode("utf-8", errors="ignore")
+                pos = end
+
+
+# Элемент очереди LogWriter: строка или DELTA‑строка с полным состоянием
+LogItem = Union[str, Tuple[str, Dict[str, object]]]
+
+
+class LogWriter:
+    """Фоновая запись runlog: очередь строк и один открытый файл.
+
+    ``write`` только кладёт строку в ограниченную очередь и никогда не
+    блокирует цикл мониторинга; при переполнении строка отбрасывается, а
+    ``dropped`` увеличивается. Поток‑писатель копит строки и сбрасывает их
+    пачкой, когда набралось ``flush_lines`` строк, прошло ``flush_ms`` мс с
+    первой несброшенной строки или при закрытии. ``fsync`` — ``"never"``,
+    ``"flush"`` (после каждого сброса) или ``"close"`` (только при
+    остановке).
+
+    Ротация: когда файл превышает ``max_bytes`` или пересекается граница
+    ``rotate_every`` (``"hour"``/``"day"``), текущий файл переименовывается
+    в сегмент ``<имя>.NNN`` и запись продолжается в новый файл с прежним
+    именем. Закрытые сегменты сжимаются в фоне (``compress``: ``"gzip"``,
+    ``"lzma"`` или ``"none"``), после чего применяется политика хранения:
+    самые старые runlog каталога удаляются, пока их суммарный размер больше
+    ``keep_bytes`` или возраст больше ``keep_days``. Сбои записи, ротации,
+    сжатия и удаления не останавливают поток, но считаются в
+    ``stats()["errors"]`` и пишутся в ``logger``; строки несброшенной пачки
+    добавляются к ``dropped``.
+
+    С ``index`` рядом с каждым файлом ведётся :class:`RunlogIndex`
+    (``<имя>.idx``): на первую строку каждой минуты — её смещение и смещение
+    последнего полного STATUS. Индекс дописывается после самих строк, так
+    что никогда не указывает за конец лога; при сжатии сегмента он удаляется.
+
+    Новый сегмент начинается с ключевого кадра: после ротации вызывается
+    ``on_rotate`` (кодировщик DELTA выпишет следующий STATUS полностью), а
+    DELTA‑строки, оказавшиеся в новом файле раньше него, пишутся полным
+    состоянием, переданным в :meth:`write`.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        queue_size: int = 10000,
+        flush_lines: int = 50,
+        flush_ms: float = 1000.0,
+        fsync: str = "close",
+        max_bytes: int = 0,
+        rotate_every: Optional[str] = None,
+        compress: str = "none",
+        keep_bytes: int = 0,
+        keep_days: float = 0.0,
+        index: bool = True,
+        logger: Optional[logging.Logger] = None,
+        on_rotate: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.path = path
+        self.index = index
+        self.logger = logger
+        self.on_rotate = on_rotate
+        self.flush_lines = max(1, flush_lines)
+        self.flush_interval = max(0.0, flush_ms) / 1000.0
+        self.fsync = fsync
+        self.max_bytes = max(0, max_bytes)
+        self.rotate_every = rotate_every
+        self.compress = compress
+        self.keep_bytes = max(0, keep_bytes)
+        self.keep_days = max(0.0, keep_days)
+        self.dropped = 0
+        self.written = 0
+        self.rotations = 0
+        self.errors = 0
+        self._queue: "queue.Queue[Optional[LogItem]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._fh: Optional[object] = None
+        self._size = 0
+        self._period: Optional[str] = None
+        self._segment = 0
+        self._compressors: List[threading.Thread] = []
+        # Сегменты, которые сейчас сжимаются: хранение их не трогает
+        self._compressing: set = set()
+        self._retention_lock = threading.Lock()
+        self._index_fh: Optional[object] = None
+        self._index_minute: Optional[str] = None
+        self._index_last = -1
+        self._keyframe_offset = RunlogIndex.NONE
+        # После ротации и до первого полного STATUS DELTA пишутся целиком
+        self._keyframe_pending = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._closed
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="netwatch-log", daemon=True)
+        self._thread.start()
+
+    def write(self, line: str, keyframe: Optional[Dict[str, object]] = None) -> bool:
+        """Поставить строку в очередь; ``False`` — очередь полна, строка потеряна.
+
+        ``keyframe`` — полное состояние DELTA‑строки: оно пишется вместо неё,
+        если строка окажется в начале нового сегмента.
+        """
+
+        try:
+            self._queue.put_nowait(line if keyframe is None else (line, keyframe))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Сбросить всё накопленное и остановить поток."""
+
+        if self._thread is None or self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        # Даём фоновому сжатию закончиться; прерванное оставит несжатый сегмент
+        for worker in self._compressors:
+            worker.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
+
+    def _current_period(self) -> Optional[str]:
+        if self.rotate_every == "hour":
+            return datetime.datetime.now().strftime("%Y%m%d%H")
+        if self.rotate_every == "day":
+            return datetime.datetime.now().strftime("%Y%m%d")
+        return None
+
+    def _open(self) -> None:
+        self._fh = self.path.open("ab")
+        self._size = self._fh.tell()  # type: ignore[attr-defined]
+        self._period = self._current_period()
+        self._index_minute = None
+        self._index_last = -1
+        self._keyframe_offset = RunlogIndex.NONE
+        if self.index:
+            try:
+                # Индекс от прежнего содержимого пустого файла не нужен
+                self._index_fh = RunlogIndex.path_for(self.path).open("ab" if self._size else "wb")
+                if self._index_fh.tell() == 0:  # type: ignore[attr-defined]
+                    self._index_fh.write(RunlogIndex.header())  # type: ignore[attr-defined]
+            except OSError:
+                self._index_fh = None
+
+    def _close_file(self, sync: bool) -> None:
+        index_fh = self._index_fh
+        self._index_fh = None
+        if index_fh is not None:
+            try:
+                index_fh.close()  # type: ignore[attr-defined]
+            except OSError:
+                pass
+        fh = self._fh
+        self._fh = None
+        if fh is None:
+            return
+        try:
+            fh.flush()  # type: ignore[attr-defined]
+            if sync:
+                os.fsync(fh.fileno())  # type: ignore[attr-defined]
+        finally:
+            fh.close()  # type: ignore[attr-defined]
+
+    def _rotate(self) -> None:
+        """Закрыть текущий файл, превратить его в сегмент и открыть новый."""
+
+        self._close_file(self.fsync != "never")
+        while True:
+            self._segment += 1
+            segment = self.path.with_name(f"{self.path.name}.{self._segment:03d}")
+            if not any(segment.with_name(segment.name + ext).exists() for ext in ("", ".gz", ".xz")):
+                break
+        if self.compress in ("gzip", "lzma"):
+            # До появления сегмента, чтобы хранение не удалило его раньше сжатия
+            with self._retention_lock:
+                self._compressing.add(segment)
+        try:
+            os.replace(self.path, segment)
+        except OSError:
+            with self._retention_lock:
+                self._compressing.discard(segment)
+            raise
+        index = RunlogIndex.path_for(self.path)
+        if index.exists():
+            os.replace(index, RunlogIndex.path_for(segment))
+        self.rotations += 1
+        self._open()
+        self._keyframe_pending = True
+        if self.on_rotate is not None:
+            try:
+                self.on_rotate()
+            except Exception as exc:
+                self._failed("запросить ключевой кадр", self.path, exc)
+        worker = threading.Thread(target=self._finish_segment, args=(segment,), name="netwatch-compress", daemon=True)
+        self._compressors = [t for t in self._compressors if t.is_alive()] + [worker]
+        worker.start()
+
+    def _failed(self, action: str, path: Path, exc: BaseException) -> None:
+        """Учесть сбой фонового обслуживания (сжатие, удаление) без остановки записи."""
+
+        self.errors += 1
+        if self.logger is not None:
+            self.logger.warning("Runlog %s: не удалось %s: %s", path, action, exc)
+
+    def _finish_segment(self, segment: Path) -> None:
+        if self.compress in ("gzip", "lzma"):
+            try:
+                compress_file(segment, self.compress)
+                # Смещения несжатого файла к сжатому не применимы
+                index = RunlogIndex.path_for(segment)
+                if index.exists():
+                    index.unlink()
+            except Exception as exc:
+                self._failed(f"сжать ({self.compress})", segment, exc)
+            finally:
+                with self._retention_lock:
+                    self._compressing.discard(segment)
+        self.apply_retention()
+
+    def apply_retention(self) -> None:
+        """Удалить старые runlog каталога сверх лимита размера или возраста.
+
+        Проходы не пересекаются; сегменты, которые ещё сжимаются (и их
+        сжатые копии), учитываются в размере, но не удаляются.
+        """
+
+        if not self.keep_bytes and not self.keep_days:
+            return
+        with self._retention_lock:
+            busy = {
+                segment.with_name(segment.name + ext) for segment in self._compressing for ext in ("", ".gz", ".xz")
+            }
+            try:
+                files = [p for p in runlog_files(self.path.parent) if p != self.path]
+            except OSError as exc:
+                self._failed("оценить размер каталога", self.path.parent, exc)
+                return
+            sizes: Dict[Path, os.stat_result] = {}
+            for path in files:
+                try:
+                    sizes[path] = path.stat()
+                except OSError:
+                    # Исходник сегмента уже заменён сжатым файлом
+                    continue
+            try:
+                total = sum(st.st_size for st in sizes.values()) + (self.path.stat().st_size if self.path.exists() else 0)
+            except OSError as exc:
+                self._failed("оценить размер каталога", self.path.parent, exc)
+                return
+            self._remove_old(sizes, busy, total)
+
+    def _remove_old(self, sizes: Dict[Path, os.stat_result], busy: set, total: int) -> None:
+        now = time.time()
+        for old, stat in sizes.items():
+            if old in busy:
+                continue
+            too_old = self.keep_days and now - stat.st_mtime > self.keep_days * 86400
+            too_big = self.keep_bytes and total > self.keep_bytes
+            if not (too_old or too_big):
+                continue
+            try:
+                old.unlink()
+                index = RunlogIndex.path_for(old)
+                if index.exists():
+                    index.unlink()
+            except OSError as exc:
+                # Следующие файлы всё равно пробуем удалить
+                self._failed("удалить", old, exc)
+                continue
+            total -= stat.st_size
+
+    def _index_entries(self, batch: List[str], encoded: List[bytes]) -> bytes:
+        """Записи индекса для пачки строк, которая ляжет в файл с ``self._size``."""
+
+        entries = []
+        offset = self._size
+        for line, raw in zip(batch, encoded):
+            # Сообщение идёт после второго « | »: "<время> | <уровень> | STATUS {...}"
+            if line.startswith("STATUS ", line.find(" | ", 20) + 3):
+                self._keyframe_offset = offset
+            minute = line[:16]
+            if minute != self._index_minute:
+                self._index_minute = minute
+                try:
+                    stamp = int(datetime.datetime.strptime(minute, "%Y-%m-%d %H:%M").timestamp())
+                except ValueError:
+                    stamp = -1
+                # Часы, ушедшие назад, не должны нарушать порядок минут в индексе
+                if stamp > self._index_last:
+                    self._index_last = stamp
+                    entries.append(RunlogIndex.ENTRY.pack(stamp, offset, self._keyframe_offset))
+            offset += len(raw)
+        return b"".join(entries)
+
+    def _lines(self, batch: List[LogItem]) -> List[str]:
+        """Строки пачки; в начале сегмента DELTA заменяются полными STATUS.
+
+        DELTA опирается на записи, оставшиеся в прошлом сегменте, поэтому до
+        первого настоящего ключевого кадра каждая пишется полным состоянием.
+        """
+
+        lines: List[str] = []
+        for item in batch:
+            if isinstance(item, tuple):
+                line, state = item
+                if self._keyframe_pending:
+                    prefix = line[: line.find(" | ", 20) + 3]
+                    line = f"{prefix}STATUS {json.dumps(state, ensure_ascii=False)}\n"
+            else:
+                line = item
+                if self._keyframe_pending and line.startswith("STATUS ", line.find(" | ", 20) + 3):
+                    self._keyframe_pending = False
+            lines.append(line)
+        return lines
+
+    def _flush(self, batch: List[LogItem]) -> None:
+        # Размеры в байтах: строки runlog в основном кириллические
+        encoded = [(item if isinstance(item, str) else item[0]).encode("utf-8") for item in batch]
+        if self._fh is not None and self._size > 0:
+            size = sum(len(raw) for raw in encoded)
+            period = self._current_period()
+            if (self.max_bytes and self._size + size > self.max_bytes) or period != self._period:
+                try:
+                    self._rotate()
+                except OSError as exc:
+                    # Пишем дальше в прежний файл, чем терять строки
+                    self._failed("ротировать", self.path, exc)
+        if self._fh is None:
+            self._open()
+        substitute = self._keyframe_pending
+        lines = self._lines(batch)
+        if substitute:
+            encoded = [line.encode("utf-8") for line in lines]
+        data = b"".join(encoded)
+        entries = self._index_entries(lines, encoded) if self._index_fh is not None else b""
+        self._fh.write(data)  # type: ignore[attr-defined]
+        self._fh.flush()  # type: ignore[attr-defined]
+        if self.fsync == "flush":
+            os.fsync(self._fh.fileno())  # type: ignore[attr-defined]
+        if entries:
+            try:
+                self._index_fh.write(entries)  # type: ignore[union-attr]
+                self._index_fh.flush()  # type: ignore[union-attr]
+            except OSError:
+                pass
+        self._size += len(data)
+        self.written += len(batch)
+        batch.clear()
+
+    def _write_batch(self, batch: List[LogItem]) -> None:
+        """Сбросить пачку; при сбое строки считаются потерянными, а не исчезают молча."""
+
+        try:
+            self._flush(batch)
+        except Exception as exc:
+            self.dropped += len(batch)
+            self._failed(f"записать {len(batch)} строк", self.path, exc)
+            batch.clear()
+
+    def _run(self) -> None:
+        batch: List[LogItem] = []
+        deadline: Optional[float] = None
+        try:
+            self._open()
+        except OSError as exc:
+            # Файл откроется при первом сбросе
+            self._failed("открыть", self.path, exc)
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    line = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    line = ""
+                if line is None:
+                    break
+                if line:
+                    batch.append(line)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                if batch and (len(batch) >= self.flush_lines or time.monotonic() >= (deadline or 0.0)):
+                    self._write_batch(batch)
+                    deadline = None
+            # Остановка: дочитать очередь и сбросить всё, что осталось
+            while True:
+                try:
+                    line = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if line:
+                    batch.append(line)
+            if batch:
+                self._write_batch(batch)
+        finally:
+            try:
+                self._close_file(self.fsync in ("flush", "close"))
+            except Exception:
+                pass
+
+
+###############################################################################
+# Binary sample store
+###############################################################################
+
+
+class SampleSeries:
+    """Ряд замеров одной проверки в файле ``<имя>.nws`` фиксированными записями.
+
+    Файл начинается с заголовка: магия ``NWTS``, версия, длина заголовка и
+    JSON‑схема (имя проверки, формат ``struct`` записи, поля). Дальше идут
+    записи ``ts`` (float64, Unix‑время), ``rtt_ms`` (float32, NaN — нет),
+    ``status`` (uint16, 0 — нет) и ``ok`` (uint8). Записи дописываются в
+    порядке времени, поэтому выборка за период — бинарный поиск по ``ts``
+    в ``mmap`` и срез, без разбора остального файла.
+    """
+
+    MAGIC = b"NWTS"
+    VERSION = 1
+    HEADER_SIZE = 256
+    RECORD = struct.Struct("<dfHB1x")
+    FIELDS = ("ts", "rtt_ms", "status", "ok")
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.probe = ""
+        self._fh: Optional[object] = None
+        self._map: Optional[mmap.mmap] = None
+        self._record = self.RECORD
+        self._header_size = self.HEADER_SIZE
+
+    @staticmethod
+    def filename(probe: str) -> str:
+        """Имя файла проверки: читаемая часть + короткий хеш полного имени."""
+
+        safe = re.sub(r"[^A-Za-z0-9._-]+", "_", probe).strip("_")[:60]
+        digest = hashlib.blake2b(probe.encode("utf-8"), digest_size=4).hexdigest()
+        return f"{safe}-{digest}.nws"
+
+    @classmethod
+    def header(cls, probe: str) -> bytes:
+        schema = json.dumps(
+            {"probe": probe, "format": cls.RECORD.format, "fields": cls.FIELDS, "created": round(time.time(), 3)},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        prefix = cls.MAGIC + struct.pack("<HH", cls.VERSION, cls.HEADER_SIZE)
+        if len(prefix) + len(schema) > cls.HEADER_SIZE:
+            raise ValueError(f"слишком длинное имя проверки: {probe!r}")
+        return (prefix + schema).ljust(cls.HEADER_SIZE, b"\x00")
+
+    # -- чтение ---------------------------------------------------------------
+
+    def open(self) -> "SampleSeries":
+        """Отобразить файл в память и прочитать схему."""
+
+        with self.path.open("rb") as fh:
+            prefix = fh.read(8)
+            if len(prefix) < 8 or prefix[:4] != self.MAGIC:
+                raise ValueError(f"{self.path}: не файл замеров NetWatch")
+            _version, header_size = struct.unpack("<HH", prefix[4:])
+            schema = json.loads(fh.read(header_size - 8).rstrip(b"\x00") or b"{}")
+        self.probe = str(schema.get("probe", ""))
+        self._record = struct.Struct(str(schema.get("format", self.RECORD.format)))
+        self._header_size = header_size
+        size = self.path.stat().st_size
+        if size > header_size:
+            self._fh = self.path.open("rb")
+            self._map = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)  # type: ignore[attr-defined]
+        return self
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fh is not None:
+            self._fh.close()  # type: ignore[attr-defined]
+            self._fh = None
+
+    def __enter__(self) -> "SampleSeries":
+        return self.open()
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        if self._map is None:
+            return 0
+        # Недописанный хвост последней записи (обрыв при сбое) не учитываем
+        return (len(self._map) - self._header_size) // self._record.size
+
+    def _ts(self, index: int) -> float:
+        assert self._map is not None
+        return struct.unpack_from("<d", self._map, self._header_size + index * self._record.size)[0]
+
+    def bisect(self, ts: float, right: bool = False) -> int:
+        """Индекс первой записи с временем не раньше ``ts`` (``right`` — позже ``ts``)."""
+
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._ts(mid)
+            if value < ts or (right and value == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def slice(self, since: Optional[float] = None, until: Optional[float] = None) -> memoryview:
+        """Сырые байты записей за ``[since, until]`` — срез отображения без копирования."""
+
+        if self._map is None:
+            return memoryview(b"")
+        start = self.bisect(since) if since is not None else 0
+        end = self.bisect(until, right=True) if until is not None else len(self)
+        view = memoryview(self._map)  # type: ignore[arg-type]
+        size = self._record.size
+        return view[self._header_size + start * size : self._header_size + max(start, end) * size]
+
+    def records(
+        self, since: Optional[float] = None, until: Optional[float] = None
+    ) -> Iterator[Tuple[float, Optional[float], Optional[int], bool]]:
+        """Записи ``(ts, rtt_ms, status, ok)`` за период."""
+
+        view = self.slice(since, until)
+        try:
+            for ts, rtt, status, ok in self._record.iter_unpack(view):
+                yield ts, None if math.isnan(rtt) else rtt, status or None, bool(ok)
+        finally:
+            view.release()
+
+
+class SampleStore:
+    """Каталог рядов :class:`SampleSeries`, по файлу на проверку (``--samples``).
+
+    :meth:`append` только ставит замеры итерации (из :func:`state_samples`)
+    в ограниченную очередь; запись идёт в отдельном потоке, как у
+    :class:`LogWriter`: файлы буферизуются и сбрасываются не чаще раза в
+    ``flush_ms``. Раз в ``prune_every`` секунд ряды обрезаются спереди до
+    последних ``keep_days`` суток (``None`` — хранить всё). Отдельный файл
+    на проверку делает каждый ряд самостоятельной колонкой.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        keep_days: Optional[float] = 30.0,
+        flush_ms: float = 1000.0,
+        prune_every: float = 3600.0,
+        queue_size: int = 1000,
+    ) -> None:
+        self.directory = directory
+        self.keep_days = keep_days if keep_days and keep_days > 0 else None
+        self.flush_interval = max(0.0, flush_ms) / 1000.0
+        self.prune_every = max(1.0, prune_every)
+        self._queue: "queue.Queue[Optional[Tuple[float, List[Tuple[str, bool, Optional[float], Optional[int]]]]]]" = (
+            queue.Queue(maxsize=max(1, queue_size))
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._files: Dict[str, object] = {}
+        self._last_ts: Dict[str, float] = {}
+        self.written = 0
+        self.dropped = 0
+        self.pruned = 0
+        self.error: Optional[str] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="netwatch-samples", daemon=True)
+            self._thread.start()
+
+    def append(self, state: Dict[str, object], ts: Optional[float] = None) -> None:
+        """Поставить замеры итерации в очередь записи (без ввода‑вывода)."""
+
+        item = (time.time() if ts is None else ts, list(state_samples(state)))
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += len(item[1])
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10.0)
+            self._thread = None
+        self._close_files()
+
+    def stats(self) -> Dict[str, object]:
+        return {"written": self.written, "dropped": self.dropped, "pruned": self.pruned, "error": self.error}
+
+    def _run(self) -> None:
+        flush_at: Optional[float] = None
+        prune_at = time.monotonic()
+        while True:
+            timeout = None if flush_at is None else max(0.0, flush_at - time.monotonic())
+            if self.keep_days is not None:
+                timeout = max(0.0, min(timeout if timeout is not None else self.prune_every, prune_at - time.monotonic()))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()  # type: ignore[assignment]
+            try:
+                if item is None:
+                    break
+                if item:
+                    self._write(*item)
+                    if flush_at is None:
+                        flush_at = time.monotonic() + self.flush_interval
+                if flush_at is not None and time.monotonic() >= flush_at:
+                    self._flush()
+                    flush_at = None
+                if self.keep_days is not None and time.monotonic() >= prune_at:
+                    self.prune(time.time() - self.keep_days * 86400.0)
+                    prune_at = time.monotonic() + self.prune_every
+            except (OSError, ValueError) as exc:
+                self.error = str(exc)
+        # Остановка: дописать всё, что осталось в очереди
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item:
+                try:
+                    self._write(*item)
+                except (OSError, ValueError) as exc:
+                    self.error = str(exc)
+        self._close_files()
+
+    def _open(self, probe: str) -> object:
+        fh = self._files.get(probe)
+        if fh is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / SampleSeries.filename(probe)
+            fh = path.open("ab")
+            if fh.tell() == 0:
+                fh.write(SampleSeries.header(probe))
+            else:
+                # Хвост оборванной записи после сбоя отрезаем, чтобы не сбить выравнивание
+                extra = (fh.tell() - SampleSeries.HEADER_SIZE) % SampleSeries.RECORD.size
+                if extra:
+                    fh.truncate(fh.tell() - extra)
+            self._files[probe] = fh
+        return fh
+
+    def _write(self, ts: float, samples: List[Tuple[str, bool, Optional[float], Optional[int]]]) -> None:
+        for probe, ok, rtt, status in samples:
+            # Ряд упорядочен по времени: шаг часов назад не нарушает бинарный поиск
+            stamp = max(ts, self._last_ts.get(probe, ts))
+            self._last_ts[probe] = stamp
+            record = SampleSeries.RECORD.pack(
+                stamp, float("nan") if rtt is None else float(rtt), status or 0, int(ok)
+            )
+            self._open(probe).write(record)  # type: ignore[attr-defined]
+            self.written += 1
+
+    def _flush(self) -> None:
+        for fh in self._files.values():
+            fh.flush()  # type: ignore[attr-defined]
+
+    def _close_files(self) -> None:
+        for fh in self._files.values():
+            try:
+                fh.close()  # type: ignore[attr-defined]
+            except OSError:
+                pass
+        self._files.clear()
+
+    def prune(self, cutoff: float) -> None:
+        """Удалить из всех рядов каталога записи старше ``cutoff`` (Unix‑время).
+
+        Записи упорядочены, поэтому граница находится бинарным поиском, а
+        хвост копируется в новый файл, который атомарно заменяет старый.
+        """
+
+        self._close_files()
+        for path in self.series(self.directory).values():
+            with SampleSeries(path) as series:
+                drop = series.bisect(cutoff)
+                header_size = series._header_size
+                record_size = series._record.size
+            if not drop:
+                continue
+            tmp = path.with_name(path.name + ".tmp")
+            with path.open("rb") as src, tmp.open("wb") as dst:
+                dst.write(src.read(header_size))
+                src.seek(header_size + drop * record_size)
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp, path)
+            self.pruned += drop
+
+    @staticmethod
+    def series(directory: Path) -> Dict[str, Path]:
+        """Имя проверки → файл ряда для всех ``*.nws`` каталога."""
+
+        found: Dict[str, Path] = {}
+        for path in sorted(directory.glob("*.nws")) if directory.is_dir() else []:
+            try:
+                with SampleSeries(path) as series:
+                    found[series.probe] = path
+            except (OSError, ValueError):
+                continue
+        return found
+
+
+###############################################################################
+# SQLite sample database
+###############################################################################
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    probe TEXT NOT NULL,
+    ts REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    rtt_ms REAL,
+    status INTEGER
+);
+CREATE INDEX IF NOT EXISTS samples_probe_ts ON samples (probe, ts);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS probes (probe TEXT PRIMARY KEY) WITHOUT ROWID;
+"""
+
+SQLITE_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    probe TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    min_ms REAL,
+    avg_ms REAL,
+    max_ms REAL,
+    p95_ms REAL,
+    PRIMARY KEY (probe, bucket)
+) WITHOUT ROWID;
+"""
+
+# Таблица свёртки → длина корзины, секунды
+SQLITE_ROLLUPS: Tuple[Tuple[str, int], ...] = (("rollup_1m", 60), ("rollup_1h", 3600))
+
+
+def rollup_row(probe: str, bucket: int, rows: List[Tuple[int, Optional[float]]]) -> Tuple[object, ...]:
+    """Строка свёртки по замерам ``(ok, rtt_ms)`` одной корзины."""
+
+    rtts = sorted(rtt for ok, rtt in rows if ok and rtt is not None)
+    failures = sum(1 for ok, _rtt in rows if not ok)
+    if not rtts:
+        return probe, bucket, len(rows), failures, None, None, None, None
+    p95 = rtts[min(len(rtts) - 1, max(0, math.ceil(0.95 * len(rtts)) - 1))]
+    return probe, bucket, len(rows), failures, rtts[0], round(sum(rtts) / len(rtts), 3), rtts[-1], p95
+
+
+class SqliteSink:
+    """Запись замеров в SQLite (``--sqlite``) в отдельном потоке.
+
+    Замеры итерации (:func:`state_samples`) ставятся в очередь; поток
+    вставляет их одной транзакцией раз в ``batch_ticks`` итераций (журнал
+    WAL, индекс ``(probe, ts)``). Тот же поток раз в ``rollup_every`` секунд
+    досчитывает завершившиеся корзины таблиц ``rollup_1m``/``rollup_1h``
+    (count, failures, min/avg/max/p95 RTT) и удаляет сырые замеры старше
+    ``keep_days``, но только уже свёрнутые в часовые корзины. Перед свёрткой
+    очередь вставок сливается в базу; список проверок хранится в таблице
+    ``probes``, а не собирается по сырым замерам. Соединение
+    живёт в потоке записи, поэтому цикл мониторинга SQLite не ждёт.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        batch_ticks: int = 10,
+        keep_days: Optional[float] = 7.0,
+        rollup_every: float = 60.0,
+        queue_size: int = 1000,
+    ) -> None:
+        self.path = path
+        self.batch_ticks = max(1, batch_ticks)
+        self.keep_days = keep_days if keep_days and keep_days > 0 else None
+        self.rollup_every = max(1.0, rollup_every)
+        self._queue: "queue.Queue[Optional[List[Tuple[object, ...]]]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self.inserted = 0
+        self.dropped = 0
+        self.error: Optional[str] = None
+        # Проверки, уже записанные в таблицу probes
+        self._probes: set = set()
+
+    @staticmethod
+    def connect(path: Path) -> sqlite3.Connection:
+        """Открыть базу, включить WAL и создать схему."""
+
+        conn = sqlite3.connect(str(path))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SQLITE_SCHEMA)
+        for table, _length in SQLITE_ROLLUPS:
+            conn.executescript(SQLITE_ROLLUP_SCHEMA.format(table=table))
+        with conn:
+            # База до появления таблицы probes: заполняем список проверок один раз
+            if conn.execute("SELECT 1 FROM probes LIMIT 1").fetchone() is None:
+                conn.execute("INSERT OR IGNORE INTO probes SELECT DISTINCT probe FROM samples")
+        return conn
+
+    def start(self) -> None:
+        if self._thread is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="netwatch-sqlite", daemon=True)
+            self._thread.start()
+
+    def append(self, state: Dict[str, object], ts: Optional[float] = None) -> None:
+        ts = time.time() if ts is None else ts
+        rows = [(probe, ts, int(ok), rtt, status) for probe, ok, rtt, status in state_samples(state)]
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            self.dropped += len(rows)
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10.0)
+            self._thread = None
+
+    def stats(self) -> Dict[str, object]:
+        return {"inserted": self.inserted, "dropped": self.dropped, "error": self.error}
+
+    def _run(self) -> None:
+        try:
+            conn = self.connect(self.path)
+        except sqlite3.Error as exc:
+            self.error = str(exc)
+            return
+        pending: List[Tuple[object, ...]] = []
+        ticks = 0
+        next_rollup = time.monotonic() + self.rollup_every
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(0.0, next_rollup - time.monotonic()))
+                except queue.Empty:
+                    item = []
+                if item is None:
+                    break
+                if item:
+                    pending.extend(item)
+                    ticks += 1
+                if pending and ticks >= self.batch_ticks:
+                    self._insert(conn, pending)
+                    pending, ticks = [], 0
+                if time.monotonic() >= next_rollup:
+                    # Всё, что уже в очереди, — в базу до сдвига отметки свёртки,
+                    # иначе строки старше новой отметки в свёртки не попадут
+                    pending.extend(self._drain())
+                    if pending:
+                        self._insert(conn, pending)
+                        pending, ticks = [], 0
+                    self._maintain(conn, time.time())
+                    next_rollup = time.monotonic() + self.rollup_every
+            if pending:
+                self._insert(conn, pending)
+            self._maintain(conn, time.time())
+        except sqlite3.Error as exc:
+            self.error = str(exc)
+        finally:
+            conn.close()
+
+    def _drain(self) -> List[Tuple[object, ...]]:
+        """Забрать из очереди всё накопленное, не дожидаясь новых итераций.
+
+        Маркер остановки возвращается в очередь, чтобы цикл его увидел.
+        """
+
+        rows: List[Tuple[object, ...]] = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return rows
+            if item is None:
+                self._queue.put(None)
+                return rows
+            rows.extend(item)
+
+    def _insert(self, conn: sqlite3.Connection, rows: List[Tuple[object, ...]]) -> None:
+        new = {row[0] for row in rows} - self._probes
+        with conn:
+            conn.executemany("INSERT INTO samples (probe, ts, ok, rtt_ms, status) VALUES (?, ?, ?, ?, ?)", rows)
+            if new:
+                conn.executemany("INSERT OR IGNORE INTO probes (probe) VALUES (?)", [(probe,) for probe in new])
+        self._probes |= new
+        self.inserted += len(rows)
+
+    def _maintain(self, conn: sqlite3.Connection, now: float) -> None:
+        """Досчитать завершившиеся корзины свёрток и удалить старые сырые замеры."""
+
+        with conn:
+            for table, length in SQLITE_ROLLUPS:
+                self.rollup(conn, table, length, now)
+            if self.keep_days is not None:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'rollup_1h'").fetchone()
+                if row is not None:
+                    cutoff = min(now - self.keep_days * 86400.0, row[0])
+                    conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,))
+
+    @staticmethod
+    def rollup(conn: sqlite3.Connection, table: str, length: int, now: float) -> int:
+        """Свернуть корзины ``[отметка, начало текущей корзины)``; вернуть число строк."""
+
+        end = math.floor(now / length) * length
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (table,)).fetchone()
+        if row is not None:
+            start = row[0]
+        else:
+            first = conn.execute("SELECT MIN(ts) FROM samples").fetchone()[0]
+            if first is None:
+                return 0
+            start = math.floor(first / length) * length
+        if start >= end:
+            return 0
+        rollups: List[Tuple[object, ...]] = []
+        probes = [row[0] for row in conn.execute("SELECT probe FROM probes")]
+        for probe in probes:
+            # Диапазон по индексу (probe, ts), без просмотра всей таблицы
+            cursor = conn.execute(
+                "SELECT ts, ok, rtt_ms FROM samples WHERE probe = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (probe, start, end),
+            )
+            bucket: Optional[int] = None
+            bucket_rows: List[Tuple[int, Optional[float]]] = []
+            for ts, ok, rtt in cursor:
+                current = int(ts // length) * length
+                if current != bucket:
+                    if bucket is not None:
+                        rollups.append(rollup_row(probe, bucket, bucket_rows))
+                    bucket, bucket_rows = current, []
+                bucket_rows.append((ok, rtt))
+            if bucket is not None:
+                rollups.append(rollup_row(probe, bucket, bucket_rows))
+        conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rollups)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (table, end))
+        return len(rollups)
+
+
+###############################################################################
+# Delta STATUS encoding
+###############################################################################
+
+
+def flatten_state(state: Dict[str, object], prefix: Tuple[str, ...] = ()) -> Dict[Tuple[str, ...], object]:
+    """Развернуть вложенные словари в ``{путь: значение}``; списки — листья."""
+
+    flat: Dict[Tuple[str, ...], object] = {}
+    for key, value in state.items():
+        path = prefix + (str(key),)
+        if isinstance(value, dict) and value:
+            flat.update(flatten_state(value, path))
+        else:
+            flat[path] = value
+    return flat
+
+
+def unflatten_state(flat: Dict[Tuple[str, ...], object]) -> Dict[str, object]:
+    """Обратное к :func:`flatten_state`."""
+
+    state: Dict[str, object] = {}
+    for path, value in flat.items():
+        node = state
+        for key in path[:-1]:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                child = node[key] = {}
+            node = child
+        node[path[-1]] = value
+    return state
+
+
+class StatusDeltaEncoder:
+    """Кодирование STATUS‑записей ключевыми кадрами и разностями (``--status-delta``).
+
+    Полное состояние (``STATUS {...}``) пишется первой записью, раз в
+    ``keyframe_every`` секунд и после ротации лога; в остальные итерации —
+    ``DELTA {"t": смещение, "s": [[путь, значение]...], "d": [путь...]}``
+    только с изменившимися полями. Задержки (``*_ms``) считаются
+    изменившимися, если ушли от записанного значения больше чем на
+    ``rtt_tolerance``, скорости (``*_bps``) — больше чем на четверть.
+    Поля ``timestamp``/``uptime_seconds`` восстанавливаются из смещения ``t``.
+    """
+
+    VOLATILE_KEYS = ("timestamp", "uptime_seconds", "log_writer")
+    RTT_TOLERANCE = 5.0
+    BPS_TOLERANCE = 0.25
+
+    def __init__(self, keyframe_every: float = 600.0, rtt_tolerance: float = RTT_TOLERANCE) -> None:
+        self.keyframe_every = max(1.0, keyframe_every)
+        self.rtt_tolerance = max(0.0, rtt_tolerance)
+        self._reference: Optional[Dict[Tuple[str, ...], object]] = None
+        self._keyframe_at = 0.0
+        self._keyframe_time: Optional[datetime.datetime] = None
+        self._keyframe_requested = False
+
+    def reset(self) -> None:
+        """Следующая запись будет ключевым кадром."""
+
+        self._reference = None
+
+    def request_keyframe(self) -> None:
+        """Как :meth:`reset`, но из другого потока (``LogWriter.on_rotate``)."""
+
+        self._keyframe_requested = True
+
+    def _changed(self, path: Tuple[str, ...], old: object, new: object) -> bool:
+        if (
+            isinstance(old, (int, float)) and isinstance(new, (int, float))
+            and not isinstance(old, bool) and not isinstance(new, bool)
+        ):
+            if path[-1].endswith("_ms"):
+                return abs(new - old) > self.rtt_tolerance
+            if path[-1].endswith("_bps"):
+                return abs(new - old) > self.BPS_TOLERANCE * max(abs(old), 1.0)
+        return old != new
+
+    def encode(self, state: Dict[str, object]) -> Tuple[str, Dict[str, object]]:
+        """Вернуть ``("STATUS", состояние)`` или ``("DELTA", разность)``."""
+
+        requested, self._keyframe_requested = self._keyframe_requested, False
+        now = time.monotonic()
+        timestamp = state.get("timestamp")
+        try:
+            current_time = datetime.datetime.fromisoformat(str(timestamp))
+        except ValueError:
+            current_time = None
+        keyframe = (
+            self._reference is None
+            or now - self._keyframe_at >= self.keyframe_every
+            or requested
+            or current_time is None
+            or self._keyframe_time is None
+        )
+        flat = {path: value for path, value in flatten_state(state).items() if path[0] not in self.VOLATILE_KEYS}
+        if keyframe:
+            self._reference = flat
+            self._keyframe_at = now
+            self._keyframe_time = current_time
+            return "STATUS", state
+        assert self._reference is not None and current_time is not None and self._keyframe_time is not None
+        changed: List[List[object]] = []
+        for path, value in flat.items():
+            if path not in self._reference or self._changed(path, self._reference[path], value):
+                changed.append([list(path), value])
+                self._reference[path] = value
+        removed = [list(path) for path in self._reference if path not in flat]
+        for path in removed:
+            del self._reference[tuple(path)]
+        delta: Dict[str, object] = {"t": round((current_time - self._keyframe_time).total_seconds(), 3)}
+        if changed:
+            delta["s"] = changed
+        if removed:
+            delta["d"] = removed
+        return "DELTA", delta
+
+
+# Поля, по которым сравнивается состояние (:func:`status_projection`)
+STATUS_PROJECTION_FIELDS = frozenset(
+    {
+        "ok", "status", "error", "timeout", "summary", "ip", "addresses", "rcode", "down", "last_event",
+        "overruns", "missed_ticks",
+    }
+)
+# Разделы, где все числа, кроме счётчиков, — миллисекунды без суффикса ``_ms``
+STATUS_PROJECTION_MS_SECTIONS = frozenset({"latency"})
+
+
+def status_projection(
+    state: Dict[str, object],
+    exclude: Iterable[str] = (),
+    rtt_tolerance: float = StatusDeltaEncoder.RTT_TOLERANCE,
+    bps_tolerance: float = StatusDeltaEncoder.BPS_TOLERANCE,
+) -> Dict[str, object]:
+    """Значимая часть состояния для проверки «изменилось ли что‑то».
+
+    Остаются только исходы проверок и события цикла
+    (:data:`STATUS_PROJECTION_FIELDS`) и корзины задержек и скоростей:
+    ``*_ms`` и перцентили разделов :data:`STATUS_PROJECTION_MS_SECTIONS` —
+    шагом ``rtt_tolerance``, ``*_bps`` — логарифмически с шагом
+    ``bps_tolerance`` (те же допуски, что у :class:`StatusDeltaEncoder`).
+    Счётчики и прочие поля, растущие каждую итерацию, а также верхние ключи
+    из ``exclude`` не учитываются.
+    """
+
+    skipped = set(exclude)
+    projection: Dict[str, object] = {}
+    for path, value in flatten_state(state).items():
+        if path[0] in skipped:
+            continue
+        field = path[-1]
+        key = "/".join(path)
+        if field in STATUS_PROJECTION_FIELDS:
+            projection[key] = value
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if field.endswith("_ms") or (path[0] in STATUS_PROJECTION_MS_SECTIONS and field != "count"):
+                projection[key] = round(value / rtt_tolerance) if rtt_tolerance > 0 else value
+            elif field.endswith("_bps"):
+                projection[key] = round(math.log1p(max(0.0, value)) / math.log1p(bps_tolerance))
+    return projection
+
+
+class StatusReconstructor:
+    """Восстановление полного состояния из ключевых кадров и DELTA‑строк.
+
+    DELTA до первого ключевого кадра (или после ``NETWATCH START``) не к чему
+    применить — такие записи пропускаются (:meth:`delta` вернёт ``None``).
+    """
+
+    def __init__(self) -> None:
+        self._flat: Optional[Dict[Tuple[str, ...], object]] = None
+        self._keyframe_time: Optional[datetime.datetime] = None
+        self._uptime: Optional[int] = None
+
+    def reset(self) -> None:
+        self._flat = None
+
+    def keyframe(self, state: Dict[str, object]) -> Dict[str, object]:
+        self._flat = flatten_state(state)
+        try:
+            self._keyframe_time = datetime.datetime.fromisoformat(str(state.get("timestamp")))
+        except ValueError:
+            self._keyframe_time = None
+        uptime = state.get("uptime_seconds")
+        self._uptime = uptime if isinstance(uptime, int) else None
+        return state
+
+    def delta(self, delta: Dict[str, object]) -> Optional[Dict[str, object]]:
+        if self._flat is None:
+            return None
+        for path, value in delta.get("s") or []:  # type: ignore[union-attr]
+            self._flat[tuple(path)] = value
+        for path in delta.get("d") or []:  # type: ignore[union-attr]
+            self._flat.pop(tuple(path), None)
+        state = unflatten_state(self._flat)
+        offset = float(delta.get("t") or 0.0)  # type: ignore[arg-type]
+        if self._keyframe_time is not None:
+            state["timestamp"] = (self._keyframe_time + datetime.timedelta(seconds=offset)).isoformat()
+        if self._uptime is not None:
+            state["uptime_seconds"] = self._uptime + int(offset)
+        return state
+
+
+###############################################################################
+# NetWatch implementation
+###############################################################################
+
+
+class NetWatch:
+    """Monitor network connectivity and write logs.
+
+    This class encapsulates the state and behaviour of the network monitor.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        log_file: Path,
+        ping_targets: List[str],
+        service_endpoints: List[Tuple[str, str, str]],
+        throughput_enabled: bool,
+        plain_output: bool,
+        primary_host: str,
+        primary_path: str,
+        primary_scheme: str,
+        primary_method: str,
+        ping_timeout: float,
+        http_timeout: float,
+        status_file: Optional[Path],
+        logger: logging.Logger,
+        max_workers: int = 8,
+        engine: str = "threads",
+        tick_deadline: Optional[float] = None,
+        ping_mode: str = "auto",
+        ping_stream_interval: Optional[float] = None,
+        http_keepalive: bool = False,
+        probe_intervals: Optional[Dict[str, float]] = None,
+        schedule_jitter: Optional[float] = None,
+        adaptive: bool = False,
+        adaptive_max: float = 8.0,
+        adaptive_burst: float = 0.25,
+        log_writer: Optional[LogWriter] = None,
+        status_heartbeat: float = 30.0,
+        metrics: Optional[MetricsExporter] = None,
+        dns_resolvers: Optional[List[str]] = None,
+        link_events: bool = True,
+        throughput_sample: float = 0.5,
+        throughput_tau: float = 5.0,
+        agent: Optional["AgentPublisher"] = None,
+        sample_store: Optional[SampleStore] = None,
+        status_log: bool = True,
+        sqlite_sink: Optional[SqliteSink] = None,
+        status_delta: Optional[StatusDeltaEncoder] = None,
+        missed_ticks: str = "skip",
+    ) -> None:
+        self.interval = max(0.5, interval)
+        self.log_file = log_file
+        # Фоновая запись лога; None — прежний режим "открыть‑дописать‑закрыть"
+        self._log_writer = log_writer
+        # Эндпоинт /metrics (--metrics-port); снимок обновляется в _publish
+        self._metrics = metrics
+        # Отправка состояния агрегатору (--push)
+        self._agent = agent
+        # Двоичные ряды замеров; текстовые STATUS‑строки можно отключить
+        self._samples = sample_store
+        self.status_log = status_log
+        # Разностная запись STATUS (--status-delta)
+        self._delta = status_delta
+        if log_writer is not None and status_delta is not None:
+            # Каждый сегмент runlog должен начинаться с ключевого кадра
+            log_writer.on_rotate = status_delta.request_keyframe
+        # База SQLite с замерами и свёртками (--sqlite)
+        self._sqlite = sqlite_sink
+        self.ping_targets = ping_targets
+        # service_endpoints: list of (domain, path, scheme) entries
+        self.service_endpoints = service_endpoints
+        self.throughput_enabled = throughput_enabled and nic_counters() is not None
+        # Фоновый замер трафика по интерфейсам (--throughput-sample)
+        self._throughput: Optional[ThroughputSampler] = (
+            ThroughputSampler(throughput_sample, throughput_tau) if self.throughput_enabled else None
+        )
+        self.plain_output = plain_output
+        self.primary_host = primary_host
+        self.primary_path = primary_path if primary_path.startswith("/") else f"/{primary_path}"
+        self.primary_scheme = primary_scheme.lower() or "https"
+        self.primary_method = primary_method.upper()
+        self.ping_timeout = max(0.2, ping_timeout)
+        self.http_timeout = max(1.0, http_timeout)
+        self.status_file = status_file
+        # Файл статуса переписывается только при изменении содержимого, но
+        # не реже раза в status_heartbeat секунд (чтобы timestamp не застывал)
+        self.status_heartbeat = max(0.0, status_heartbeat)
+        self._status_seq = 0
+        self._status_digest: Optional[str] = None
+        self._status_written_at = 0.0
+        # Скользящие перцентили задержек по каждой проверке (см. state_samples)
+        self._latency: Dict[str, RollingLatency] = {}
+        self.logger = logger
+        # Сколько проверок одной итерации может выполняться одновременно;
+        # 1 — прежний последовательный режим без пула потоков.
+        self.max_workers = max(1, int(max_workers))
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        # "threads" — пул потоков, "async" — AsyncProbeEngine на asyncio
+        self.engine = engine
+        # Бюджет итерации (--tick-budget): что не успело, помечается timeout.
+        # Async‑движок всегда держит дедлайн (по умолчанию = интервал), пул
+        # потоков — только при явно заданном бюджете
+        self.tick_budget = tick_deadline if tick_deadline and tick_deadline > 0 else None
+        self.tick_deadline = self.tick_budget or self.interval
+        # Расписание цикла, отставание и перерасход бюджета (--missed-ticks)
+        self._clock = TickClock(self.tick_deadline, missed_ticks)
+        # Проверки, снятые по бюджету, но ещё занимающие пул: повторно не запускаются
+        self._inflight: Dict[Hashable, concurrent.futures.Future] = {}
+        # ICMP: "auto" — сокет, если доступен, иначе ping; "icmp" — только
+        # сокет; "subprocess" — ping на каждую итерацию; "stream" — постоянный
+        # процесс ping на цель
+        self.ping_mode = ping_mode
+        self._icmp: Optional[IcmpProber] = IcmpProber.create() if ping_mode in ("auto", "icmp") else None
+        # Прямой опрос резолверов (--dns-resolvers) вместо getaddrinfo
+        self._dns: Optional[DnsProber] = DnsProber(dns_resolvers) if dns_resolvers else None
+        self.ping_stream_interval = ping_stream_interval or self.interval
+        self._ping_streams: Dict[str, PingStream] = {}
+        # Keep-alive пул для HTTP‑проверок (только движок threads)
+        self._http_pool: Optional[HttpConnectionPool] = HttpConnectionPool() if http_keepalive else None
+        # Индивидуальные интервалы проверок (ключ — группа или точное имя).
+        # Если заданы, проверки идут по ProbeScheduler, а итерация лишь
+        # публикует последние результаты.
+        self.probe_intervals = dict(probe_intervals or {})
+        self.schedule_jitter = 0.1 if schedule_jitter is None else schedule_jitter
+        self._scheduler: Optional[ProbeScheduler] = None
+        # Адаптивная частота: без планировщика — общий интервал цикла,
+        # с планировщиком — интервал каждой проверки
+        self.adaptive = adaptive
+        self.adaptive_max = adaptive_max
+        self.adaptive_burst = adaptive_burst
+        self._loop_policy: Optional[AdaptiveInterval] = self._make_policy(self.interval) if adaptive else None
+        # Переход "up"/"down", случившийся на последней итерации
+        self._last_transition: Optional[str] = None
+        self._ansi_enabled = False
+        # Последний выведенный кадр панели и размер терминала для него
+        self._frame: List[str] = []
+        self._frame_size: Optional[Tuple[int, int]] = None
+
+        # Track downtime intervals
+        self._downtime_start: Optional[datetime.datetime] = None
+        self._downtime_total: datetime.timedelta = datetime.timedelta()
+        self._started_at: datetime.datetime = datetime.datetime.now()
+        # Stop flag for the main loop
+        self._stop_event = threading.Event()
+        # Внеочередная итерация (событие линка); stop() тоже будит цикл
+        self._wake = threading.Event()
+        # События линков/маршрутов (Linux netlink): локальный IP берётся из
+        # кэша, пока таблица маршрутов не изменилась
+        self._local_ip_cache: Optional[Dict[str, Optional[str]]] = None
+        self._link: Optional[LinkMonitor] = LinkMonitor.create(self._on_link_change) if link_events else None
+        # Try to enable ANSI/VT sequences on Windows consoles for proper clearing
+        self._configure_console()
+
+    # -------------------------------------------------------------------------
+    # State gathering helpers
+    # -------------------------------------------------------------------------
+
+    def get_local_ip(self) -> Dict[str, Optional[str]]:
+        """Return a mapping with your outward‑facing IP address.
+
+        The method opens an unbound UDP socket and connects it to a public
+        resolver (8.8.8.8:80). The OS routing table determines which
+        interface and address will be used for this connection. No data is
+        actually sent over the network, but ``socket.getsockname`` returns
+        the local endpoint of the socket. If any error occurs, ``ip`` is
+        ``None`` and ``error`` will contain a human readable message.
+
+        When the netlink listener is active the answer is cached until the
+        next link, address or default route change.
+        """
+
+        cached = self._local_ip_cache
+        if cached is not None:
+            return dict(cached)
+        result: Dict[str, Optional[str]] = {"ip": None, "error": None}
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # The address below need not be reachable; it's only used to choose
+            # the correct outbound interface. See e.g. RFC 1122 for details.
+            sock.connect(("8.8.8.8", 80))
+            result["ip"] = sock.getsockname()[0]
+            if self._link is not None:
+                self._local_ip_cache = dict(result)
+        except Exception as exc:
+            result["error"] = str(exc)
+        finally:
+            try:
+                sock.close()
+            except Exception:
+                pass
+        return result
+
+    def ping_host(self, host: str, timeout: Optional[float] = None) -> Dict[str, Optional[object]]:
+        """Ping an IPv4 host using the system ``ping`` command.
+
+        ICMP echo requests normally require elevated privileges to send raw
+        packets. To avoid requiring administrative rights, this function
+        delegates to the platform’s ``ping`` utility via ``subprocess``. On
+        Windows a single echo request is sent using ``ping -n 1 -w
+        timeout_ms``; on POSIX systems ``ping -c 1 -W timeout`` is used.
+
+        Returns a dictionary with keys ``ok`` (bool), ``rtt_ms`` (float or
+        ``None``) and ``error`` (string or ``None``).
+        """
+
+        result: Dict[str, Optional[object]] = {
+            "ok": False,
+            "rtt_ms": None,
+            "error": None,
+        }
+        timeout = self.ping_timeout if timeout is None else timeout
+        try:
+            proc = subprocess.run(
+                ping_command(host, timeout), capture_output=True, text=True, encoding="utf-8", errors="ignore"
+            )
+            result = parse_ping_reply(proc.returncode, proc.stdout + proc.stderr)
+        except FileNotFoundError:
+            # If the ping utility is not available, we cannot perform the test.
+            result["error"] = "ping не найден"
+        except Exception as exc:
+            result["error"] = str(exc)
+        return result
+
+    def _ping_stream(self, host: str) -> PingStream:
+        """Вернуть (и при первом обращении запустить) постоянный ping для цели."""
+
+        stream = self._ping_streams.get(host)
+        if stream is None:
+            stream = PingStream(host, self.ping_stream_interval, self.ping_timeout)
+            stream.start()
+            self._ping_streams[host] = stream
+        return stream
+
+    def _native_ping_enabled(self) -> bool:
+        return self._icmp is not None or self.ping_mode == "icmp"
+
+    def ping_all(self, timeout: Optional[float] = None) -> Dict[str, Dict[str, Optional[object]]]:
+        """Пропинговать все цели разом через встроенный ICMP‑сокет."""
+
+        if self._icmp is None:
+            return {
+                host: {"ok": False, "rtt_ms": None, "error": "ICMP-сокет недоступен"} for host in self.ping_targets
+            }
+        return self._icmp.ping_many(self.ping_targets, self.ping_timeout if timeout is None else timeout)
+
+    def resolve_host(self, host: str) -> Dict[str, Optional[object]]:
+        """Разрешить домен через DNS.
+
+        Возвращает словарь ``ok`` (bool), ``addresses`` (list[str]) и
+        ``error``. Ошибка резолва фиксируется как ``ok=False``. С
+        ``--dns-resolvers`` запрос идёт напрямую к каждому резолверу
+        (см. :meth:`resolve_direct`).
+        """
+
+        if self._dns is not None:
+            return self.resolve_direct(host)
+        result: Dict[str, Optional[object]] = {
+            "ok": False,
+            "addresses": None,
+            "error": None,
+        }
+        try:
+            infos = socket.getaddrinfo(host, 443, proto=socket.IPPROTO_TCP)
+            addresses = []
+            for info in infos:
+                addr = info[4][0]
+                if addr not in addresses:
+                    addresses.append(addr)
+            result["addresses"] = addresses
+            result["ok"] = bool(addresses)
+        except Exception as exc:
+            result["error"] = str(exc)
+        return result
+
+    def resolve_direct(self, host: str, timeout: Optional[float] = None) -> Dict[str, Optional[object]]:
+        """Опросить резолверы ``--dns-resolvers`` и свести ответы.
+
+        ``resolvers`` содержит результат по каждому резолверу; проверка
+        успешна, если ответил хотя бы один, ``rtt_ms`` — самый быстрый ответ.
+        """
+
+        assert self._dns is not None
+        per_resolver = self._dns.resolve(host, self.http_timeout if timeout is None else timeout)
+        addresses: List[str] = []
+        for res in per_resolver.values():
+            if res.get("ok"):
+                addresses.extend(addr for addr in res.get("addresses") or [] if addr not in addresses)  # type: ignore[union-attr]
+        rtts = [res["rtt_ms"] for res in per_resolver.values() if res.get("ok") and res.get("rtt_ms") is not None]
+        errors = [f"{label}: {res.get('error')}" for label, res in per_resolver.items() if not res.get("ok")]
+        return {
+            "ok": bool(addresses),
+            "addresses": addresses,
+            "rtt_ms": min(rtts) if rtts else None,  # type: ignore[type-var]
+            "error": None if addresses else "; ".join(errors) or None,
+            "resolvers": per_resolver,
+        }
+
+    def check_primary_http(self) -> Dict[str, Optional[object]]:
+        """Проверить основной HTTP/HTTPS‑хост HEAD/GET запросом.
+
+        Помимо ``ok``/``status``/``error`` возвращает ``timing`` с временем
+        DNS, TCP‑connect, TLS, до первого байта и общим (мс).
+        """
+
+        if self._http_pool is not None:
+            return self._http_pool.check(
+                self.primary_scheme, self.primary_host, self.primary_method, self.primary_path, self.http_timeout
+            )
+        result: Dict[str, Optional[object]] = {
+            "ok": False,
+            "status": None,
+            "error": None,
+        }
+        timing: Dict[str, Optional[float]] = {}
+        conn: Optional[http.client.HTTPConnection] = None
+        try:
+            conn = timed_http_connection(self.primary_scheme, self.primary_host, self.http_timeout)
+            resp, _body = http_exchange(conn, self.primary_method, self.primary_path, timing)
+            result["status"] = resp.status
+            # Любой ответ от сервера значит, что соединение и TLS установились
+            result["ok"] = True
+        except Exception as exc:
+            result["error"] = str(exc)
+        finally:
+            result["timing"] = timing
+            try:
+                if conn is not None:
+                    conn.close()
+            except Exception:
+                pass
+        return result
+
+    def check_service(self, host: str, path: str, scheme: str) -> Dict[str, Optional[object]]:
+        """Check a given HTTP/HTTPS endpoint for network reachability.
+
+        The function performs a GET request to the specified host and path.
+        A response status of 204 (No Content) or 200 is treated as
+        success. These endpoints are commonly used by operating systems
+        and browsers to detect captive portals: if the request is
+        redirected to a login page or times out, ``ok`` will be False.
+        See for example the connectivity test URLs documented in May 2025
+        by Anton Zhiyanov【971457281900871†L14-L31】.
+
+        :param host: Domain name to contact, e.g. ``google.com``.
+        :param path: URL path to request, e.g. ``/generate_204``.
+        :param scheme: Either ``http`` or ``https``.
+        :returns: dict with ``ok`` (bool), ``status`` (int or None),
+                  ``error`` (str or None) and ``timing`` (per‑phase ms, see
+                  :func:`http_exchange`).
+        """
+
+        if self._http_pool is not None:
+            return self._http_pool.check(scheme, host, "GET", path, 5.0, accept=(200, 204))
+        result: Dict[str, Optional[object]] = {
+            "ok": False,
+            "status": None,
+            "error": None,
+        }
+        timing: Dict[str, Optional[float]] = {}
+        conn: Optional[http.client.HTTPConnection] = None
+        try:
+            conn = timed_http_connection(scheme, host, 5.0)
+            resp, _body = http_exchange(conn, "GET", path, timing)
+            result["status"] = resp.status
+            # For captive portal detection endpoints we accept 200 and 204
+            if resp.status in (200, 204):
+                result["ok"] = True
+        except Exception as exc:
+            result["error"] = str(exc)
+        finally:
+            result["timing"] = timing
+            try:
+                if conn is not None:
+                    conn.close()
+            except Exception:
+                pass
+        return result
+
+    def measure_throughput(self) -> Dict[str, object]:
+        """Measure aggregate bytes per second in and out.
+
+        Counters come from :class:`ThroughputSampler`, which reads per‑NIC
+        counters (``psutil`` or ``/proc/net/dev``) in the background. The
+        aggregate rate is the byte delta divided by the real elapsed time
+        since the previous call, and ``interfaces`` holds per‑NIC instant,
+        EWMA and peak rates. If throughput monitoring is disabled or no
+        counter source exists, both values will be ``None``.
+        """
+
+        if self._throughput is None:
+            return {"in_bps": None, "out_bps": None}
+        return self._throughput.snapshot()
+
+    def _update_downtime(self, summary: str, now_dt: datetime.datetime) -> datetime.timedelta:
+        """Зафиксировать длительность простоя/аптайма и вернуть накопленный простой."""
+
+        is_up = summary_is_up(summary)
+        self._last_transition = None
+        if not is_up:
+            if self._downtime_start is None:
+                self._downtime_start = now_dt
+                self._last_transition = "down"
+                self._on_down()
+        else:
+            if self._downtime_start is not None:
+                self._last_transition = "up"
+                duration = now_dt - self._downtime_start
+                self._downtime_total += duration
+                human_duration = str(duration).split(".")[0]
+                self._write_log(f"DOWNTIME {human_duration}")
+                self._downtime_start = None
+
+        if self._downtime_start is not None:
+            return self._downtime_total + (now_dt - self._downtime_start)
+        return self._downtime_total
+
+    def _make_policy(self, base: float) -> AdaptiveInterval:
+        return AdaptiveInterval(base, max_factor=self.adaptive_max, burst_factor=self.adaptive_burst)
+
+    def _on_down(self) -> None:
+        """Начало простоя: адаптивный режим сразу переходит на частый опрос."""
+
+        if not self.adaptive:
+            return
+        if self._loop_policy is not None:
+            self._loop_policy.burst()
+        if self._scheduler is not None:
+            self._scheduler.burst_all()
+
+    def _on_link_change(self, event: str) -> None:
+        """Событие netlink: сбросить кэш IP и провести внеочередную итерацию.
+
+        Вызывается из потока :class:`LinkMonitor`. С планировщиком все
+        проверки перезапускаются сразу, иначе будится основной цикл.
+        """
+
+        self._local_ip_cache = None
+        self._write_log(f"LINK {event}")
+        self._on_down()
+        if self._scheduler is not None:
+            self._scheduler.trigger_all()
+        else:
+            self._wake.set()
+
+    def _end_tick(self, state: Optional[Dict[str, object]]) -> float:
+        """Закрыть итерацию в расписании и вернуть паузу до следующей."""
+
+        overruns, missed = self._clock.overruns, self._clock.missed
+        sleep_time = self._clock.end(self._next_interval(state))
+        if self._clock.overruns != overruns:
+            # Узкое место — сам монитор, а не сеть: фиксируем в логе сразу
+            self._write_log(
+                f"LOOP OVERRUN duration={self._clock.duration * 1000.0:.0f}ms "  # type: ignore[operator]
+                f"budget={self.tick_deadline * 1000.0:.0f}ms lag={self._clock.lag * 1000.0:.0f}ms "
+                f"missed={self._clock.missed - missed} policy={self._clock.policy}",
+                level="WARN",
+            )
+        return sleep_time
+
+    def _wait_tick(self, timeout: float) -> bool:
+        """Пауза до следующей итерации; ``True`` — разбужены событием линка."""
+
+        woken = self._wake.wait(timeout)
+        self._wake.clear()
+        return woken and not self._stop_event.is_set()
+
+    def _next_interval(self, state: Optional[Dict[str, object]] = None) -> float:
+        """Пауза до следующей итерации: фиксированная или адаптивная."""
+
+        if self._loop_policy is None or self._scheduler is not None:
+            return self.interval
+        if state is None or self._downtime_start is not None:
+            # Сбой итерации или идёт простой — держим частый опрос
+            return self._loop_policy.burst()
+        primary = state.get("primary_http") or {}
+        rtt = primary.get("timing", {}).get("total_ms") if isinstance(primary, dict) else None
+        # Реже опрашиваем только когда здоровы все проверки, а не лишь сводка
+        healthy = all(ok for _name, ok, _rtt, _status in state_samples(state))
+        return self._loop_policy.observe(healthy, rtt)
+
+    def _log_inline_error(self, message: object) -> None:
+        """Записать ошибку в текущий лог, не прерывая работу."""
+
+        self._write_log(f"{message}", level="ERROR")
+
+    # Разделы, которые меняются каждую итерацию и не считаются изменением статуса
+    _VOLATILE_STATUS_KEYS = ("timestamp", "uptime_seconds", "downtime_seconds", "log_writer")
+
+    def _write_status_file(self, state: Dict[str, object]) -> None:
+        """Сохранить последний статус в JSON (для внешнего мониторинга).
+
+        Файл публикуется атомарно: компактный JSON пишется во временный файл
+        рядом и переименовывается поверх (``os.replace``), так что читатель
+        никогда не видит оборванный документ. Сравнивается не весь документ,
+        а :func:`status_projection` — исходы проверок, корзины RTT/скоростей,
+        скользящих перцентилей и отставания цикла, без разделов
+        ``_VOLATILE_STATUS_KEYS`` (время, счётчики). Если проекция не
+        изменилась, запись пропускается, пока не истечёт ``status_heartbeat``,
+        так что перцентили и ``loop`` в файле отстают не больше чем на допуск
+        одной корзины. Каждая публикация
+        получает растущий ``seq`` и ``content_hash`` (хеш проекции).
+        """
+
+        if not self.status_file:
+            return
+        try:
+            tolerance = self._delta.rtt_tolerance if self._delta is not None else StatusDeltaEncoder.RTT_TOLERANCE
+            stable = status_projection(state, self._VOLATILE_STATUS_KEYS, rtt_tolerance=tolerance)
+            content = json.dumps(stable, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+            digest = hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+            now = time.monotonic()
+            if digest == self._status_digest and now - self._status_written_at < self.status_heartbeat:
+                return
+            self._status_seq += 1
+            document = {**state, "seq": self._status_seq, "content_hash": digest}
+            payload = json.dumps(document, ensure_ascii=False, separators=(",", ":"), default=str)
+            self.status_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.status_file.with_name(f".{self.status_file.name}.{os.getpid()}.tmp")
+            with tmp_path.open("w", encoding="utf-8") as fh:
+                fh.write(payload)
+            os.replace(tmp_path, self.status_file)
+            self._status_digest = digest
+            self._status_written_at = now
+        except Exception as exc:
+            # Не шумим в консоли, только тихий лог
+            self.logger.debug("Не удалось записать файл статуса: %s", exc, exc_info=False)
+
+    def _write_log(self, message: str, level: str = "INFO", keyframe: Optional[Dict[str, object]] = None) -> None:
+        """Единый формат логов, совпадающий с исходным netwatch.cpp."""
+
+        ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        line = f"{ts} | {level.upper():<5} | {message}\n"
+        if self._log_writer is not None and self._log_writer.running:
+            self._log_writer.write(line, keyframe)
+            return
+        try:
+            with self.log_file.open("a", encoding="utf-8") as fh:
+                fh.write(line)
+        except Exception:
+            pass
+
+    def _configure_console(self) -> None:
+        """Включить ANSI при возможности и подготовить функции очистки."""
+
+        if self.plain_output:
+            self._ansi_enabled = False
+            return
+        if sys.stdout.isatty() and enable_windows_ansi():
+            self._ansi_enabled = True
+        else:
+            self._ansi_enabled = False
+
+    def _clear_screen(self) -> None:
+        """Очистить экран, учитывая поддержку ANSI."""
+
+        if self.plain_output:
+            return
+        if self._ansi_enabled:
+            sys.stdout.write("\x1b[2J\x1b[H")
+            return
+        # Fallback: системная команда очистки, чтобы не печатать коды в логи
+        try:
+            if os.name == "nt":
                 os.system("cls")
             else:
-                sys.stdout.write("\n" * 60)
-        except Exception:
-            pass
+                sys.stdout.write("\n" * 60)
+        except Exception:
+            pass
+
+    # -------------------------------------------------------------------------
+    # Logging and presentation
+    # -------------------------------------------------------------------------
+
+    def summarise_state(
+        self,
+        ip_info: Dict[str, Optional[str]],
+        ping_info: Dict[str, Dict[str, Optional[object]]],
+        dns_info: Dict[str, Optional[object]],
+        primary_http: Dict[str, Optional[object]],
+        services: Dict[str, Dict[str, Optional[object]]],
+    ) -> str:
+        """Сформировать краткий вывод о состоянии подключения."""
+
+        # Check local IP
+        if ip_info.get("ip") is None:
+            return "Нет активного IP – сетевой интерфейс не в сети"
+
+        # Check ping results. If all targets failed we might still be
+        # connected to the Internet if ICMP is blocked. We'll defer
+        # judgement until DNS/HTTP checks.
+        ping_ok = any(res.get("ok") for res in ping_info.values())
+
+        # Check DNS
+        if not dns_info.get("ok"):
+            return f"Проблема DNS – не удалось разрешить {self.primary_host}"
+
+        # Check captive portal endpoints
+        if services:
+            captive_ok = all(res.get("ok") for res in services.values())
+        else:
+            captive_ok = True
+
+        # Check primary HTTP
+        if not primary_http.get("ok"):
+            if ping_ok and captive_ok:
+                return f"Проблема соединения с {self.primary_host}"
+            return f"Проблема HTTPS до {self.primary_host} – возможно нет интернета"
+
+        # If we've reached here everything required is working
+        if not ping_ok:
+            # ICMP might be blocked but everything else works
+            return "Интернет доступен – ICMP может быть заблокирован"
+        return f"OK – интернет и {self.primary_host} доступны"
+
+    # Производные сводки, которые восстанавливаются из самих STATUS‑записей
+    _LOG_EXCLUDED_KEYS = ("latency",)
+
+    def log_entry(self, state: Dict[str, object]) -> None:
+        """Write a structured JSON‑like log entry for the current state."""
+
+        try:
+            logged = {key: value for key, value in state.items() if key not in self._LOG_EXCLUDED_KEYS}
+            kind: str = "STATUS"
+            record: Dict[str, object] = logged
+            if self._delta is not None:
+                kind, record = self._delta.encode(logged)
+            if kind == "DELTA":
+                payload = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+                # Полное состояние — на случай, если строка откроет новый сегмент
+                self._write_log(f"{kind} {payload}", keyframe=logged)
+            else:
+                self._write_log(f"{kind} {json.dumps(record, ensure_ascii=False)}")
+        except Exception as exc:
+            sys.stderr.write(f"Не удалось записать в лог: {exc}\n")
+
+    @staticmethod
+    def _latency_details(state: Dict[str, object], name: str) -> str:
+        """Хвост строки панели: перцентили за минуту и джиттер проверки."""
+
+        latency = state.get("latency")
+        if not isinstance(latency, dict) or name not in latency:
+            return ""
+        stats = latency[name]
+        minute = stats.get("1m") or {}
+        if not minute.get("count"):
+            return ""
+        text = f"  [1m p50 {minute['p50']:.1f} p95 {minute['p95']:.1f} p99 {minute['p99']:.1f}"
+        text += f" min {minute['min']:.1f} max {minute['max']:.1f}"
+        if stats.get("jitter_ms") is not None:
+            text += f" jitter {stats['jitter_ms']:.1f}"
+        return text + "]"
+
+    @staticmethod
+    def _http_details(res: Dict[str, Optional[object]]) -> str:
+        """Хвост строки панели с задержкой и фазами HTTP‑запроса, если они измерены."""
+
+        text = ""
+        timing = res.get("timing") or {}
+        if isinstance(timing, dict) and timing.get("total_ms") is not None:
+            parts = []
+            for label, field in (("dns", "dns_ms"), ("tcp", "connect_ms"), ("tls", "tls_ms"), ("ttfb", "ttfb_ms")):
+                if timing.get(field) is not None:
+                    parts.append(f"{label} {timing[field]:.1f}")
+            parts.append(f"total {timing['total_ms']:.1f} ms")
+            text += "  " + " / ".join(parts)
+        if res.get("connection"):
+            text += f" ({res.get('connection')})"
+        if res.get("cold_ms") is not None and res.get("reused_ms") is not None:
+            text += f"  cold={res.get('cold_ms'):.1f} reused={res.get('reused_ms'):.1f}"
+        return text
+
+    def update_console(self, state: Dict[str, object], summary: str) -> None:
+        """Render the current diagnostic state to the terminal.
+
+        The frame is assembled in memory and handed to :meth:`_render_frame`,
+        which repaints only the changed lines when ANSI is available. Colours
+        are used unless ``plain_output`` is true. The dashboard contains sections
+        for the local IP, ping targets, DNS resolution, OpenAI HTTP
+        connectivity, additional service checks and throughput.
+        """
+
+        # Choose colours based on summary: green for OK, red for problems,
+        # yellow for warnings
+        use_color = self._ansi_enabled and not self.plain_output
+        col = AnsiColor.GREEN if use_color else ""
+        if summary.startswith("Проблема"):
+            col = AnsiColor.RED if use_color else ""
+        elif summary.startswith("Интернет"):
+            col = AnsiColor.YELLOW if use_color else ""
+        frame: List[str] = []
+        write = frame.append
+        # Header
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        interval = self._loop_policy.current if self._loop_policy is not None and self._scheduler is None else self.interval
+        header = f"NETWATCH PY    {now}    интервал: {interval:.2f}с"
+        if self.adaptive:
+            header += " (адаптивный)"
+        write(header + "\n")
+        write("-" * len(header) + "\n")
+        now_dt = datetime.datetime.now()
+        uptime = human_timedelta(now_dt - self._started_at)
+        downtime = self._downtime_total
+        if self._downtime_start:
+            downtime += now_dt - self._downtime_start
+        write(f"Время работы : {uptime}\n")
+        write(f"Простой      : {human_timedelta(downtime)}\n\n")
+        # Summary
+        if self.plain_output or not use_color:
+            write(f"Статус: {summary}\n\n")
+        else:
+            write(f"Общий статус: {col}{summary}{AnsiColor.RESET}\n\n")
+        # Local IP
+        if ip := state.get("ip", {}).get("ip"):
+            write(f"Локальный IP   : {ip}\n")
+        else:
+            err = state.get("ip", {}).get("error") or "unknown"
+            write(f"Локальный IP   : [ошибка] {err}\n")
+        link = state.get("link")
+        if isinstance(link, dict):
+            down = ", ".join(link.get("down") or [])
+            if down:
+                text = f"{AnsiColor.RED}down: {down}{AnsiColor.RESET}" if use_color else f"down: {down}"
+            else:
+                text = "все подняты"
+            write(f"Линки          : {text}\n")
+            if link.get("last_event"):
+                write(f"  событие      : {link.get('last_event')} ({link.get('last_event_at')})\n")
+        write("\n")
+        # Pings
+        write("Ping:\n")
+        for host, res in state.get("ping", {}).items():
+            ok = res.get("ok")
+            rtt = res.get("rtt_ms")
+            err = res.get("error")
+            if ok:
+                rtt_text = f"{rtt:.1f} ms" if rtt is not None else "n/a"
+                if use_color:
+                    line = f"  {host:<15}: {AnsiColor.GREEN}OK{AnsiColor.RESET}   rtt={rtt_text}"
+                else:
+                    line = f"  {host:<15}: OK   rtt={rtt_text}"
+            else:
+                msg = f"{err}" if err else "тайм-аут"
+                if use_color:
+                    line = f"  {host:<15}: {AnsiColor.RED}FAIL{AnsiColor.RESET} ({msg})"
+                else:
+                    line = f"  {host:<15}: FAIL ({msg})"
+            line += self._latency_details(state, f"ping/{host}")
+            if res.get("loss_pct") is not None:
+                # Постоянный ping: потери по всему потоку ответов
+                line += f"  loss={res.get('loss_pct'):.1f}% ({res.get('lost')}/{res.get('sent')})"
+            write(line + "\n")
+        write("\n")
+        # DNS
+        dns = state.get("dns", {})
+        dns_host = dns.get("host") or self.primary_host
+        if dns.get("ok"):
+            addrs = ", ".join(dns.get("addresses") or [])
+            if use_color:
+                line = f"DNS {dns_host:<17}: {AnsiColor.GREEN}OK{AnsiColor.RESET}   {addrs}"
+            else:
+                line = f"DNS {dns_host:<17}: OK   {addrs}"
+        else:
+            err = dns.get("error") or "ошибка"
+            if use_color:
+                line = f"DNS {dns_host:<17}: {AnsiColor.RED}FAIL{AnsiColor.RESET} ({err})"
+            else:
+                line = f"DNS {dns_host:<17}: FAIL ({err})"
+        write(line + "\n")
+        for label, res in (dns.get("resolvers") or {}).items():
+            # Прямой опрос резолверов: задержка, rcode и ответы каждого
+            if res.get("ok"):
+                status = f"{AnsiColor.GREEN}OK{AnsiColor.RESET}" if use_color else "OK"
+                line = f"  {label:<15}: {status}   {res.get('rtt_ms'):.1f} ms  {res.get('rcode')}"
+                if res.get("transport") == "tcp":
+                    line += "/tcp"
+                line += "  " + ", ".join(res.get("addresses") or [])
+            else:
+                status = f"{AnsiColor.RED}FAIL{AnsiColor.RESET}" if use_color else "FAIL"
+                line = f"  {label:<15}: {status} ({res.get('error')})"
+            line += self._latency_details(state, f"dns/{label}")
+            write(line + "\n")
+        write("\n")
+        # OpenAI HTTP
+        http = state.get("primary_http", {}) or state.get("openai_http", {})
+        if http.get("ok"):
+            status = http.get("status")
+            if use_color:
+                line = f"{self.primary_method} {self.primary_scheme.upper()} {dns_host:<12}: {AnsiColor.GREEN}OK{AnsiColor.RESET}   HTTP {status}"
+            else:
+                line = f"{self.primary_method} {self.primary_scheme.upper()} {dns_host:<12}: OK   HTTP {status}"
+            line += self._http_details(http)
+            line += self._latency_details(state, "primary")
+        else:
+            err = http.get("error") or "ошибка"
+            if use_color:
+                line = f"{self.primary_method} {self.primary_scheme.upper()} {dns_host:<12}: {AnsiColor.RED}FAIL{AnsiColor.RESET} ({err})"
+            else:
+                line = f"{self.primary_method} {self.primary_scheme.upper()} {dns_host:<12}: FAIL ({err})"
+        write(line + "\n\n")
+        # Additional services
+        if state.get("services"):
+            write("Дополнительные сервисы:\n")
+            for key, res in state.get("services", {}).items():
+                if res.get("ok"):
+                    if use_color:
+                        line = f"  {key:<20}: {AnsiColor.GREEN}OK{AnsiColor.RESET}   HTTP {res.get('status')}"
+                    else:
+                        line = f"  {key:<20}: OK   HTTP {res.get('status')}"
+                    line += self._http_details(res)
+                    line += self._latency_details(state, f"service/{key}")
+                else:
+                    err = res.get("error") or f"HTTP {res.get('status')}"
+                    if use_color:
+                        line = f"  {key:<20}: {AnsiColor.RED}FAIL{AnsiColor.RESET} ({err})"
+                    else:
+                        line = f"  {key:<20}: FAIL ({err})"
+                write(line + "\n")
+            write("\n")
+        # Throughput
+        thr = state.get("throughput", {}) or {}
+        write("Трафик (все интерфейсы):\n")
+        in_bps = human_bytes_per_second(thr.get("in_bps"))
+        out_bps = human_bytes_per_second(thr.get("out_bps"))
+        write(f"  IN : {in_bps}\n")
+        write(f"  OUT: {out_bps}\n")
+        for name, nic in (thr.get("interfaces") or {}).items():
+            # EWMA и пик по каждому интерфейсу
+            write(
+                f"  {name:<10} IN {human_bytes_per_second(nic.get('ewma_in_bps'))}"
+                f" (пик {human_bytes_per_second(nic.get('peak_in_bps')).strip()})"
+                f"  OUT {human_bytes_per_second(nic.get('ewma_out_bps'))}"
+                f" (пик {human_bytes_per_second(nic.get('peak_out_bps')).strip()})\n"
+            )
+        write("\n")
+        loop = state.get("loop")
+        if isinstance(loop, dict):
+            # Отставание и длительность самого цикла: узкое место — монитор, а не сеть
+            line = (
+                f"Цикл         : сбор {loop.get('collect_ms')} мс / бюджет {loop.get('budget_ms')} мс, "
+                f"старт +{loop.get('lag_ms')} мс (макс {loop.get('max_lag_ms')})"
+            )
+            if loop.get("overruns") or loop.get("missed_ticks"):
+                text = f"перерасход {loop.get('overruns')}, пропущено тактов {loop.get('missed_ticks')}"
+                line += f", {AnsiColor.YELLOW}{text}{AnsiColor.RESET}" if use_color else f", {text}"
+            write(line + "\n\n")
+        write("Нажмите Ctrl+C для остановки...\n")
+        self._render_frame("".join(frame).split("\n")[:-1])
+
+    def _render_frame(self, lines: List[str]) -> None:
+        """Вывести кадр панели одной записью в stdout.
+
+        С ANSI кадр сравнивается с предыдущим: перерисовываются только
+        изменившиеся строки (позиционирование курсора + очистка до конца
+        строки), лишние строки старого кадра стираются. Полная перерисовка
+        нужна лишь на первом кадре и при смене размера терминала. Перенос
+        строк отключён, а кадр обрезается по высоте окна, чтобы номера строк
+        кадра совпадали с номерами строк экрана.
+        """
+
+        if self.plain_output or not self._ansi_enabled:
+            self._clear_screen()
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+            return
+        size = tuple(shutil.get_terminal_size())
+        lines = lines[: max(1, size[1] - 1)]
+        if size != self._frame_size:
+            # \x1b[?7l — без автопереноса, \x1b[?25l — скрыть курсор
+            out = ["\x1b[?7l\x1b[?25l\x1b[2J\x1b[H", "\x1b[K\n".join(lines), "\x1b[K"]
+            self._frame_size = size
+        else:
+            out = []
+            previous = self._frame
+            for row, line in enumerate(lines):
+                if row >= len(previous) or previous[row] != line:
+                    out.append(f"\x1b[{row + 1};1H{line}\x1b[K")
+            if len(previous) > len(lines):
+                out.append(f"\x1b[{len(lines) + 1};1H\x1b[J")
+        out.append(f"\x1b[{len(lines) + 1};1H")
+        self._frame = lines
+        sys.stdout.write("".join(out))
+        sys.stdout.flush()
+
+    def _restore_console(self) -> None:
+        """Вернуть автоперенос и курсор после дифференциальной отрисовки."""
+
+        if self._frame_size is not None:
+            sys.stdout.write("\x1b[?7h\x1b[?25h")
+            sys.stdout.flush()
+            self._frame_size = None
 
     # -------------------------------------------------------------------------
-    # Logging and presentation
+    # State collection
+    # -------------------------------------------------------------------------
+
+    def _probe_jobs(self) -> Dict[Hashable, Callable[[], Dict[str, Optional[object]]]]:
+        """Перечислить все проверки одной итерации в виде независимых заданий.
+
+        Ключи — кортежи ``("ip",)``, ``("ping", host)``, ``("dns",)``,
+        ``("primary",)`` и ``("service", "scheme://host/path")``. При
+        встроенном ICMP все цели ping объединены в задачу ``("ping_all",)``.
+        """
+
+        jobs: Dict[Hashable, Callable[[], Dict[str, Optional[object]]]] = {
+            ("ip",): self.get_local_ip,
+        }
+        if self._native_ping_enabled():
+            # Один сокет обслуживает все цели: одна задача вместо N процессов
+            jobs[("ping_all",)] = self.ping_all
+        elif self.ping_mode == "stream":
+            for host in self.ping_targets:
+                jobs[("ping", host)] = self._ping_stream(host).snapshot
+        else:
+            for host in self.ping_targets:
+                jobs[("ping", host)] = lambda host=host: self.ping_host(host)
+        jobs[("dns",)] = lambda: self.resolve_host(self.primary_host)
+        jobs[("primary",)] = self.check_primary_http
+        for (host, path, scheme) in self.service_endpoints:
+            key = f"{scheme}://{host}{path}"
+            jobs[("service", key)] = lambda host=host, path=path, scheme=scheme: self.check_service(host, path, scheme)
+        return jobs
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Лениво создать пул потоков для проверок."""
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="netwatch-probe",
+            )
+        return self._executor
+
+    def _shutdown_executor(self) -> None:
+        """Остановить пул потоков, не дожидаясь зависших проверок."""
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _run_probes(
+        self, jobs: Dict[Hashable, Callable[[], Dict[str, Optional[object]]]]
+    ) -> Dict[Hashable, Dict[str, Optional[object]]]:
+        """Выполнить задания проверок и вернуть результаты по тем же ключам.
+
+        При ``max_workers > 1`` все проверки запускаются одновременно в
+        ограниченном пуле, поэтому длительность итерации определяется самой
+        медленной проверкой, а не суммой всех задержек. Исключение внутри
+        задания превращается в результат с ``ok=False`` и текстом ошибки.
+        """
+
+        results: Dict[Hashable, Dict[str, Optional[object]]] = {}
+        if self.max_workers <= 1:
+            for key, job in jobs.items():
+                try:
+                    results[key] = job()
+                except Exception as exc:
+                    results[key] = {"ok": False, "error": str(exc)}
+            return results
+        executor = self._get_executor()
+        futures: Dict[Hashable, concurrent.futures.Future] = {}
+        for key, job in jobs.items():
+            running = self._inflight.get(key)
+            # Снятая по бюджету проверка ещё висит — вторую копию не запускаем
+            futures[key] = running if running is not None and not running.done() else executor.submit(job)
+        budget = None
+        if self.tick_budget is not None:
+            # Остаток бюджета на публикацию (лог, файл статуса, панель) — 10 %
+            budget = max(0.05, self.tick_budget * 0.9 - (time.monotonic() - self._clock.started))
+        concurrent.futures.wait(futures.values(), timeout=budget)
+        for key, future in futures.items():
+            if not future.done():
+                self._inflight[key] = future
+                results[key] = timeout_result(key[0])  # type: ignore[index]
+                continue
+            self._inflight.pop(key, None)
+            try:
+                results[key] = future.result()
+            except Exception as exc:
+                results[key] = {"ok": False, "error": str(exc)}
+        return results
+
+    def _ping_results(
+        self, results: Dict[Hashable, Dict[str, Optional[object]]]
+    ) -> Dict[str, Dict[str, Optional[object]]]:
+        """Достать результаты ping из отдельных задач или из пакетной ``ping_all``."""
+
+        batch = results.get(("ping_all",))
+        if batch is None:
+            return {host: results[("ping", host)] for host in self.ping_targets}
+        ping_info: Dict[str, Dict[str, Optional[object]]] = {}
+        for host in self.ping_targets:
+            res = batch.get(host)
+            if isinstance(res, dict):
+                ping_info[host] = res
+            else:
+                # Пакет целиком упал или снят по дедлайну
+                ping_info[host] = {"ok": False, "rtt_ms": None, "error": batch.get("error") or "ошибка"}
+        return ping_info
+
+    def _assemble_state(
+        self, now_dt: datetime.datetime, results: Dict[Hashable, Dict[str, Optional[object]]]
+    ) -> Dict[str, object]:
+        """Собрать словарь состояния из результатов отдельных проверок."""
+
+        ip_info = results[("ip",)]
+        ping_info = self._ping_results(results)
+        dns_info = results[("dns",)]
+        primary_http = results[("primary",)]
+        service_results: Dict[str, Dict[str, Optional[object]]] = {}
+        for (host, path, scheme) in self.service_endpoints:
+            key = f"{scheme}://{host}{path}"
+            service_results[key] = results[("service", key)]
+        throughput = self.measure_throughput()
+        summary = self.summarise_state(ip_info, ping_info, dns_info, primary_http, service_results)
+        downtime = self._update_downtime(summary, now_dt)
+        transition = self._last_transition
+        uptime = now_dt - self._started_at
+        state: Dict[str, object] = {
+            "timestamp": now_dt.isoformat(),
+            "ip": ip_info,
+            "ping": ping_info,
+            "dns": {**dns_info, "host": self.primary_host},
+            "primary_http": primary_http,
+            "openai_http": primary_http,  # совместимость со старыми логами
+            "services": service_results,
+            "throughput": throughput,
+            "summary": summary,
+            "uptime_seconds": int(uptime.total_seconds()),
+            "downtime_seconds": int(downtime.total_seconds()),
+            "primary": {
+                "host": self.primary_host,
+                "path": self.primary_path,
+                "scheme": self.primary_scheme,
+                "method": self.primary_method,
+            },
+        }
+        state["latency"] = self._update_latency(state)
+        state["loop"] = {
+            **self._clock.snapshot(),
+            "collect_ms": round((time.monotonic() - self._clock.started) * 1000.0, 1),
+        }
+        if self._link is not None:
+            state["link"] = self._link.snapshot()
+        if self._log_writer is not None:
+            state["log_writer"] = self._log_writer.stats()
+        if self.adaptive:
+            adaptive: Dict[str, object] = {"transition": transition}
+            if self._scheduler is not None:
+                adaptive["intervals"] = {
+                    "/".join(str(part) for part in key): round(value, 3)
+                    for key, value in self._scheduler.intervals().items()
+                }
+            elif self._loop_policy is not None:
+                adaptive["interval"] = round(self._loop_policy.current, 3)
+            state["adaptive"] = adaptive
+        return state
+
+    def _probe_interval(self, key: Hashable) -> float:
+        """Интервал проверки: точное имя важнее группы, по умолчанию — общий."""
+
+        kind, exact = probe_names(key)
+        if exact is not None and exact in self.probe_intervals:
+            return max(0.1, self.probe_intervals[exact])
+        return max(0.1, self.probe_intervals.get(kind, self.interval))
+
+    def _start_scheduler(self) -> None:
+        """Запустить планировщик проверок с индивидуальными интервалами."""
+
+        jobs = self._probe_jobs()
+        intervals = {key: self._probe_interval(key) for key in jobs}
+        self._scheduler = ProbeScheduler(
+            jobs,
+            intervals,
+            self._get_executor(),
+            spread=self.interval,
+            jitter=self.schedule_jitter,
+            adaptive=self._make_policy if self.adaptive else None,
+        )
+        self._scheduler.start()
+        # Первая публикация — после первого круга, чтобы заглушки "pending"
+        # не выглядели как простой
+        self._scheduler.wait_ready(self.interval + max(self.http_timeout, 5.0, self.ping_timeout))
+
+    def _update_latency(self, state: Dict[str, object]) -> Dict[str, object]:
+        """Добавить задержки итерации в скользящие окна и вернуть их сводку."""
+
+        now = time.monotonic()
+        for name, ok, rtt, _status in state_samples(state):
+            if ok and rtt is not None:
+                rolling = self._latency.get(name)
+                if rolling is None:
+                    rolling = self._latency[name] = RollingLatency()
+                rolling.add(float(rtt), now)
+        return {name: rolling.summary(now) for name, rolling in self._latency.items()}
+
+    def _collect_state(self) -> Dict[str, object]:
+        """Собрать всю диагностику за одну итерацию.
+
+        С планировщиком проверки не запускаются заново: берутся последние
+        результаты, которые он накопил по своим интервалам.
+        """
+
+        now_dt = datetime.datetime.now()
+        if self._scheduler is not None:
+            results = self._scheduler.latest()
+        else:
+            results = self._run_probes(self._probe_jobs())
+        return self._assemble_state(now_dt, results)
+
+    # -------------------------------------------------------------------------
+    # Main loop and stop handling
     # -------------------------------------------------------------------------
 
-    def summarise_state(
-        self,
-        ip_info: Dict[str, Optional[str]],
-        ping_info: Dict[str, Dict[str, Optional[object]]],
-        dns_info: Dict[str, Optional[object]],
-        primary_http: Dict[str, Optional[object]],
-        services: Dict[str, Dict[str, Optional[object]]],
-    ) -> str:
-        """Сформировать краткий вывод о состоянии подключения."""
+    def _finalise(self) -> None:
+        """Write a termination record into the log file.
+
+        Called upon exiting the main loop either via signal or normal
+        termination. Ensures that each run ends with a ``NETWATCH STOP``
+        marker.
+        """
+
+        self._restore_console()
+        ts = datetime.datetime.now().isoformat()
+        self._write_log(f"=== NETWATCH STOP {ts} ===")
+        if self._log_writer is not None:
+            self._log_writer.close()
+
+    def stop(self, signum: Optional[int] = None, frame: Optional[object] = None) -> None:
+        """Signal handler: request that the monitoring loop terminates."""
+
+        self._stop_event.set()
+        self._wake.set()
+
+    def run(self) -> None:
+        """Основной цикл мониторинга с защитой от падений."""
+
+        # Перезапускаем отсчёт аптайма при фактическом старте цикла
+        self._started_at = datetime.datetime.now()
+
+        # Register signal handlers once inside the run method to avoid
+        # interfering with potential parent processes. Signals like SIGTERM
+        # may not be available on Windows.
+        try:
+            signal.signal(signal.SIGINT, self.stop)
+        except Exception:
+            pass
+        try:
+            signal.signal(signal.SIGTERM, self.stop)
+        except Exception:
+            pass
+
+        if self._log_writer is not None:
+            self._log_writer.start()
+        if self._metrics is not None:
+            self._metrics.start()
+        if self._link is not None:
+            self._link.start()
+        if self._throughput is not None:
+            self._throughput.start()
+        if self._agent is not None:
+            self._agent.start()
+        if self._samples is not None:
+            self._samples.start()
+        if self._sqlite is not None:
+            self._sqlite.start()
+
+        # Write start record
+        start_ts = self._started_at.isoformat()
+        self._write_log(f"=== NETWATCH START {start_ts} ===")
+        self._write_log(f"LOG FILE: {self.log_file}")
+        args = {
+            "interval": self.interval,
+            "throughput_enabled": self.throughput_enabled,
+            "services": self.service_endpoints,
+            "ping_targets": self.ping_targets,
+            "primary": f"{self.primary_scheme}://{self.primary_host}{self.primary_path} ({self.primary_method})",
+            "ping_timeout": self.ping_timeout,
+            "http_timeout": self.http_timeout,
+            "workers": self.max_workers,
+            "engine": self.engine,
+            "tick_deadline": self.tick_deadline,
+            "missed_ticks": self._clock.policy,
+            "ping_mode": self.ping_mode,
+            "icmp_socket": self._icmp.kind if self._icmp else None,
+            "ping_stream_interval": self.ping_stream_interval,
+            "http_keepalive": self._http_pool is not None,
+            "probe_intervals": self.probe_intervals,
+            "schedule_jitter": self.schedule_jitter,
+            "adaptive": self.adaptive,
+            "adaptive_max": self.adaptive_max,
+            "adaptive_burst": self.adaptive_burst,
+            "metrics": "%s:%d" % self._metrics.address if self._metrics else None,
+            "dns_resolvers": [label for label, _addr in self._dns.resolvers] if self._dns else None,
+            "netlink": self._link is not None,
+            "throughput_sample": self._throughput.period if self._throughput else None,
+            "push": f"{self._agent.scheme}://{self._agent.address}:{self._agent.port}" if self._agent else None,
+            "samples": self._samples.directory if self._samples else None,
+            "status_log": self.status_log,
+            "sqlite": self._sqlite.path if self._sqlite else None,
+            "log_index": bool(self._log_writer and self._log_writer.index),
+            "status_delta": (
+                {"keyframe_seconds": self._delta.keyframe_every, "rtt_tolerance_ms": self._delta.rtt_tolerance}
+                if self._delta
+                else None
+            ),
+        }
+        self._write_log("ARGS " + json.dumps(args, ensure_ascii=False, default=str))
+        self._write_log(f"NETWATCH LOOP START, interval={self.interval:.3f}s")
+
+        # Use atexit to ensure finalisation when Python exits normally
+        import atexit
+
+        atexit.register(self._finalise)
+
+        # Main loop
+        if self.engine == "async":
+            asyncio.run(AsyncProbeEngine(self).run())
+        else:
+            if self.probe_intervals:
+                self._start_scheduler()
+            # Запуск и ожидание планировщика не должны считаться отставанием
+            self._clock.reset()
+            while not self._stop_event.is_set():
+                state: Optional[Dict[str, object]] = None
+                self._clock.begin()
+                try:
+                    state = self._collect_state()
+                    self._publish(state)
+                except Exception as exc:
+                    self._handle_iteration_error(exc)
+                # Sleep until next iteration maintaining fixed interval
+                sleep_time = self._end_tick(state)
+                if sleep_time > 0 and self._wait_tick(sleep_time):
+                    # Изменился линк или маршрут — новая итерация сразу
+                    self._clock.wake()
+
+        # After loop exit, call finaliser explicitly (atexit will also call)
+        if self._scheduler is not None:
+            self._scheduler.stop()
+        self._shutdown_executor()
+        if self._icmp is not None:
+            self._icmp.close()
+        for stream in self._ping_streams.values():
+            stream.stop()
+        if self._http_pool is not None:
+            self._http_pool.close()
+        if self._metrics is not None:
+            self._metrics.stop()
+        if self._link is not None:
+            self._link.stop()
+        if self._throughput is not None:
+            self._throughput.stop()
+        if self._agent is not None:
+            self._agent.stop()
+        if self._samples is not None:
+            self._samples.close()
+        if self._sqlite is not None:
+            self._sqlite.close()
+        self._finalise()
+
+    def _publish(self, state: Dict[str, object]) -> None:
+        """Записать состояние итерации в лог, файл статуса и на панель."""
+
+        summary = str(state.get("summary"))
+        if self.status_log:
+            self.log_entry(state)
+        if self._samples is not None:
+            self._samples.append(state)
+        if self._sqlite is not None:
+            self._sqlite.append(state)
+        self._write_status_file(state)
+        if self._metrics is not None:
+            self._metrics.update(state, time.monotonic() - self._clock.started)
+        if self._agent is not None:
+            self._agent.publish(state)
+        self.update_console(state, summary)
+
+    def _handle_iteration_error(self, exc: BaseException) -> None:
+        """Зафиксировать сбой итерации, не выходя из цикла."""
+
+        # Не выходим из цикла, чтобы скрипт мог работать автономно
+        self.logger.exception("Сбой итерации", exc_info=True)
+        self._log_inline_error(exc)
+        summary = f"Проблема: внутренняя ошибка цикла ({exc})"
+        try:
+            self.update_console({"summary": summary}, summary)
+        except Exception:
+            pass
+
 
-        # Check local IP
-        if ip_info.get("ip") is None:
-            return "Нет активного IP – сетевой интерфейс не в сети"
+###############################################################################
+# Asyncio probe engine
+###############################################################################
 
-        # Check ping results. If all targets failed we might still be
-        # connected to the Internet if ICMP is blocked. We'll defer
-        # judgement until DNS/HTTP checks.
-        ping_ok = any(res.get("ok") for res in ping_info.values())
 
-        # Check DNS
-        if not dns_info.get("ok"):
-            return f"Проблема DNS – не удалось разрешить {self.primary_host}"
+class AsyncProbeEngine:
+    """Неблокирующий движок проверок на ``asyncio`` для ``--engine async``.
 
-        # Check captive portal endpoints
-        if services:
-            captive_ok = all(res.get("ok") for res in services.values())
-        else:
-            captive_ok = True
+    Все проверки итерации запускаются как задачи одного цикла событий:
+    TCP/TLS‑соединения и HTTP HEAD/GET идут через ``asyncio.open_connection``,
+    DNS — через ``loop.getaddrinfo``, ping — через асинхронный подпроцесс.
+    На итерацию действует один дедлайн (``NetWatch.tick_deadline``): задачи,
+    не успевшие к нему, отменяются и попадают в состояние как ``timeout``,
+    поэтому зависший хост не растягивает интервал цикла.
+    """
 
-        # Check primary HTTP
-        if not primary_http.get("ok"):
-            if ping_ok and captive_ok:
-                return f"Проблема соединения с {self.primary_host}"
-            return f"Проблема HTTPS до {self.primary_host} – возможно нет интернета"
+    def __init__(self, monitor: "NetWatch") -> None:
+        self.monitor = monitor
+        self._ssl_context = ssl.create_default_context()
 
-        # If we've reached here everything required is working
-        if not ping_ok:
-            # ICMP might be blocked but everything else works
-            return "Интернет доступен – ICMP может быть заблокирован"
-        return f"OK – интернет и {self.primary_host} доступны"
+    async def ping(self, host: str) -> Dict[str, Optional[object]]:
+        """Один эхо‑запрос через системный ``ping`` без блокировки цикла."""
 
-    def log_entry(self, state: Dict[str, object]) -> None:
-        """Write a structured JSON‑like log entry for the current state."""
+        timeout = self.monitor.ping_timeout
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *ping_command(host, timeout),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        except FileNotFoundError:
+            return {"ok": False, "rtt_ms": None, "error": "ping не найден"}
+        try:
+            output, _ = await proc.communicate()
+        except asyncio.CancelledError:
+            # Не оставляем висящий процесс после отмены по дедлайну
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            raise
+        return parse_ping_reply(proc.returncode or 0, output.decode("utf-8", errors="ignore"))
 
+    async def resolve(self, host: str) -> Dict[str, Optional[object]]:
+        """Разрешить домен через ``loop.getaddrinfo``."""
+
+        result: Dict[str, Optional[object]] = {"ok": False, "addresses": None, "error": None}
         try:
-            payload = json.dumps(state, ensure_ascii=False)
-            self._write_log(f"STATUS {payload}")
+            loop = asyncio.get_running_loop()
+            infos = await loop.getaddrinfo(host, 443, proto=socket.IPPROTO_TCP)
+            addresses: List[str] = []
+            for info in infos:
+                addr = info[4][0]
+                if addr not in addresses:
+                    addresses.append(addr)
+            result["addresses"] = addresses
+            result["ok"] = bool(addresses)
         except Exception as exc:
-            sys.stderr.write(f"Не удалось записать в лог: {exc}\n")
+            result["error"] = str(exc)
+        return result
 
-    def update_console(self, state: Dict[str, object], summary: str) -> None:
-        """Render the current diagnostic state to the terminal.
+    async def http_check(
+        self,
+        host: str,
+        path: str,
+        scheme: str,
+        method: str,
+        timeout: float,
+        accept: Optional[Tuple[int, ...]] = None,
+    ) -> Dict[str, Optional[object]]:
+        """Выполнить HTTP/1.1 запрос и прочитать строку статуса.
 
-        Uses ANSI escape codes to clear the screen and colourise output
-        unless ``plain_output`` is true. The dashboard contains sections
-        for the local IP, ping targets, DNS resolution, OpenAI HTTP
-        connectivity, additional service checks and throughput.
+        ``accept`` — допустимые коды ответа; ``None`` означает, что успехом
+        считается любой ответ сервера (как в ``check_primary_http``).
         """
 
-        # Choose colours based on summary: green for OK, red for problems,
-        # yellow for warnings
-        use_color = self._ansi_enabled and not self.plain_output
-        col = AnsiColor.GREEN if use_color else ""
-        if summary.startswith("Проблема"):
-            col = AnsiColor.RED if use_color else ""
-        elif summary.startswith("Интернет"):
-            col = AnsiColor.YELLOW if use_color else ""
-        # Clear the screen and reposition cursor
-        self._clear_screen()
-        # Header
-        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        header = f"NETWATCH PY    {now}    интервал: {self.interval:.2f}с"
-        sys.stdout.write(header + "\n")
-        sys.stdout.write("-" * len(header) + "\n")
-        now_dt = datetime.datetime.now()
-        uptime = human_timedelta(now_dt - self._started_at)
-        downtime = self._downtime_total
-        if self._downtime_start:
-            downtime += now_dt - self._downtime_start
-        sys.stdout.write(f"Время работы : {uptime}\n")
-        sys.stdout.write(f"Простой      : {human_timedelta(downtime)}\n\n")
-        # Summary
-        if self.plain_output or not use_color:
-            sys.stdout.write(f"Статус: {summary}\n\n")
-        else:
-            sys.stdout.write(f"Общий статус: {col}{summary}{AnsiColor.RESET}\n\n")
-        # Local IP
-        if ip := state.get("ip", {}).get("ip"):
-            sys.stdout.write(f"Локальный IP   : {ip}\n")
+        result: Dict[str, Optional[object]] = {"ok": False, "status": None, "error": None}
+        timing: Dict[str, Optional[float]] = {
+            "dns_ms": None,
+            "connect_ms": None,
+            "tls_ms": None,
+            "ttfb_ms": None,
+            "total_ms": None,
+        }
+        writer: Optional[asyncio.StreamWriter] = None
+        https = scheme.lower() == "https"
+        name, port = split_host_port(host, 443 if https else 80)
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            phase = time.perf_counter()
+            infos = await asyncio.wait_for(loop.getaddrinfo(name, port, type=socket.SOCK_STREAM), timeout)
+            timing["dns_ms"] = _elapsed_ms(phase)
+            addr = infos[0][4][0]
+            # TLS поднимается отдельно через start_tls, чтобы замерить его
+            # отдельно от TCP; без start_tls (Python < 3.11) — одной фазой
+            split_tls = https and hasattr(asyncio.StreamWriter, "start_tls")
+            phase = time.perf_counter()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    addr,
+                    port,
+                    ssl=self._ssl_context if https and not split_tls else None,
+                    server_hostname=name if https and not split_tls else None,
+                ),
+                timeout,
+            )
+            timing["connect_ms"] = _elapsed_ms(phase)
+            if split_tls:
+                phase = time.perf_counter()
+                await asyncio.wait_for(writer.start_tls(self._ssl_context, server_hostname=name), timeout)
+                timing["tls_ms"] = _elapsed_ms(phase)
+            request = (
+                f"{method} {path} HTTP/1.1\r\n"
+                f"Host: {host}\r\n"
+                "User-Agent: netwatch.py\r\n"
+                "Accept: */*\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            phase = time.perf_counter()
+            writer.write(request.encode("ascii"))
+            await asyncio.wait_for(writer.drain(), timeout)
+            status_line = await asyncio.wait_for(reader.readline(), timeout)
+            timing["ttfb_ms"] = _elapsed_ms(phase)
+            parts = status_line.decode("iso-8859-1").split()
+            if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+                raise ConnectionError(f"некорректный ответ: {status_line[:64]!r}")
+            status = int(parts[1])
+            result["status"] = status
+            result["ok"] = accept is None or status in accept
+            timing["total_ms"] = _elapsed_ms(started)
+        except asyncio.TimeoutError:
+            result["error"] = "timed out"
+        except Exception as exc:
+            result["error"] = str(exc)
+        finally:
+            result["timing"] = timing
+            if writer is not None:
+                writer.close()
+                try:
+                    # Дождаться закрытия транспорта (TLS иначе остаётся висеть до конца цикла)
+                    await asyncio.wait_for(writer.wait_closed(), timeout)
+                except Exception:
+                    pass
+        return result
+
+    @staticmethod
+    async def _ready(value: Dict[str, Optional[object]]) -> Dict[str, Optional[object]]:
+        """Обернуть уже готовый результат (например, снимок PingStream) в корутину."""
+
+        return value
+
+    async def local_ip(self) -> Dict[str, Optional[str]]:
+        """Локальный адрес: ``connect`` UDP‑сокета не ходит в сеть, вызываем напрямую."""
+
+        return self.monitor.get_local_ip()
+
+    def _probe_coroutines(self) -> Dict[Hashable, Tuple[str, object]]:
+        """Корутины проверок с теми же ключами, что и ``NetWatch._probe_jobs``."""
+
+        mon = self.monitor
+        coros: Dict[Hashable, Tuple[str, object]] = {("ip",): ("ip", self.local_ip())}
+        if mon._native_ping_enabled():
+            # Пакет ждёт все цели сразу, поэтому укладываем его в дедлайн итерации,
+            # чтобы ответившие цели не потерялись вместе с опоздавшими
+            loop = asyncio.get_running_loop()
+            timeout = min(mon.ping_timeout, max(0.05, mon.tick_deadline * 0.9))
+            coros[("ping_all",)] = ("ping", loop.run_in_executor(None, mon.ping_all, timeout))
+        elif mon.ping_mode == "stream":
+            for host in mon.ping_targets:
+                coros[("ping", host)] = ("ping", self._ready(mon._ping_stream(host).snapshot()))
         else:
-            err = state.get("ip", {}).get("error") or "unknown"
-            sys.stdout.write(f"Локальный IP   : [ошибка] {err}\n")
-        sys.stdout.write("\n")
-        # Pings
-        sys.stdout.write("Ping:\n")
-        for host, res in state.get("ping", {}).items():
-            ok = res.get("ok")
-            rtt = res.get("rtt_ms")
-            err = res.get("error")
-            if ok:
-                rtt_text = f"{rtt:.1f} ms" if rtt is not None else "n/a"
-                if use_color:
-                    line = f"  {host:<15}: {AnsiColor.GREEN}OK{AnsiColor.RESET}   rtt={rtt_text}"
-                else:
-                    line = f"  {host:<15}: OK   rtt={rtt_text}"
-            else:
-                msg = f"{err}" if err else "тайм-аут"
-                if use_color:
-                    line = f"  {host:<15}: {AnsiColor.RED}FAIL{AnsiColor.RESET} ({msg})"
-                else:
-                    line = f"  {host:<15}: FAIL ({msg})"
-            sys.stdout.write(line + "\n")
-        sys.stdout.write("\n")
-        # DNS
-        dns = state.get("dns", {})
-        dns_host = dns.get("host") or self.primary_host
-        if dns.get("ok"):
-            addrs = ", ".join(dns.get("addresses") or [])
-            if use_color:
-                line = f"DNS {dns_host:<17}: {AnsiColor.GREEN}OK{AnsiColor.RESET}   {addrs}"
-            else:
-                line = f"DNS {dns_host:<17}: OK   {addrs}"
+            for host in mon.ping_targets:
+                coros[("ping", host)] = ("ping", self.ping(host))
+        if mon._dns is not None:
+            # Свой неблокирующий UDP‑клиент; таймаут укладывается в дедлайн итерации
+            loop = asyncio.get_running_loop()
+            timeout = min(mon.http_timeout, max(0.05, mon.tick_deadline * 0.9))
+            coros[("dns",)] = ("dns", loop.run_in_executor(None, mon.resolve_direct, mon.primary_host, timeout))
         else:
-            err = dns.get("error") or "ошибка"
-            if use_color:
-                line = f"DNS {dns_host:<17}: {AnsiColor.RED}FAIL{AnsiColor.RESET} ({err})"
-            else:
-                line = f"DNS {dns_host:<17}: FAIL ({err})"
-        sys.stdout.write(line + "\n\n")
-        # OpenAI HTTP
-        http = state.get("primary_http", {}) or state.get("openai_http", {})
-        if http.get("ok"):
-            status = http.get("status")
-            if use_color:
-                line = f"{self.primary_method} {self.primary_scheme.upper()} {dns_host:<12}: {AnsiColor.GREEN}OK{AnsiColor.RESET}   HTTP {status}"
+            coros[("dns",)] = ("dns", self.resolve(mon.primary_host))
+        coros[("primary",)] = (
+            "http",
+            self.http_check(mon.primary_host, mon.primary_path, mon.primary_scheme, mon.primary_method, mon.http_timeout),
+        )
+        for (host, path, scheme) in mon.service_endpoints:
+            key = f"{scheme}://{host}{path}"
+            coros[("service", key)] = ("http", self.http_check(host, path, scheme, "GET", 5.0, accept=(200, 204)))
+        return coros
+
+    async def collect_state(self) -> Dict[str, object]:
+        """Собрать состояние одной итерации с общим дедлайном."""
+
+        now_dt = datetime.datetime.now()
+        coros = self._probe_coroutines()
+        tasks = {key: asyncio.ensure_future(coro) for key, (_, coro) in coros.items()}  # type: ignore[arg-type]
+        done, pending = await asyncio.wait(tasks.values(), timeout=self.monitor.tick_deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        results: Dict[Hashable, Dict[str, Optional[object]]] = {}
+        for key, task in tasks.items():
+            kind = coros[key][0]
+            if task in pending:
+                results[key] = timeout_result(kind)
+            elif task.exception() is not None:
+                results[key] = {"ok": False, "error": str(task.exception())}
             else:
-                line = f"{self.primary_method} {self.primary_scheme.upper()} {dns_host:<12}: OK   HTTP {status}"
-        else:
-            err = http.get("error") or "ошибка"
-            if use_color:
-                line = f"{self.primary_method} {self.primary_scheme.upper()} {dns_host:<12}: {AnsiColor.RED}FAIL{AnsiColor.RESET} ({err})"
+                results[key] = task.result()
+        return self.monitor._assemble_state(now_dt, results)
+
+    async def run(self) -> None:
+        """Цикл с фиксированным интервалом поверх ``asyncio``."""
+
+        mon = self.monitor
+        loop = asyncio.get_running_loop()
+        mon._clock.reset()
+        while not mon._stop_event.is_set():
+            state: Optional[Dict[str, object]] = None
+            mon._clock.begin()
+            try:
+                state = await self.collect_state()
+                mon._publish(state)
+            except Exception as exc:
+                mon._handle_iteration_error(exc)
+            sleep_time = mon._end_tick(state)
+            if sleep_time > 0:
+                # Ожидание в пуле, чтобы сигнал остановки и события линка будили цикл сразу
+                if await loop.run_in_executor(None, mon._wait_tick, sleep_time):
+                    mon._clock.wake()
+
+
+###############################################################################
+# OpenMetrics exporter
+###############################################################################
+
+
+def metric_label(value: object) -> str:
+    """Экранировать значение метки OpenMetrics (``\\``, ``"``, перевод строки)."""
+
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Отдаёт готовый снимок метрик; сам запрос ничего не проверяет."""
+
+    server: "_MetricsServer"
+
+    def do_GET(self) -> None:  # noqa: N802 - имя задано BaseHTTPRequestHandler
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.exporter.snapshot()
+        self.send_response(200)
+        self.send_header("Content-Type", MetricsExporter.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        # Опросы Prometheus не должны попадать в stderr поверх панели
+        pass
+
+
+class _MetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    exporter: "MetricsExporter"
+
+
+class MetricsExporter:
+    """HTTP‑эндпоинт ``/metrics`` в формате OpenMetrics для ``--metrics-port``.
+
+    Цикл мониторинга раз в итерацию вызывает :meth:`update`: счётчики
+    обновляются и текст метрик рендерится заранее, а обработчик запроса
+    лишь отдаёт последний снимок. Поэтому опрос Prometheus не запускает
+    проверок и не блокирует цикл дольше, чем на подмену ссылки на байты.
+    Сервер работает в фоновом потоке (stdlib ``http.server``).
+    """
+
+    CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+    # Границы корзин гистограммы RTT, секунды
+    RTT_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, host: str, port: int) -> None:
+        # Порт занимается сразу, чтобы ошибка конфигурации была видна при запуске
+        self._server = _MetricsServer((host, port), _MetricsHandler)
+        self._server.exporter = self
+        self._thread: Optional[threading.Thread] = None
+        self._snapshot = b"# EOF\n"
+        self._iterations = 0
+        self._failures: Dict[str, int] = {}
+        # проверка → (счётчики корзин + переполнение, сумма, число замеров)
+        self._rtt: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        host, port = self._server.server_address[:2]
+        return str(host), int(port)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, name="netwatch-metrics", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def snapshot(self) -> bytes:
+        return self._snapshot
+
+    def update(self, state: Dict[str, object], iteration_seconds: Optional[float] = None) -> None:
+        """Учесть итерацию и перерисовать снимок метрик."""
+
+        self._iterations += 1
+        samples = list(state_samples(state))
+        for name, ok, rtt, _status in samples:
+            if not ok:
+                self._failures[name] = self._failures.get(name, 0) + 1
             else:
-                line = f"{self.primary_method} {self.primary_scheme.upper()} {dns_host:<12}: FAIL ({err})"
-        sys.stdout.write(line + "\n\n")
-        # Additional services
-        if state.get("services"):
-            sys.stdout.write("Дополнительные сервисы:\n")
-            for key, res in state.get("services", {}).items():
-                if res.get("ok"):
-                    if use_color:
-                        line = f"  {key:<20}: {AnsiColor.GREEN}OK{AnsiColor.RESET}   HTTP {res.get('status')}"
-                    else:
-                        line = f"  {key:<20}: OK   HTTP {res.get('status')}"
-                else:
-                    err = res.get("error") or f"HTTP {res.get('status')}"
-                    if use_color:
-                        line = f"  {key:<20}: {AnsiColor.RED}FAIL{AnsiColor.RESET} ({err})"
-                    else:
-                        line = f"  {key:<20}: FAIL ({err})"
-                sys.stdout.write(line + "\n")
-            sys.stdout.write("\n")
-        # Throughput
-        thr = state.get("throughput", {}) or {}
-        sys.stdout.write("Трафик (все интерфейсы):\n")
-        in_bps = human_bytes_per_second(thr.get("in_bps"))
-        out_bps = human_bytes_per_second(thr.get("out_bps"))
-        sys.stdout.write(f"  IN : {in_bps}\n")
-        sys.stdout.write(f"  OUT: {out_bps}\n\n")
-        sys.stdout.write("Нажмите Ctrl+C для остановки...\n")
-        sys.stdout.flush()
+                self._failures.setdefault(name, 0)
+            if ok and rtt is not None:
+                counts, totals = self._rtt.setdefault(name, ([0] * (len(self.RTT_BUCKETS) + 1), [0.0, 0.0]))
+                seconds = rtt / 1000.0
+                index = next((i for i, bound in enumerate(self.RTT_BUCKETS) if seconds <= bound), len(self.RTT_BUCKETS))
+                counts[index] += 1
+                totals[0] += seconds
+                totals[1] += 1
+        # Рендер целиком до подмены: обработчик видит либо старый, либо новый снимок
+        self._snapshot = self._render(state, samples, iteration_seconds).encode("utf-8")
+
+    def _render(
+        self,
+        state: Dict[str, object],
+        samples: List[Tuple[str, bool, Optional[float], Optional[int]]],
+        iteration_seconds: Optional[float],
+    ) -> str:
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"# HELP {name} {help_text}")
+
+        family("netwatch_up", "gauge", "1 if the overall summary reports connectivity.")
+        lines.append(f"netwatch_up {int(summary_is_up(str(state.get('summary', ''))))}")
+        family("netwatch_probe_up", "gauge", "1 if the probe succeeded on the last iteration.")
+        for name, ok, _rtt, _status in samples:
+            lines.append(f'netwatch_probe_up{{probe="{metric_label(name)}"}} {int(ok)}')
+        family("netwatch_probe_failures", "counter", "Failed probe iterations since start.")
+        for name, failures in self._failures.items():
+            lines.append(f'netwatch_probe_failures_total{{probe="{metric_label(name)}"}} {failures}')
+        family("netwatch_http_status", "gauge", "HTTP status code of the last response.")
+        for name, _ok, _rtt, status in samples:
+            if status is not None:
+                lines.append(f'netwatch_http_status{{probe="{metric_label(name)}"}} {status}')
+        family("netwatch_rtt_seconds", "histogram", "Round-trip time of successful probes.")
+        for name, (counts, totals) in self._rtt.items():
+            label = metric_label(name)
+            cumulative = 0
+            for bound, count in zip(self.RTT_BUCKETS, counts):
+                cumulative += count
+                lines.append(f'netwatch_rtt_seconds_bucket{{probe="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'netwatch_rtt_seconds_bucket{{probe="{label}",le="+Inf"}} {int(totals[1])}')
+            lines.append(f'netwatch_rtt_seconds_count{{probe="{label}"}} {int(totals[1])}')
+            lines.append(f'netwatch_rtt_seconds_sum{{probe="{label}"}} {totals[0]:.6f}')
+        family("netwatch_downtime_seconds", "counter", "Accumulated downtime since start.")
+        lines.append(f"netwatch_downtime_seconds_total {state.get('downtime_seconds', 0)}")
+        family("netwatch_uptime_seconds", "gauge", "Seconds since the monitoring loop started.")
+        lines.append(f"netwatch_uptime_seconds {state.get('uptime_seconds', 0)}")
+        family("netwatch_iterations", "counter", "Completed monitoring iterations.")
+        lines.append(f"netwatch_iterations_total {self._iterations}")
+        if iteration_seconds is not None:
+            family("netwatch_iteration_duration_seconds", "gauge", "Wall time of the last iteration.")
+            lines.append(f"netwatch_iteration_duration_seconds {iteration_seconds:.6f}")
+        throughput = state.get("throughput")
+        if isinstance(throughput, dict) and any(throughput.get(k) is not None for k in ("in_bps", "out_bps")):
+            family("netwatch_throughput_bytes_per_second", "gauge", "Network throughput over all interfaces.")
+            for direction in ("in", "out"):
+                value = throughput.get(f"{direction}_bps")
+                if value is not None:
+                    lines.append(f'netwatch_throughput_bytes_per_second{{direction="{direction}"}} {float(value):.3f}')
+        interfaces = throughput.get("interfaces") if isinstance(throughput, dict) else None
+        if isinstance(interfaces, dict) and interfaces:
+            family("netwatch_interface_bytes_per_second", "gauge", "Smoothed (EWMA) throughput per interface.")
+            for name, nic in interfaces.items():
+                for direction in ("in", "out"):
+                    lines.append(
+                        f'netwatch_interface_bytes_per_second{{interface="{metric_label(name)}",direction="{direction}"}} '
+                        f'{float(nic.get(f"ewma_{direction}_bps") or 0.0):.3f}'
+                    )
+        loop = state.get("loop")
+        if isinstance(loop, dict):
+            family("netwatch_loop_lag_seconds", "gauge", "How late the last iteration started against its schedule.")
+            lines.append(f"netwatch_loop_lag_seconds {float(loop.get('lag_ms') or 0.0) / 1000.0:.6f}")
+            family("netwatch_loop_overruns", "counter", "Iterations that ran longer than the tick budget.")
+            lines.append(f"netwatch_loop_overruns_total {loop.get('overruns', 0)}")
+            family("netwatch_loop_missed_ticks", "counter", "Scheduled ticks skipped because the loop fell behind.")
+            lines.append(f"netwatch_loop_missed_ticks_total {loop.get('missed_ticks', 0)}")
+        family("netwatch_last_update_timestamp_seconds", "gauge", "Unix time of the last snapshot.")
+        lines.append(f"netwatch_last_update_timestamp_seconds {time.time():.3f}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+###############################################################################
+# Runlog report
+###############################################################################
+
+
+def parse_time_arg(value: str, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    """Разобрать момент времени: ISO (``2025-01-31T03:12``) или «назад» (``24h``, ``30m``, ``7d``)."""
+
+    now = now or datetime.datetime.now()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", value.strip())
+    if match:
+        seconds = float(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+        return now - datetime.timedelta(seconds=seconds)
+    return datetime.datetime.fromisoformat(value.strip())
+
+
+def iter_log_lines(
+    files: Iterable[Path], since: Optional[datetime.datetime] = None
+) -> Iterator[Tuple[Path, str]]:
+    """Построчно читать runlog один за другим (сжатые — с распаковкой на лету).
+
+    С ``since`` несжатые файлы с индексом (:class:`RunlogIndex`) читаются
+    через ``mmap`` начиная с последнего полного STATUS перед ``since``, а не
+    с начала; строки до ``since`` при этом всё равно могут попасть в выдачу.
+    """
+
+    for path in files:
+        start = runlog_start_offset(path, since) if since is not None and path.suffix not in (".gz", ".xz") else 0
+        if start:
+            try:
+                for line in iter_mapped_lines(path, start):
+                    yield path, line
+            except (OSError, ValueError):
+                pass
+            continue
+        try:
+            with open_runlog(path) as fh:  # type: ignore[attr-defined]
+                for line in fh:
+                    yield path, line
+        except (OSError, EOFError, lzma.LZMAError):
+            # Обрезанный сегмент (например, оборванное сжатие) — берём что есть
+            continue
+
+
+def iter_status_records(
+    lines: Iterable[Tuple[Path, str]],
+) -> Iterator[Tuple[str, datetime.datetime, Optional[Dict[str, object]]]]:
+    """Разобрать строки лога в события ``("status", ts, state)``, ``("start"|"stop", ts, None)``.
+
+    DELTA‑строки (``--status-delta``) разворачиваются в полное состояние.
+    """
+
+    rebuild = StatusReconstructor()
+    for _path, line in lines:
+        if len(line) < 19:
+            continue
+        parts = line.rstrip("\n").split(" | ", 2)
+        if len(parts) != 3:
+            continue
+        try:
+            ts = datetime.datetime.strptime(parts[0], "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+        message = parts[2]
+        if message.startswith("STATUS "):
+            try:
+                state = json.loads(message[7:])
+            except ValueError:
+                continue
+            if isinstance(state, dict):
+                yield "status", ts, rebuild.keyframe(state)
+        elif message.startswith("DELTA "):
+            try:
+                delta = json.loads(message[6:])
+            except ValueError:
+                continue
+            state = rebuild.delta(delta) if isinstance(delta, dict) else None
+            if state is not None:
+                yield "status", ts, state
+        elif "NETWATCH START" in message:
+            rebuild.reset()
+            yield "start", ts, None
+        elif "NETWATCH STOP" in message:
+            yield "stop", ts, None
+
+
+def select_runlogs(
+    log_dir: Path, since: Optional[datetime.datetime], until: Optional[datetime.datetime]
+) -> List[Path]:
+    """Runlog каталога, которые могут пересекаться с диапазоном ``[since, until]``."""
+
+    selected = []
+    for path in runlog_files(log_dir):
+        started, _segment = runlog_sort_key(path)
+        if until is not None and started > until:
+            continue
+        if since is not None and datetime.datetime.fromtimestamp(path.stat().st_mtime) < since:
+            continue
+        selected.append(path)
+    return selected
+
+
+def state_samples(state: Dict[str, object]) -> Iterator[Tuple[str, bool, Optional[float], Optional[int]]]:
+    """Разложить состояние на замеры ``(проверка, ok, rtt_ms, http_status)``.
+
+    Имена проверок: ``ip``, ``ping/<цель>``, ``dns``, ``dns/<резолвер>``, ``primary``,
+    ``service/<scheme://host/path>``. Для HTTP задержка — ``timing.total_ms``.
+    """
+
+    ip = state.get("ip")
+    if isinstance(ip, dict):
+        yield "ip", ip.get("ip") is not None, None, None
+    ping = state.get("ping")
+    if isinstance(ping, dict):
+        for host, res in ping.items():
+            if isinstance(res, dict):
+                rtt = res.get("rtt_ms")
+                yield f"ping/{host}", bool(res.get("ok")), rtt if isinstance(rtt, (int, float)) else None, None
+    dns = state.get("dns")
+    if isinstance(dns, dict):
+        yield "dns", bool(dns.get("ok")), None, None
+        resolvers = dns.get("resolvers")
+        if isinstance(resolvers, dict):
+            for label, res in resolvers.items():
+                if isinstance(res, dict):
+                    rtt = res.get("rtt_ms")
+                    yield f"dns/{label}", bool(res.get("ok")), rtt if isinstance(rtt, (int, float)) else None, None
+    http_checks: List[Tuple[str, object]] = [("primary", state.get("primary_http") or state.get("openai_http"))]
+    services = state.get("services")
+    if isinstance(services, dict):
+        http_checks.extend((f"service/{key}", res) for key, res in services.items())
+    for name, res in http_checks:
+        if not isinstance(res, dict):
+            continue
+        timing = res.get("timing")
+        total = timing.get("total_ms") if isinstance(timing, dict) else None
+        status = res.get("status")
+        yield (
+            name,
+            bool(res.get("ok")),
+            total if isinstance(total, (int, float)) else None,
+            status if isinstance(status, int) else None,
+        )
+
+
+class RunlogReport:
+    """Потоковая сводка по STATUS‑записям с постоянной памятью.
+
+    На каждую проверку хранятся только счётчики и :class:`LatencyHistogram`;
+    окна простоя (по общей сводке, как ``_update_downtime``) считаются на
+    лету, а в памяти остаются лишь последние ``max_windows`` из них.
+    Промежутки между запусками (после ``NETWATCH STOP``) в простой не
+    засчитываются.
+    """
+
+    def __init__(self, max_windows: int = 50) -> None:
+        self.first_ts: Optional[datetime.datetime] = None
+        self.last_ts: Optional[datetime.datetime] = None
+        self.records = 0
+        self.runs = 0
+        self.probes: Dict[str, Dict[str, object]] = {}
+        self.windows: Deque[Tuple[datetime.datetime, datetime.datetime]] = deque(maxlen=max_windows)
+        self.window_count = 0
+        self.downtime = datetime.timedelta()
+        self.observed = datetime.timedelta()
+        self._down_since: Optional[datetime.datetime] = None
+        self._prev_ts: Optional[datetime.datetime] = None
+
+    def _probe(self, name: str) -> Dict[str, object]:
+        probe = self.probes.get(name)
+        if probe is None:
+            probe = {"samples": 0, "ok": 0, "incidents": 0, "failing": False, "hist": LatencyHistogram(), "status": {}}
+            self.probes[name] = probe
+        return probe
+
+    def _close_window(self, end: datetime.datetime) -> None:
+        if self._down_since is None:
+            return
+        self.windows.append((self._down_since, end))
+        self.window_count += 1
+        self.downtime += end - self._down_since
+        self._down_since = None
+
+    def add(self, kind: str, ts: datetime.datetime, state: Optional[Dict[str, object]]) -> None:
+        if kind == "start":
+            self.runs += 1
+            self._prev_ts = None
+            return
+        if kind == "stop":
+            if self._prev_ts is not None:
+                self._close_window(self._prev_ts)
+            self._prev_ts = None
+            return
+        assert state is not None
+        self.records += 1
+        self.first_ts = self.first_ts or ts
+        self.last_ts = ts
+        if self._prev_ts is not None:
+            self.observed += ts - self._prev_ts
+        self._prev_ts = ts
+        up = summary_is_up(str(state.get("summary", "")))
+        if not up and self._down_since is None:
+            self._down_since = ts
+        elif up:
+            self._close_window(ts)
+        for name, ok, rtt, status in state_samples(state):
+            probe = self._probe(name)
+            probe["samples"] = int(probe["samples"]) + 1  # type: ignore[arg-type]
+            if ok:
+                probe["ok"] = int(probe["ok"]) + 1  # type: ignore[arg-type]
+                probe["failing"] = False
+            elif not probe["failing"]:
+                probe["failing"] = True
+                probe["incidents"] = int(probe["incidents"]) + 1  # type: ignore[arg-type]
+            if ok and rtt is not None:
+                probe["hist"].add(float(rtt))  # type: ignore[union-attr]
+            if status is not None:
+                codes: Dict[str, int] = probe["status"]  # type: ignore[assignment]
+                codes[str(status)] = codes.get(str(status), 0) + 1
+
+    def finish(self) -> Dict[str, object]:
+        """Закрыть незавершённое окно и вернуть итоговый словарь."""
+
+        if self._down_since is not None and self.last_ts is not None:
+            self._close_window(self.last_ts)
+        probes = {}
+        for name, probe in self.probes.items():
+            samples = int(probe["samples"])  # type: ignore[arg-type]
+            hist: LatencyHistogram = probe["hist"]  # type: ignore[assignment]
+            probes[name] = {
+                "samples": samples,
+                "availability_pct": round(100.0 * int(probe["ok"]) / samples, 3) if samples else None,  # type: ignore[arg-type]
+                "incidents": probe["incidents"],
+                "rtt_ms": hist.summary() if hist.count else None,
+                "http_status": probe["status"] or None,
+            }
+        observed = self.observed.total_seconds()
+        return {
+            "from": self.first_ts.isoformat() if self.first_ts else None,
+            "to": self.last_ts.isoformat() if self.last_ts else None,
+            "records": self.records,
+            "runs": self.runs,
+            "availability_pct": round(100.0 * (1 - self.downtime.total_seconds() / observed), 3) if observed else None,
+            "downtime_seconds": int(self.downtime.total_seconds()),
+            "downtime_windows": self.window_count,
+            "mttr_seconds": round(self.downtime.total_seconds() / self.window_count, 1) if self.window_count else None,
+            "recent_windows": [
+                {"start": start.isoformat(), "end": end.isoformat(), "seconds": int((end - start).total_seconds())}
+                for start, end in self.windows
+            ],
+            "probes": probes,
+        }
+
+
+def format_report(report: Dict[str, object]) -> str:
+    """Текстовое представление отчёта для терминала."""
+
+    lines = [
+        f"Период        : {report['from']} — {report['to']}",
+        f"Записей       : {report['records']} (запусков: {report['runs']})",
+        f"Доступность   : {report['availability_pct']} %",
+        f"Простой       : {human_timedelta(datetime.timedelta(seconds=int(report['downtime_seconds'])))}"  # type: ignore[arg-type]
+        f" в {report['downtime_windows']} окнах, MTTR {report['mttr_seconds']} с",
+        "",
+        f"{'Проверка':<44} {'выборка':>8} {'доступн.%':>10} {'сбоев':>6} {'p50':>9} {'p95':>9} {'p99':>9}",
+    ]
+    for name, probe in sorted(report["probes"].items()):  # type: ignore[union-attr]
+        rtt = probe.get("rtt_ms") or {}
+        cells = [f"{rtt.get(q):9.1f}" if rtt.get(q) is not None else f"{'—':>9}" for q in ("p50", "p95", "p99")]
+        availability = probe.get("availability_pct")
+        lines.append(
+            f"{name[:44]:<44} {probe['samples']:>8} "
+            f"{(f'{availability:.3f}' if availability is not None else '—'):>10} {probe['incidents']:>6} " + " ".join(cells)
+        )
+    windows = report.get("recent_windows") or []
+    if windows:
+        lines.append("")
+        lines.append("Последние окна простоя:")
+        for window in windows:  # type: ignore[union-attr]
+            lines.append(f"  {window['start']} — {window['end']}  ({window['seconds']} с)")
+    return "\n".join(lines)
+
+
+def report_main(argv: List[str]) -> int:
+    """``netwatch.py report``: доступность, окна простоя и перцентили RTT по runlog."""
+
+    parser = argparse.ArgumentParser(
+        prog="netwatch.py report",
+        description="Отчёт по runlog: доступность проверок, окна простоя, MTTR и p50/p95/p99 RTT.",
+    )
+    parser.add_argument("files", nargs="*", help="Runlog (в т.ч. .gz/.xz). По умолчанию — все runlog из --log-dir.")
+    parser.add_argument("--log-dir", default=None, help="Каталог с runlog (по умолчанию scripts/netlog).")
+    parser.add_argument("--since", default=None, help="Начало диапазона: ISO‑время или «назад» (24h, 7d).")
+    parser.add_argument("--until", default=None, help="Конец диапазона: ISO‑время или «назад».")
+    parser.add_argument("--windows", type=int, default=20, help="Сколько последних окон простоя показать.")
+    parser.add_argument("--json", action="store_true", help="Вывести отчёт в JSON.")
+    args = parser.parse_args(argv)
+    since = parse_time_arg(args.since) if args.since else None
+    until = parse_time_arg(args.until) if args.until else None
+    if args.files:
+        files = sorted((Path(f) for f in args.files), key=runlog_sort_key)
+    else:
+        log_dir = Path(args.log_dir) if args.log_dir else Path(__file__).resolve().parent / "netlog"
+        files = select_runlogs(log_dir, since, until) if log_dir.is_dir() else []
+    report = RunlogReport(max_windows=max(0, args.windows))
+    for kind, ts, state in iter_status_records(iter_log_lines(files, since)):
+        if since is not None and ts < since:
+            continue
+        if until is not None and ts > until:
+            break
+        report.add(kind, ts, state)
+    result = report.finish()
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(result))
+    return 0
 
-    # -------------------------------------------------------------------------
-    # State collection
-    # -------------------------------------------------------------------------
 
-    def _collect_state(self) -> Dict[str, object]:
-        """Собрать всю диагностику за одну итерацию."""
+def show_main(argv: List[str]) -> int:
+    """``netwatch.py show``: состояние на момент (``--at``) или все состояния за период."""
 
-        now_dt = datetime.datetime.now()
-        ip_info = self.get_local_ip()
-        ping_info = {host: self.ping_host(host) for host in self.ping_targets}
-        dns_info = self.resolve_host(self.primary_host)
-        primary_http = self.check_primary_http()
-        service_results: Dict[str, Dict[str, Optional[object]]] = {}
-        for (host, path, scheme) in self.service_endpoints:
-            key = f"{scheme}://{host}{path}"
-            service_results[key] = self.check_service(host, path, scheme)
-        throughput = self.measure_throughput()
-        summary = self.summarise_state(ip_info, ping_info, dns_info, primary_http, service_results)
-        downtime = self._update_downtime(summary, now_dt)
-        uptime = now_dt - self._started_at
-        state: Dict[str, object] = {
-            "timestamp": now_dt.isoformat(),
-            "ip": ip_info,
-            "ping": ping_info,
-            "dns": {**dns_info, "host": self.primary_host},
-            "primary_http": primary_http,
-            "openai_http": primary_http,  # совместимость со старыми логами
-            "services": service_results,
-            "throughput": throughput,
-            "summary": summary,
-            "uptime_seconds": int(uptime.total_seconds()),
-            "downtime_seconds": int(downtime.total_seconds()),
-            "primary": {
-                "host": self.primary_host,
-                "path": self.primary_path,
-                "scheme": self.primary_scheme,
-                "method": self.primary_method,
-            },
-        }
-        return state
+    parser = argparse.ArgumentParser(
+        prog="netwatch.py show",
+        description=(
+            "Восстановить состояние на момент времени или за период из runlog (в т.ч. разностных "
+            "--status-delta). По индексу *.idx чтение начинается сразу с нужной минуты."
+        ),
+    )
+    parser.add_argument("files", nargs="*", help="Runlog (в т.ч. .gz/.xz). По умолчанию — из --log-dir.")
+    parser.add_argument("--log-dir", default=None, help="Каталог с runlog (по умолчанию scripts/netlog).")
+    parser.add_argument("--at", default=None, help="Момент: ISO‑время или «назад» (например, 2h).")
+    parser.add_argument("--since", default=None, help="Начало периода: ISO‑время или «назад»; по строке JSON на состояние.")
+    parser.add_argument("--until", default=None, help="Конец периода (по умолчанию — сейчас).")
+    args = parser.parse_args(argv)
+    if (args.at is None) == (args.since is None):
+        parser.error("укажите ровно одно из --at и --since")
+    if args.until is not None and args.since is None:
+        parser.error("--until используется вместе с --since")
+    since = parse_time_arg(args.at or args.since)
+    until = parse_time_arg(args.until) if args.until else (since if args.at else None)
+    if args.files:
+        files = sorted((Path(f) for f in args.files), key=runlog_sort_key)
+    else:
+        log_dir = Path(args.log_dir) if args.log_dir else Path(__file__).resolve().parent / "netlog"
+        # Для --at нужен и файл, закончившийся раньше момента: его последнее состояние
+        files = select_runlogs(log_dir, None if args.at else since, until) if log_dir.is_dir() else []
+    records = iter_status_records(iter_log_lines(files, since))
+    if args.at is None:
+        for kind, ts, state in records:
+            if until is not None and ts > until:
+                break
+            if kind == "status" and state is not None and ts >= since:
+                print(json.dumps(state, ensure_ascii=False))
+        return 0
+    found: Optional[Tuple[datetime.datetime, Dict[str, object]]] = None
+    stopped = False
+    for kind, ts, state in records:
+        if ts > since:
+            break
+        if kind == "status" and state is not None:
+            found, stopped = (ts, state), False
+        elif kind == "stop":
+            stopped = True
+    if found is None:
+        sys.stderr.write(f"Нет записей состояния до {since.isoformat()}\n")
+        return 1
+    if stopped:
+        sys.stderr.write("Внимание: к этому моменту монитор был остановлен; показано последнее состояние.\n")
+    print(json.dumps(found[1], ensure_ascii=False, indent=2))
+    return 0
 
-    # -------------------------------------------------------------------------
-    # Main loop and stop handling
-    # -------------------------------------------------------------------------
 
-    def _finalise(self) -> None:
-        """Write a termination record into the log file.
+def samples_main(argv: List[str]) -> int:
+    """``netwatch.py samples``: выборка из двоичных рядов замеров за период."""
 
-        Called upon exiting the main loop either via signal or normal
-        termination. Ensures that each run ends with a ``NETWATCH STOP``
-        marker.
-        """
+    parser = argparse.ArgumentParser(
+        prog="netwatch.py samples",
+        description="Доступность и перцентили RTT из двоичных рядов (*.nws) без разбора текстовых логов.",
+    )
+    parser.add_argument("probes", nargs="*", help="Проверки (например, ping/8.8.8.8); по умолчанию — все.")
+    parser.add_argument("--dir", default=None, help="Каталог рядов (по умолчанию scripts/netlog/samples).")
+    parser.add_argument("--since", default=None, help="Начало: ISO‑время или «назад» (24h, 30m).")
+    parser.add_argument("--until", default=None, help="Конец: ISO‑время или «назад».")
+    parser.add_argument("--raw", action="store_true", help="Вывести сами записи (ts, ok, rtt_ms, status).")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON.")
+    args = parser.parse_args(argv)
+    directory = Path(args.dir) if args.dir else Path(__file__).resolve().parent / "netlog" / "samples"
+    since = parse_time_arg(args.since).timestamp() if args.since else None
+    until = parse_time_arg(args.until).timestamp() if args.until else None
+    available = SampleStore.series(directory)
+    wanted = args.probes or sorted(available)
+    result: Dict[str, object] = {}
+    for probe in wanted:
+        path = available.get(probe)
+        if path is None:
+            sys.stderr.write(f"Нет ряда для {probe!r} в {directory}\n")
+            continue
+        with SampleSeries(path) as series:
+            if args.raw:
+                for ts, rtt, status, ok in series.records(since, until):
+                    stamp = datetime.datetime.fromtimestamp(ts).isoformat(timespec="milliseconds")
+                    rtt_text = f"{rtt:.3f}" if rtt is not None else "-"
+                    print(f"{probe}\t{stamp}\t{int(ok)}\t{rtt_text}\t{status or '-'}")
+                continue
+            histogram = LatencyHistogram()
+            total = ok_count = 0
+            for _ts, rtt, _status, ok in series.records(since, until):
+                total += 1
+                ok_count += ok
+                if ok and rtt is not None:
+                    histogram.add(rtt)
+            result[probe] = {
+                "samples": total,
+                "availability_pct": round(100.0 * ok_count / total, 3) if total else None,
+                "rtt_ms": histogram.summary(),
+            }
+    if args.raw:
+        return 0
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    for probe, info in result.items():
+        rtt = info["rtt_ms"]  # type: ignore[index]
+        line = f"{probe:<40} замеров {info['samples']:>7}"  # type: ignore[index]
+        if info["availability_pct"] is not None:  # type: ignore[index]
+            line += f"  доступность {info['availability_pct']:7.3f}%"  # type: ignore[index]
+        if rtt["count"]:
+            line += f"  RTT p50 {rtt['p50']:.1f} p95 {rtt['p95']:.1f} p99 {rtt['p99']:.1f} ms"
+        print(line)
+    return 0
 
-        ts = datetime.datetime.now().isoformat()
-        self._write_log(f"=== NETWATCH STOP {ts} ===")
 
-    def stop(self, signum: Optional[int] = None, frame: Optional[object] = None) -> None:
-        """Signal handler: request that the monitoring loop terminates."""
+def db_main(argv: List[str]) -> int:
+    """``netwatch.py db``: выборка из базы SQLite по свёрткам или сырым замерам."""
 
-        self._stop_event.set()
+    parser = argparse.ArgumentParser(
+        prog="netwatch.py db",
+        description="Запрос к базе --sqlite: свёртки по минутам/часам или сырые замеры за период.",
+    )
+    parser.add_argument("probes", nargs="*", help="Проверки (например, primary); по умолчанию — все.")
+    parser.add_argument("--db", default=None, help="Файл базы (по умолчанию scripts/netlog/netwatch.sqlite).")
+    parser.add_argument("--since", default="24h", help="Начало: ISO‑время или «назад» (по умолчанию 24h).")
+    parser.add_argument("--until", default=None, help="Конец: ISO‑время или «назад».")
+    parser.add_argument("--resolution", choices=["1m", "1h", "raw"], default="1h", help="Свёртка или сырые замеры.")
+    parser.add_argument("--json", action="store_true", help="Вывести строки в JSON.")
+    args = parser.parse_args(argv)
+    path = Path(args.db) if args.db else Path(__file__).resolve().parent / "netlog" / "netwatch.sqlite"
+    if not path.exists():
+        parser.error(f"нет базы {path}")
+    since = parse_time_arg(args.since).timestamp()
+    until = parse_time_arg(args.until).timestamp() if args.until else time.time()
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        if args.resolution == "raw":
+            columns = ("probe", "ts", "ok", "rtt_ms", "status")
+            sql = "SELECT probe, ts, ok, rtt_ms, status FROM samples WHERE probe = ? AND ts >= ? AND ts <= ? ORDER BY ts"
+        else:
+            columns = ("probe", "bucket", "count", "failures", "min_ms", "avg_ms", "max_ms", "p95_ms")
+            sql = (
+                f"SELECT probe, bucket, count, failures, min_ms, avg_ms, max_ms, p95_ms FROM rollup_{args.resolution} "
+                "WHERE probe = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket"
+            )
+        probes = args.probes
+        if not probes:
+            try:
+                # Таблица probes переживает очистку сырых замеров и не требует их просмотра
+                probes = [row[0] for row in conn.execute("SELECT probe FROM probes ORDER BY probe")]
+            except sqlite3.OperationalError:
+                # База, которую ещё не открывал SqliteSink с таблицей probes
+                probes = [row[0] for row in conn.execute("SELECT DISTINCT probe FROM samples ORDER BY probe")]
+        rows = [row for probe in probes for row in conn.execute(sql, (probe, since, until))]
+    finally:
+        conn.close()
+    if args.json:
+        print(json.dumps([dict(zip(columns, row)) for row in rows], ensure_ascii=False, indent=2))
+        return 0
+    for row in rows:
+        stamp = datetime.datetime.fromtimestamp(row[1]).isoformat(timespec="seconds")
+        values = "\t".join("-" if value is None else f"{value:g}" if isinstance(value, float) else str(value) for value in row[2:])
+        print(f"{row[0]}\t{stamp}\t{values}")
+    return 0
 
-    def run(self) -> None:
-        """Основной цикл мониторинга с защитой от падений."""
 
-        # Перезапускаем отсчёт аптайма при фактическом старте цикла
-        self._started_at = datetime.datetime.now()
+###############################################################################
+# Multi-host agent and aggregator
+###############################################################################
 
-        # Register signal handlers once inside the run method to avoid
-        # interfering with potential parent processes. Signals like SIGTERM
-        # may not be available on Windows.
+
+def parse_endpoint(value: str, default_scheme: str = "udp") -> Tuple[str, str, int]:
+    """Разобрать ``[udp|tcp://]host:port`` в ``(схема, хост, порт)``."""
+
+    scheme, sep, rest = value.partition("://")
+    if not sep:
+        scheme, rest = default_scheme, value
+    if scheme not in ("udp", "tcp"):
+        raise ValueError(f"неизвестная схема {scheme!r} (нужно udp:// или tcp://)")
+    host, port = split_host_port(rest, 0)
+    if not port:
+        raise ValueError(f"не указан порт в {value!r}")
+    return scheme, host or "0.0.0.0", port
+
+
+def agent_record(host: str, seq: int, state: Dict[str, object]) -> Dict[str, object]:
+    """Компактная запись итерации для агрегатора.
+
+    ``probes`` — ``{проверка: [ok, rtt_ms]}`` по :func:`state_samples`.
+    """
+
+    summary = str(state.get("summary", ""))
+    return {
+        "v": 1,
+        "host": host,
+        "seq": seq,
+        "ts": round(time.time(), 3),
+        "up": summary_is_up(summary),
+        "summary": summary,
+        "downtime_seconds": state.get("downtime_seconds"),
+        "probes": {
+            name: [int(ok), round(rtt, 3) if rtt is not None else None]
+            for name, ok, rtt, _status in state_samples(state)
+        },
+    }
+
+
+class AgentPublisher:
+    """Отправка состояния каждой итерации агрегатору (``--push``).
+
+    UDP — одна датаграмма на итерацию; TCP — постоянное соединение с
+    JSON‑строками и переподключением с нарастающей паузой. Отправка идёт
+    из фонового потока через ограниченную очередь: недоступный агрегатор
+    не задерживает цикл мониторинга, лишние записи отбрасываются.
+    """
+
+    def __init__(self, endpoint: str, host: Optional[str] = None, queue_size: int = 100) -> None:
+        self.scheme, self.address, self.port = parse_endpoint(endpoint)
+        self.host = host or socket.gethostname()
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=queue_size)
+        self._seq = itertools.count(1)
+        self._thread: Optional[threading.Thread] = None
+        self._sock: Optional[socket.socket] = None
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="netwatch-agent", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            try:
+                self._queue.put(None, timeout=1.0)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self._close()
+
+    def publish(self, state: Dict[str, object]) -> None:
+        payload = json.dumps(agent_record(self.host, next(self._seq), state), ensure_ascii=False, separators=(",", ":"))
         try:
-            signal.signal(signal.SIGINT, self.stop)
-        except Exception:
-            pass
+            self._queue.put_nowait(payload.encode("utf-8") + b"\n")
+        except queue.Full:
+            self.dropped += 1
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _send(self, data: bytes) -> None:
+        if self.scheme == "udp":
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_INET6 if ":" in self.address else socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.sendto(data, (self.address, self.port))
+            return
+        if self._sock is None:
+            self._sock = socket.create_connection((self.address, self.port), timeout=5.0)
+        self._sock.sendall(data)
+
+    def _loop(self) -> None:
+        backoff = 0.5
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            try:
+                self._send(data)
+                self.sent += 1
+                backoff = 0.5
+            except OSError:
+                # Агрегатор недоступен: запись теряется, соединение переоткроется
+                self.dropped += 1
+                self._close()
+                if self.scheme == "tcp":
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+
+
+class HostStream:
+    """Поток записей одного агента: последняя запись и окна по проверкам."""
+
+    def __init__(self, host: str, window: float) -> None:
+        self.host = host
+        self.window = window
+        self.last: Dict[str, object] = {}
+        self.last_seen = 0.0
+        self.peer: Optional[str] = None
+        self.last_seq = 0
+        self.lost = 0
+        self.records = 0
+        # проверка → deque[(время, ok)] за последние ``window`` секунд
+        self.samples: Dict[str, Deque[Tuple[float, bool]]] = {}
+
+    def add(self, record: Dict[str, object], now: float) -> None:
+        seq = record.get("seq")
+        if isinstance(seq, int):
+            if self.last_seq and seq > self.last_seq + 1:
+                self.lost += seq - self.last_seq - 1
+            self.last_seq = seq
+        self.last = record
+        self.last_seen = now
+        self.records += 1
+        probes = record.get("probes")
+        if isinstance(probes, dict):
+            for name, value in probes.items():
+                ring = self.samples.setdefault(name, deque())
+                ring.append((now, bool(value[0]) if isinstance(value, list) and value else False))
+        self.trim(now)
+
+    def trim(self, now: float) -> None:
+        for ring in self.samples.values():
+            while ring and now - ring[0][0] > self.window:
+                ring.popleft()
+
+    def availability(self, name: str) -> Optional[float]:
+        ring = self.samples.get(name)
+        if not ring:
+            return None
+        return 100.0 * sum(1 for _ts, ok in ring if ok) / len(ring)
+
+
+class Aggregator:
+    """Приёмник ``netwatch.py aggregate``: UDP и TCP на одном порту.
+
+    Все сокеты обслуживаются одним потоком через ``selectors``; записи
+    агентов (JSON‑строки) сводятся в :class:`HostStream` по имени хоста.
+    :meth:`summary` отличает сбой всей площадки (проверка не проходит у
+    всех активных хостов) от проблемы отдельных машин.
+    """
+
+    MAX_LINE = 65536
+
+    def __init__(self, address: str, port: int, window: float = 300.0, stale: float = 15.0) -> None:
+        self.window = window
+        self.stale = stale
+        self.hosts: Dict[str, HostStream] = {}
+        self.invalid = 0
+        self._selector = selectors.DefaultSelector()
+        family = socket.AF_INET6 if ":" in address else socket.AF_INET
+        self._udp = socket.socket(family, socket.SOCK_DGRAM)
+        self._udp.bind((address, port))
+        # TCP на том же порту, что выбрала система для UDP (если port == 0)
+        self._tcp = socket.socket(family, socket.SOCK_STREAM)
+        self._tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._tcp.bind((address, self._udp.getsockname()[1]))
+        self._tcp.listen(64)
+        for sock in (self._udp, self._tcp):
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ)
+        self._buffers: Dict[socket.socket, bytearray] = {}
+
+    @property
+    def port(self) -> int:
+        return int(self._udp.getsockname()[1])
+
+    def close(self) -> None:
+        for sock in list(self._buffers):
+            sock.close()
+        self._buffers.clear()
+        self._selector.close()
+        self._udp.close()
+        self._tcp.close()
+
+    def poll(self, timeout: float) -> None:
+        """Обработать всё, что пришло за ``timeout`` секунд."""
+
+        for key, _mask in self._selector.select(timeout):
+            sock = key.fileobj
+            if sock is self._udp:
+                self._read_udp()
+            elif sock is self._tcp:
+                self._accept()
+            else:
+                self._read_tcp(sock)  # type: ignore[arg-type]
+
+    def _accept(self) -> None:
         try:
-            signal.signal(signal.SIGTERM, self.stop)
-        except Exception:
-            pass
+            conn, _addr = self._tcp.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        conn.setblocking(False)
+        self._buffers[conn] = bytearray()
+        self._selector.register(conn, selectors.EVENT_READ)
 
-        # Write start record
-        start_ts = self._started_at.isoformat()
-        self._write_log(f"=== NETWATCH START {start_ts} ===")
-        self._write_log(f"LOG FILE: {self.log_file}")
-        self._write_log(
-            "ARGS "
-            f'{{"interval": {self.interval}, "throughput_enabled": {self.throughput_enabled}, '
-            f'"services": {self.service_endpoints}, "ping_targets": {self.ping_targets}, '
-            f'"primary": "{self.primary_scheme}://{self.primary_host}{self.primary_path} ({self.primary_method})", '
-            f'"ping_timeout": {self.ping_timeout}, "http_timeout": {self.http_timeout}}}'
-        )
-        self._write_log(f"NETWATCH LOOP START, interval={self.interval:.3f}s")
+    def _read_udp(self) -> None:
+        while True:
+            try:
+                data, addr = self._udp.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            for line in data.splitlines():
+                self.ingest(line, f"udp:{addr[0]}")
 
-        # Use atexit to ensure finalisation when Python exits normally
-        import atexit
+    def _read_tcp(self, conn: socket.socket) -> None:
+        try:
+            data = conn.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        buffer = self._buffers.get(conn)
+        if not data or buffer is None:
+            self._selector.unregister(conn)
+            self._buffers.pop(conn, None)
+            conn.close()
+            return
+        buffer.extend(data)
+        try:
+            peer = f"tcp:{conn.getpeername()[0]}"
+        except OSError:
+            peer = "tcp"
+        while True:
+            end = buffer.find(b"\n")
+            if end < 0:
+                if len(buffer) > self.MAX_LINE:
+                    # Строка без конца — поток повреждён, сбрасываем буфер
+                    self.invalid += 1
+                    buffer.clear()
+                return
+            line = bytes(buffer[:end])
+            del buffer[: end + 1]
+            self.ingest(line, peer)
 
-        atexit.register(self._finalise)
+    def ingest(self, line: bytes, peer: Optional[str] = None) -> None:
+        """Принять одну JSON‑запись агента."""
 
-        # Main loop
-        next_run = time.monotonic()
-        while not self._stop_event.is_set():
-            try:
-                state = self._collect_state()
-                summary = str(state.get("summary"))
-                self.log_entry(state)
-                self._write_status_file(state)
-                self.update_console(state, summary)
-            except Exception as exc:
-                # Не выходим из цикла, чтобы скрипт мог работать автономно
-                self.logger.exception("Сбой итерации", exc_info=True)
-                self._log_inline_error(exc)
-                summary = f"Проблема: внутренняя ошибка цикла ({exc})"
-                try:
-                    self.update_console({"summary": summary}, summary)
-                except Exception:
-                    pass
-            # Sleep until next iteration maintaining fixed interval
-            next_run += self.interval
-            sleep_time = next_run - time.monotonic()
-            if sleep_time > 0:
-                self._stop_event.wait(sleep_time)
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            host = str(record["host"])
+        except (ValueError, KeyError, TypeError):
+            self.invalid += 1
+            return
+        now = time.monotonic()
+        stream = self.hosts.get(host)
+        if stream is None:
+            stream = self.hosts[host] = HostStream(host, self.window)
+        stream.peer = peer
+        stream.add(record, now)
+
+    def summary(self) -> Dict[str, object]:
+        """Сводка по хостам и проверкам, а также вердикт по площадке."""
+
+        now = time.monotonic()
+        hosts: Dict[str, object] = {}
+        probes: Dict[str, Dict[str, List[str]]] = {}
+        active = []
+        for name, stream in sorted(self.hosts.items()):
+            stream.trim(now)
+            age = now - stream.last_seen
+            fresh = age <= self.stale
+            record = stream.last
+            failing = sorted(
+                probe for probe, value in (record.get("probes") or {}).items()  # type: ignore[union-attr]
+                if isinstance(value, list) and value and not value[0]
+            )
+            hosts[name] = {
+                "fresh": fresh,
+                "age_seconds": round(age, 1),
+                "peer": stream.peer,
+                "up": record.get("up"),
+                "summary": record.get("summary"),
+                "failing": failing,
+                "records": stream.records,
+                "lost": stream.lost,
+                "availability": {probe: round(stream.availability(probe) or 0.0, 2) for probe in sorted(stream.samples)},
+            }
+            if not fresh:
+                continue
+            active.append(name)
+            for probe, value in (record.get("probes") or {}).items():  # type: ignore[union-attr]
+                entry = probes.setdefault(probe, {"ok": [], "fail": []})
+                entry["ok" if isinstance(value, list) and value and value[0] else "fail"].append(name)
+        site_down = sorted(p for p, e in probes.items() if e["fail"] and not e["ok"] and len(active) > 1)
+        partial = {p: e["fail"] for p, e in sorted(probes.items()) if e["fail"] and e["ok"]}
+        if not active:
+            verdict = "Нет данных от агентов"
+        elif site_down:
+            verdict = "Сбой площадки: у всех хостов не проходит " + ", ".join(site_down)
+        elif partial:
+            broken = sorted({host for names in partial.values() for host in names})
+            verdict = "Проблема на отдельных хостах: " + ", ".join(broken)
+        else:
+            verdict = "OK – все хосты в норме"
+        return {
+            "verdict": verdict,
+            "active": len(active),
+            "hosts": hosts,
+            "site_down": site_down,
+            "partial": partial,
+            "probes": {p: {"ok": len(e["ok"]), "fail": len(e["fail"])} for p, e in sorted(probes.items())},
+            "invalid_records": self.invalid,
+        }
 
-        # After loop exit, call finaliser explicitly (atexit will also call)
-        self._finalise()
+
+def format_aggregate(summary: Dict[str, object], window: float) -> List[str]:
+    """Строки многохостовой панели агрегатора."""
+
+    lines = [
+        f"NETWATCH AGGREGATE    {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}    окно: {window:g}с",
+        "-" * 60,
+        f"Итог: {summary['verdict']}",
+        f"Активных хостов: {summary['active']} из {len(summary['hosts'])}",  # type: ignore[arg-type]
+        "",
+        "Хосты:",
+    ]
+    for name, info in summary["hosts"].items():  # type: ignore[union-attr]
+        state = "OK  " if info["up"] else "FAIL"
+        if not info["fresh"]:
+            state = "нет данных"
+        line = f"  {name:<20} {state:<10} {info['age_seconds']:>6.1f}с назад"
+        if info["failing"]:
+            line += "  сбой: " + ", ".join(info["failing"])
+        if info["lost"]:
+            line += f"  потеряно записей: {info['lost']}"
+        lines.append(line)
+    lines.append("")
+    lines.append("Проверки (сейчас OK/всего активных):")
+    for probe, counts in summary["probes"].items():  # type: ignore[union-attr]
+        total = counts["ok"] + counts["fail"]
+        mark = "  <-- у всех" if probe in summary["site_down"] else ""  # type: ignore[operator]
+        lines.append(f"  {probe:<40} {counts['ok']}/{total}{mark}")
+    return lines
+
+
+def aggregate_main(argv: List[str]) -> int:
+    """``netwatch.py aggregate``: приём потоков агентов и общая панель."""
+
+    parser = argparse.ArgumentParser(
+        prog="netwatch.py aggregate",
+        description="Сводная панель по агентам netwatch (--push) на многих хостах.",
+    )
+    parser.add_argument("--listen", default="0.0.0.0:9787", help="Адрес host:port для приёма (UDP и TCP).")
+    parser.add_argument("--window", type=float, default=300.0, help="Окно доступности по каждому хосту, секунды.")
+    parser.add_argument("--stale", type=float, default=15.0, help="Через сколько секунд молчания хост считается пропавшим.")
+    parser.add_argument("--interval", type=float, default=1.0, help="Период обновления панели, секунды.")
+    parser.add_argument("--json", action="store_true", help="Печатать сводку JSON‑строкой вместо панели.")
+    parser.add_argument("--plain", action="store_true", help="Без очистки экрана.")
+    args = parser.parse_args(argv)
+    try:
+        _scheme, address, port = parse_endpoint(args.listen)
+        aggregator = Aggregator(address, port, window=args.window, stale=args.stale)
+    except (ValueError, OSError) as exc:
+        parser.error(str(exc))
+    ansi = not args.plain and not args.json and sys.stdout.isatty() and enable_windows_ansi()
+    next_render = time.monotonic()
+    try:
+        while True:
+            aggregator.poll(max(0.0, next_render - time.monotonic()))
+            if time.monotonic() < next_render:
+                continue
+            next_render += max(0.1, args.interval)
+            summary = aggregator.summary()
+            if args.json:
+                sys.stdout.write(json.dumps(summary, ensure_ascii=False) + "\n")
+            else:
+                frame = "\n".join(format_aggregate(summary, args.window)) + "\n"
+                sys.stdout.write(("\x1b[H\x1b[2J" + frame) if ansi else frame + "\n")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.close()
+    return 0
 
 
 ###############################################################################
@@ -846,7 +6037,34 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
         metavar="HOST",
         help="IP/домены для ping через системную утилиту (по умолчанию 1.1.1.1 8.8.8.8).",
     )
-    parser.add_argument("--no-throughput", action="store_true", help="Отключить измерение трафика даже если psutil установлен.")
+    parser.add_argument(
+        "--ping-mode",
+        choices=["auto", "icmp", "subprocess", "stream"],
+        default="auto",
+        help=(
+            "ICMP: встроенный сокет с откатом на ping (auto), только сокет (icmp), "
+            "системный ping на каждую итерацию (subprocess) или постоянный ping на цель (stream)."
+        ),
+    )
+    parser.add_argument(
+        "--ping-stream-interval",
+        type=float,
+        default=None,
+        help="Stream: интервал постоянного ping (сек, минимум 0.2). По умолчанию = интервал опроса.",
+    )
+    parser.add_argument("--no-throughput", action="store_true", help="Отключить измерение трафика.")
+    parser.add_argument(
+        "--throughput-sample",
+        type=float,
+        default=0.5,
+        help="Период фонового замера трафика по интерфейсам, секунды (можно меньше секунды).",
+    )
+    parser.add_argument(
+        "--throughput-ewma",
+        type=float,
+        default=5.0,
+        help="Постоянная времени сглаживания (EWMA) скорости по интерфейсам, секунды.",
+    )
     parser.add_argument("--plain", action="store_true", help="Без очистки экрана и цветов.")
     parser.add_argument("--new-console", action="store_true", help="Windows: запустить в новой консоли.")
     parser.add_argument("--primary-host", default="api.openai.com", help="Основной хост для DNS/HTTP проверки.")
@@ -854,6 +6072,78 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     parser.add_argument("--primary-scheme", choices=["http", "https"], default="https", help="Схема основной проверки.")
     parser.add_argument("--primary-method", choices=["HEAD", "GET"], default="HEAD", help="HTTP метод для основной проверки.")
     parser.add_argument("--http-timeout", type=float, default=5.0, help="Таймаут HTTP/HTTPS запросов (сек).")
+    parser.add_argument(
+        "--http-keepalive",
+        action="store_true",
+        help="Переиспользовать keep-alive соединения HTTP‑проверок между итерациями (движок threads).",
+    )
+    parser.add_argument(
+        "--probe-interval",
+        action="append",
+        default=[],
+        metavar="NAME=SEC",
+        help=(
+            "Свой интервал для проверки: группа (ip, ping, dns, primary, services) или точное имя "
+            "(цель ping, scheme://host/path). Можно повторять; включает планировщик проверок (движок threads)."
+        ),
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.1,
+        help="Планировщик: случайный сдвиг срока проверки в долях её интервала (0–0.5).",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Адаптивная частота: реже при стабильной связи, чаще после сбоя или всплеска RTT.",
+    )
+    parser.add_argument(
+        "--adaptive-max",
+        type=float,
+        default=8.0,
+        help="Адаптивный режим: во сколько раз интервал может вырасти при стабильной связи.",
+    )
+    parser.add_argument(
+        "--adaptive-burst",
+        type=float,
+        default=0.25,
+        help="Адаптивный режим: доля базового интервала при сбое (не меньше 0.5 с).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Сколько проверок одной итерации выполнять одновременно (1 — последовательно).",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="Движок проверок: пул потоков или неблокирующий asyncio.",
+    )
+    parser.add_argument(
+        "--tick-budget",
+        "--tick-deadline",
+        dest="tick_deadline",
+        metavar="SEC",
+        type=float,
+        default=None,
+        help=(
+            "Бюджет итерации (сек): проверки, не успевшие к нему, снимаются как timeout, а итерация "
+            "дольше бюджета считается перерасходом. По умолчанию = интервал (пул потоков тогда "
+            "ждёт все проверки)."
+        ),
+    )
+    parser.add_argument(
+        "--missed-ticks",
+        choices=["skip", "catchup"],
+        default="skip",
+        help=(
+            "Что делать с тактами, пропущенными из-за долгой итерации: skip — ждать следующего "
+            "такта сетки, catchup — выполнить их подряд (не больше 10)."
+        ),
+    )
     parser.add_argument(
         "--services",
         nargs="*",
@@ -868,15 +6158,179 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
         default=None,
         help="Каталог для логов (по умолчанию scripts/netlog рядом со скриптом).",
     )
+    parser.add_argument(
+        "--status-heartbeat",
+        type=float,
+        default=30.0,
+        help="Переписывать файл статуса без изменений не реже, чем раз в N секунд.",
+    )
+    parser.add_argument(
+        "--dns-resolvers",
+        default=None,
+        help=(
+            "Опрашивать DNS напрямую (UDP, откат на TCP) через перечисленные резолверы, "
+            "например system,1.1.1.1,8.8.8.8,127.0.0.1:5353; по умолчанию — системный getaddrinfo."
+        ),
+    )
+    parser.add_argument(
+        "--no-netlink",
+        action="store_true",
+        help="Не слушать события линков и маршрутов (Linux netlink) и определять IP каждую итерацию.",
+    )
+    parser.add_argument(
+        "--samples",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="DIR",
+        help="Вести двоичные ряды замеров по проверкам (по умолчанию в scripts/netlog/samples).",
+    )
+    parser.add_argument(
+        "--samples-keep-days",
+        type=float,
+        default=30.0,
+        help="Сколько дней хранить записи в рядах --samples; 0 — без удаления.",
+    )
+    parser.add_argument(
+        "--no-status-log",
+        action="store_true",
+        help="Не писать STATUS‑строки в текстовый runlog (остаются START/STOP, ошибки и события).",
+    )
+    parser.add_argument(
+        "--sqlite",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="PATH",
+        help="Писать замеры в SQLite (по умолчанию scripts/netlog/netwatch.sqlite) со свёртками 1m/1h.",
+    )
+    parser.add_argument("--sqlite-batch", type=int, default=10, help="Итераций в одной транзакции вставки SQLite.")
+    parser.add_argument(
+        "--sqlite-keep-days",
+        type=float,
+        default=7.0,
+        help="Сколько дней хранить сырые замеры в SQLite (свёртки остаются); 0 — без удаления.",
+    )
+    parser.add_argument(
+        "--status-delta",
+        action="store_true",
+        help="Писать в runlog только изменения состояния (DELTA) с периодическими полными кадрами.",
+    )
+    parser.add_argument(
+        "--keyframe-minutes",
+        type=float,
+        default=10.0,
+        help="Период полного кадра STATUS в режиме --status-delta, минуты.",
+    )
+    parser.add_argument(
+        "--delta-rtt-tolerance",
+        type=float,
+        default=5.0,
+        help="Изменение задержки (мс), которое не считается изменением в режиме --status-delta.",
+    )
+    parser.add_argument(
+        "--push",
+        default=None,
+        metavar="udp://HOST:PORT",
+        help="Режим агента: отправлять состояние каждой итерации агрегатору (udp:// или tcp://).",
+    )
+    parser.add_argument(
+        "--agent-name",
+        default=None,
+        help="Имя хоста в записях агента (по умолчанию — имя машины).",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Отдавать метрики OpenMetrics/Prometheus по HTTP на этом порту (путь /metrics).",
+    )
+    parser.add_argument(
+        "--metrics-bind",
+        default="0.0.0.0",
+        help="Адрес, на котором слушает --metrics-port (по умолчанию все интерфейсы).",
+    )
+    parser.add_argument(
+        "--log-queue",
+        type=int,
+        default=10000,
+        help="Размер очереди фоновой записи лога (строк). 0 — писать напрямую, открывая файл на каждую строку (без ротации).",
+    )
+    parser.add_argument("--log-flush-lines", type=int, default=50, help="Сбрасывать лог после N строк.")
+    parser.add_argument("--log-flush-ms", type=float, default=1000.0, help="Сбрасывать лог не реже, чем раз в T мс.")
+    parser.add_argument(
+        "--log-fsync",
+        choices=["never", "flush", "close"],
+        default="close",
+        help="Когда вызывать fsync для лога: никогда, после каждого сброса или при остановке.",
+    )
+    parser.add_argument(
+        "--log-max-mb",
+        type=float,
+        default=0.0,
+        help="Ротировать runlog, когда он превышает N МБ (0 — без ограничения).",
+    )
+    parser.add_argument(
+        "--log-rotate",
+        choices=["none", "hour", "day"],
+        default="none",
+        help="Ротировать runlog на границе часа или суток.",
+    )
+    parser.add_argument(
+        "--log-compress",
+        choices=["none", "gzip", "lzma"],
+        default="gzip",
+        help="Чем сжимать закрытые сегменты runlog.",
+    )
+    parser.add_argument(
+        "--log-keep-mb",
+        type=float,
+        default=0.0,
+        help="Хранить runlog суммарно не больше N МБ, удаляя самые старые (0 — без ограничения).",
+    )
+    parser.add_argument(
+        "--log-keep-days",
+        type=float,
+        default=0.0,
+        help="Удалять runlog старше N дней (0 — не удалять).",
+    )
+    parser.add_argument(
+        "--no-log-index",
+        action="store_true",
+        help="Не вести поминутный индекс runlog (*.idx), по которому show/report сразу переходят к нужному времени.",
+    )
     parser.add_argument(
         "--status-file",
         default=None,
         help="Файл, куда класть последний статус в JSON. По умолчанию scripts/netlog/last_status.json.",
     )
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    intervals: Dict[str, float] = {}
+    for raw in args.probe_interval:
+        name, sep, value = raw.rpartition("=")
+        try:
+            if not sep or not name:
+                raise ValueError(raw)
+            intervals[name] = float(value)
+        except ValueError:
+            parser.error(f"--probe-interval ожидает NAME=SEC, получено {raw!r}")
+    args.probe_intervals = intervals
+    return args
+
+
+# Подкоманды, которые не запускают мониторинг, а работают с его данными
+SUBCOMMANDS: Dict[str, Callable[[List[str]], int]] = {
+    "report": report_main,
+    "aggregate": aggregate_main,
+    "samples": samples_main,
+    "db": db_main,
+    "show": show_main,
+}
 
 
 def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        sys.exit(SUBCOMMANDS[sys.argv[1]](sys.argv[2:]))
     args = parse_args()
     # Determine log directory
     script_dir = Path(__file__).resolve().parent
@@ -923,8 +6377,51 @@ def main() -> None:
             else:
                 host, path = host_path, "/"
             service_endpoints.append((host, path, scheme))
+    log_writer = None
+    if args.log_queue > 0:
+        log_writer = LogWriter(
+            log_path,
+            queue_size=args.log_queue,
+            flush_lines=args.log_flush_lines,
+            flush_ms=args.log_flush_ms,
+            fsync=args.log_fsync,
+            max_bytes=int(args.log_max_mb * 1024 * 1024),
+            rotate_every=None if args.log_rotate == "none" else args.log_rotate,
+            compress=args.log_compress,
+            keep_bytes=int(args.log_keep_mb * 1024 * 1024),
+            keep_days=args.log_keep_days,
+            index=not args.no_log_index,
+            logger=logger,
+        )
+        # Старые запуски тоже подпадают под политику хранения
+        log_writer.apply_retention()
+    metrics = None
+    if args.metrics_port is not None:
+        try:
+            metrics = MetricsExporter(args.metrics_bind, args.metrics_port)
+        except OSError as exc:
+            sys.exit(f"Не удалось открыть порт метрик {args.metrics_bind}:{args.metrics_port}: {exc}")
+    agent = None
+    if args.push:
+        try:
+            agent = AgentPublisher(args.push, host=args.agent_name)
+        except ValueError as exc:
+            sys.exit(f"Некорректный --push: {exc}")
+    sample_store = None
+    if args.samples is not None:
+        sample_store = SampleStore(
+            Path(args.samples) if args.samples else log_dir / "samples",
+            keep_days=args.samples_keep_days,
+        )
+    sqlite_sink = None
+    if args.sqlite is not None:
+        sqlite_sink = SqliteSink(
+            Path(args.sqlite) if args.sqlite else log_dir / "netwatch.sqlite",
+            batch_ticks=args.sqlite_batch,
+            keep_days=args.sqlite_keep_days,
+        )
     # Determine throughput flag
-    throughput_enabled = not args.no_throughput and psutil is not None
+    throughput_enabled = not args.no_throughput
     # Instantiate and run the monitor
     monitor = NetWatch(
         interval=args.interval,
@@ -941,6 +6438,32 @@ def main() -> None:
         http_timeout=args.http_timeout,
         status_file=status_path,
         logger=logger,
+        max_workers=args.workers,
+        engine=args.engine,
+        tick_deadline=args.tick_deadline,
+        missed_ticks=args.missed_ticks,
+        ping_mode=args.ping_mode,
+        ping_stream_interval=args.ping_stream_interval,
+        http_keepalive=args.http_keepalive,
+        probe_intervals=args.probe_intervals,
+        schedule_jitter=args.jitter,
+        adaptive=args.adaptive,
+        adaptive_max=args.adaptive_max,
+        adaptive_burst=args.adaptive_burst,
+        log_writer=log_writer,
+        status_heartbeat=args.status_heartbeat,
+        metrics=metrics,
+        dns_resolvers=[item.strip() for item in args.dns_resolvers.split(",") if item.strip()] if args.dns_resolvers else None,
+        link_events=not args.no_netlink,
+        throughput_sample=args.throughput_sample,
+        throughput_tau=args.throughput_ewma,
+        agent=agent,
+        sample_store=sample_store,
+        status_log=not args.no_status_log,
+        sqlite_sink=sqlite_sink,
+        status_delta=(
+            StatusDeltaEncoder(args.keyframe_minutes * 60.0, args.delta_rtt_tolerance) if args.status_delta else None
+        ),
     )
     try:
         monitor.run()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# netwatch.py — самостоятельный скрипт, а не пакет: импортируем из scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,85 @@
+"""Агрегатор и агенты (UDP и TCP) на localhost."""
+
+import time
+
+import pytest
+
+import netwatch
+
+
+def make_state(ping_ok: bool = True, primary_ok: bool = True) -> dict:
+    return {
+        "summary": "OK – всё в норме" if ping_ok and primary_ok else "Проблема: сбой проверок",
+        "downtime_seconds": 0,
+        "ping": {"8.8.8.8": {"ok": ping_ok, "rtt_ms": 12.5 if ping_ok else None}},
+        "primary_http": {"ok": primary_ok, "status": 200 if primary_ok else None, "timing": {"total_ms": 48.0}},
+    }
+
+
+def pump(aggregator, condition, timeout: float = 3.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "агрегатор не получил записи вовремя"
+        aggregator.poll(0.05)
+
+
+@pytest.fixture
+def site():
+    aggregator = netwatch.Aggregator("127.0.0.1", 0, window=60.0, stale=15.0)
+    agents = {
+        "web-1": netwatch.AgentPublisher(f"udp://127.0.0.1:{aggregator.port}", host="web-1"),
+        "web-2": netwatch.AgentPublisher(f"tcp://127.0.0.1:{aggregator.port}", host="web-2"),
+    }
+    for agent in agents.values():
+        agent.start()
+
+    def send(states):
+        """Отправить по состоянию от каждого агента и дождаться их в агрегаторе."""
+
+        before = {name: stream.records for name, stream in aggregator.hosts.items()}
+        for name, state in states.items():
+            agents[name].publish(state)
+        pump(
+            aggregator,
+            lambda: all(
+                name in aggregator.hosts and aggregator.hosts[name].records > before.get(name, 0) for name in states
+            ),
+        )
+        return aggregator.summary()
+
+    yield send
+    for agent in agents.values():
+        agent.stop()
+    aggregator.close()
+
+
+def test_merges_streams_per_host(site):
+    for _ in range(3):
+        summary = site({"web-1": make_state(), "web-2": make_state()})
+    assert summary["active"] == 2
+    assert summary["verdict"] == "OK – все хосты в норме"
+    web1, web2 = summary["hosts"]["web-1"], summary["hosts"]["web-2"]
+    assert web1["peer"].startswith("udp:") and web2["peer"].startswith("tcp:")
+    for host in (web1, web2):
+        assert host["records"] == 3
+        assert host["lost"] == 0
+        assert host["availability"] == {"ping/8.8.8.8": 100.0, "primary": 100.0}
+    assert summary["probes"]["primary"] == {"ok": 2, "fail": 0}
+
+
+def test_single_host_outage(site):
+    site({"web-1": make_state(), "web-2": make_state()})
+    summary = site({"web-1": make_state(), "web-2": make_state(ping_ok=False)})
+    assert summary["site_down"] == []
+    assert summary["partial"] == {"ping/8.8.8.8": ["web-2"]}
+    assert summary["verdict"] == "Проблема на отдельных хостах: web-2"
+    assert summary["hosts"]["web-2"]["failing"] == ["ping/8.8.8.8"]
+    assert summary["hosts"]["web-2"]["availability"]["ping/8.8.8.8"] == 50.0
+
+
+def test_site_wide_outage(site):
+    summary = site({"web-1": make_state(primary_ok=False), "web-2": make_state(primary_ok=False)})
+    assert summary["site_down"] == ["primary"]
+    assert summary["partial"] == {}
+    assert summary["verdict"].startswith("Сбой площадки")
+    assert summary["probes"]["primary"] == {"ok": 0, "fail": 2}
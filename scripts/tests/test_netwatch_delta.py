@@ -0,0 +1,121 @@
+"""DELTA‑кодирование STATUS: кодировщик → JSON → восстановление, в т.ч. через ротацию LogWriter."""
+
+import datetime
+import json
+import types
+
+import netwatch
+
+T0 = datetime.datetime(2026, 1, 1, 12, 0, 0)
+
+
+def make_state(second: int, rtt: float = 20.0, primary_ok: bool = True, dns: bool = True) -> dict:
+    state = {
+        "timestamp": (T0 + datetime.timedelta(seconds=second)).isoformat(),
+        "uptime_seconds": second,
+        "summary": "OK – всё в норме" if primary_ok else "Проблема: primary недоступен",
+        "ping": {"8.8.8.8": {"ok": True, "rtt_ms": rtt}},
+        "primary_http": {"ok": primary_ok, "status": 204 if primary_ok else None, "timing": {"total_ms": rtt + 30.0}},
+        "throughput": {"rx_bps": 1000.0 + second},
+    }
+    if dns:
+        state["dns"] = {"ok": True, "addresses": ["192.0.2.1"]}
+    return state
+
+
+def log_line(state: dict, kind: str, record: dict) -> str:
+    stamp = datetime.datetime.fromisoformat(state["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
+    return f"{stamp} | INFO  | {kind} {json.dumps(record, ensure_ascii=False)}\n"
+
+
+def assert_close(expected: dict, actual: dict, rtt_tolerance: float) -> None:
+    """Совпадение с точностью до допусков кодировщика (задержки и скорости)."""
+
+    want, got = netwatch.flatten_state(expected), netwatch.flatten_state(actual)
+    assert set(want) == set(got)
+    for path, value in want.items():
+        if path[-1].endswith("_ms"):
+            assert abs(got[path] - value) <= rtt_tolerance, path
+        elif path[-1].endswith("_bps"):
+            assert abs(got[path] - value) <= netwatch.StatusDeltaEncoder.BPS_TOLERANCE * max(abs(value), 1.0), path
+        else:
+            assert got[path] == value, path
+
+
+def test_round_trip_with_tolerance_and_removed_keys():
+    states = [make_state(0)]
+    states.append(make_state(1, rtt=22.0))  # в пределах допуска — в DELTA не попадает
+    states.append(make_state(2, rtt=40.0))  # за допуском
+    states.append(make_state(3, rtt=40.0, primary_ok=False))
+    states.append(make_state(4, rtt=40.0, primary_ok=False, dns=False))  # ключ удалён
+    states.append(make_state(5, rtt=41.0, dns=True))  # и вернулся
+    encoder = netwatch.StatusDeltaEncoder(keyframe_every=3600.0, rtt_tolerance=5.0)
+    rebuild = netwatch.StatusReconstructor()
+    kinds = []
+    for state in states:
+        kind, record = encoder.encode(state)
+        kinds.append(kind)
+        record = json.loads(json.dumps(record))
+        restored = rebuild.keyframe(record) if kind == "STATUS" else rebuild.delta(record)
+        assert restored["timestamp"] == state["timestamp"]
+        assert restored["uptime_seconds"] == state["uptime_seconds"]
+        assert_close(state, restored, encoder.rtt_tolerance)
+    assert kinds == ["STATUS"] + ["DELTA"] * 5
+
+
+def test_small_changes_produce_empty_delta():
+    encoder = netwatch.StatusDeltaEncoder(rtt_tolerance=5.0)
+    encoder.encode(make_state(0))
+    kind, record = encoder.encode(make_state(1, rtt=24.0))
+    assert kind == "DELTA"
+    assert record == {"t": 1.0}
+    # Сравнивается с записанным значением (20), а не с предыдущим замером (24)
+    kind, record = encoder.encode(make_state(2, rtt=26.0))
+    assert record["s"] == [[["ping", "8.8.8.8", "rtt_ms"], 26.0], [["primary_http", "timing", "total_ms"], 56.0]]
+
+
+def test_keyframe_cadence_and_requests(monkeypatch):
+    clock = {"now": 0.0}
+    monkeypatch.setattr(netwatch, "time", types.SimpleNamespace(monotonic=lambda: clock["now"]))
+    encoder = netwatch.StatusDeltaEncoder(keyframe_every=10.0)
+    kinds = []
+    for second in range(0, 25, 5):
+        clock["now"] = float(second)
+        kinds.append(encoder.encode(make_state(second))[0])
+    assert kinds == ["STATUS", "DELTA", "STATUS", "DELTA", "STATUS"]
+    encoder.request_keyframe()
+    assert encoder.encode(make_state(21))[0] == "STATUS"
+    assert encoder.encode(make_state(22))[0] == "DELTA"
+    encoder.reset()
+    assert encoder.encode(make_state(23))[0] == "STATUS"
+
+
+def test_every_segment_starts_with_keyframe(tmp_path):
+    log = tmp_path / "runlog_01.01.26_12-00-00.log"
+    writer = netwatch.LogWriter(log, flush_lines=7, flush_ms=60000.0, max_bytes=3000)
+    encoder = netwatch.StatusDeltaEncoder(keyframe_every=3600.0)
+    writer.on_rotate = encoder.request_keyframe
+    writer.start()
+    states = [make_state(second, rtt=20.0 + (second % 4) * 10, primary_ok=second % 9 != 0) for second in range(150)]
+    for state in states:
+        kind, record = encoder.encode(state)
+        # Так же, как NetWatch.log_entry: DELTA несёт полное состояние на случай ротации
+        writer.write(log_line(state, kind, record), state if kind == "DELTA" else None)
+    writer.close()
+    assert writer.rotations >= 3
+    assert writer.stats()["errors"] == 0
+    files = netwatch.runlog_files(tmp_path)
+    for path in files:
+        first = path.read_text(encoding="utf-8").split("\n", 1)[0]
+        assert first.split(" | ", 2)[2].startswith("STATUS "), path.name
+        with netwatch.RunlogIndex(path) as index:
+            assert index.entry(0)[2] == 0
+    # Каждый сегмент восстанавливается сам по себе
+    restored = []
+    for path in files:
+        records = netwatch.iter_status_records(netwatch.iter_log_lines([path]))
+        restored.extend(state for kind, _ts, state in records if kind == "status")
+    assert len(restored) == len(states)
+    for state, got in zip(states, restored):
+        assert got["timestamp"] == state["timestamp"]
+        assert_close(state, got, encoder.rtt_tolerance)
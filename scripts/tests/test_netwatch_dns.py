@@ -0,0 +1,157 @@
+"""DnsProber против локального stub‑сервера DNS на 127.0.0.1."""
+
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import netwatch
+
+ADDRESS_A = "192.0.2.10"
+ADDRESS_AAAA = "2001:db8::10"
+
+
+def build_response(query: bytes, rcode: int = 0, truncated: bool = False, answers: bool = True) -> bytes:
+    """Ответ на запрос одного вопроса: A/AAAA со ссылкой на имя из вопроса."""
+
+    qid = struct.unpack("!H", query[:2])[0]
+    end = 12
+    while query[end]:
+        end += 1 + query[end]
+    question = query[12 : end + 5]
+    qtype = struct.unpack("!H", query[end + 1 : end + 3])[0]
+    records = b""
+    if answers and rcode == 0 and not truncated:
+        if qtype == netwatch.DNS_TYPE_A:
+            rdata = socket.inet_pton(socket.AF_INET, ADDRESS_A)
+        else:
+            rdata = socket.inet_pton(socket.AF_INET6, ADDRESS_AAAA)
+        records = struct.pack("!HHHIH", 0xC00C, qtype, 1, 60, len(rdata)) + rdata
+    flags = 0x8180 | rcode | (0x0200 if truncated else 0)
+    header = struct.pack("!HHHHHH", qid, flags, 1, 1 if records else 0, 0, 0)
+    return header + question + records
+
+
+class StubDns:
+    """UDP (и TCP на том же порту) stub‑резолвер с настраиваемым поведением."""
+
+    def __init__(self, rcode: int = 0, delay: float = 0.0, truncate: bool = False, silent: bool = False) -> None:
+        self.rcode = rcode
+        self.delay = delay
+        self.truncate = truncate
+        self.silent = silent
+        self.tcp_queries = 0
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(("127.0.0.1", 0))
+        self.port = self.udp.getsockname()[1]
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(("127.0.0.1", self.port))
+        self.tcp.listen()
+        self._threads = [
+            threading.Thread(target=self._serve_udp, daemon=True),
+            threading.Thread(target=self._serve_tcp, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def resolver(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    def _serve_udp(self) -> None:
+        while True:
+            try:
+                query, peer = self.udp.recvfrom(4096)
+            except OSError:
+                return
+            if self.silent:
+                continue
+            if self.delay:
+                time.sleep(self.delay)
+            self.udp.sendto(build_response(query, self.rcode, truncated=self.truncate), peer)
+
+    def _serve_tcp(self) -> None:
+        while True:
+            try:
+                conn, _peer = self.tcp.accept()
+            except OSError:
+                return
+            with conn:
+                length = struct.unpack("!H", conn.recv(2))[0]
+                query = b""
+                while len(query) < length:
+                    query += conn.recv(length - len(query))
+                self.tcp_queries += 1
+                response = build_response(query, self.rcode)
+                conn.sendall(struct.pack("!H", len(response)) + response)
+
+    def close(self) -> None:
+        self.udp.close()
+        self.tcp.close()
+
+
+@pytest.fixture
+def stubs():
+    created = []
+
+    def make(**kwargs):
+        stub = StubDns(**kwargs)
+        created.append(stub)
+        return stub
+
+    yield make
+    for stub in created:
+        stub.close()
+
+
+def test_parse_response_a_and_aaaa():
+    query_a = netwatch.dns_query(0x1234, "example.test", netwatch.DNS_TYPE_A)
+    query_aaaa = netwatch.dns_query(0x4321, "example.test", netwatch.DNS_TYPE_AAAA)
+    assert netwatch.parse_dns_response(build_response(query_a)) == (0x1234, 0, False, [ADDRESS_A])
+    assert netwatch.parse_dns_response(build_response(query_aaaa)) == (0x4321, 0, False, [ADDRESS_AAAA])
+    assert netwatch.parse_dns_response(build_response(query_a, rcode=3)) == (0x1234, 3, False, [])
+    assert netwatch.parse_dns_response(build_response(query_a, truncated=True))[2] is True
+    with pytest.raises(ValueError):
+        netwatch.parse_dns_response(build_response(query_a)[:20])
+
+
+def test_resolve_reports_each_resolver(stubs):
+    fast = stubs()
+    slow = stubs(delay=0.15)
+    prober = netwatch.DnsProber([fast.resolver, slow.resolver])
+    results = prober.resolve("example.test", timeout=2.0)
+    for stub in (fast, slow):
+        res = results[stub.resolver]
+        assert res["ok"] is True
+        assert res["rcode"] == "NOERROR"
+        assert sorted(res["addresses"]) == sorted([ADDRESS_A, ADDRESS_AAAA])
+        assert res["transport"] == "udp"
+    # Задержка своя у каждого резолвера: медленный не тормозит быстрый
+    assert results[fast.resolver]["rtt_ms"] < 100
+    assert results[slow.resolver]["rtt_ms"] >= 150
+
+
+def test_resolve_reports_rcode_and_timeout(stubs):
+    nxdomain = stubs(rcode=3)
+    silent = stubs(silent=True)
+    started = time.monotonic()
+    results = netwatch.DnsProber([nxdomain.resolver, silent.resolver]).resolve("missing.test", timeout=0.5)
+    assert time.monotonic() - started < 1.5
+    assert results[nxdomain.resolver]["ok"] is False
+    assert results[nxdomain.resolver]["rcode"] == "NXDOMAIN"
+    assert results[nxdomain.resolver]["error"] == "NXDOMAIN"
+    assert results[silent.resolver]["ok"] is False
+    assert results[silent.resolver]["error"] == "тайм-аут"
+
+
+def test_truncated_reply_falls_back_to_tcp(stubs):
+    stub = stubs(truncate=True)
+    res = netwatch.DnsProber([stub.resolver]).resolve("big.test", timeout=2.0)[stub.resolver]
+    assert stub.tcp_queries == 2
+    assert res["ok"] is True
+    assert res["transport"] == "tcp"
+    assert sorted(res["addresses"]) == sorted([ADDRESS_A, ADDRESS_AAAA])
+    assert res["rtt_ms"] is not None
@@ -0,0 +1,125 @@
+"""Поминутный индекс runlog (*.idx): запись LogWriter, поиск по минуте, show/report."""
+
+import datetime
+import json
+
+import netwatch
+
+T0 = datetime.datetime(2026, 1, 1, 12, 0, 0)
+KEYFRAMES = (0, 130)  # секунды, на которых пишется полный STATUS
+
+
+def make_state(second: int) -> dict:
+    return {
+        "timestamp": (T0 + datetime.timedelta(seconds=second)).isoformat(),
+        "uptime_seconds": second,
+        "summary": "OK – всё в норме",
+        "ping": {"8.8.8.8": {"ok": second % 60 != 40, "rtt_ms": 10.0 + second}},
+    }
+
+
+def log_line(when: datetime.datetime, message: str) -> str:
+    return f"{when:%Y-%m-%d %H:%M:%S} | INFO  | {message}\n"
+
+
+def write_log(path, lines, **kwargs) -> netwatch.LogWriter:
+    writer = netwatch.LogWriter(path, flush_lines=4, flush_ms=60000.0, **kwargs)
+    writer.start()
+    for line in lines:
+        writer.write(line)
+    writer.close()
+    return writer
+
+
+def status_log(path):
+    """Состояния раз в 20 с на пять минут; смещения строк по секундам."""
+
+    encoder = netwatch.StatusDeltaEncoder(keyframe_every=3600.0)
+    lines, offsets, states = [], {}, {}
+    offset = 0
+    for second in range(0, 300, 20):
+        # Ключевой кадр на 130‑й секунде — отдельной строкой между обычными
+        for tick in (second, second + 10) if second + 10 in KEYFRAMES else (second,):
+            if tick in KEYFRAMES:
+                encoder.reset()
+            state = make_state(tick)
+            kind, record = encoder.encode(state)
+            line = log_line(T0 + datetime.timedelta(seconds=tick), f"{kind} {json.dumps(record, ensure_ascii=False)}")
+            lines.append(line)
+            offsets[tick] = offset
+            states[tick] = state
+            offset += len(line.encode("utf-8"))
+    write_log(path, lines)
+    return offsets, states
+
+
+def minute(when: datetime.datetime) -> int:
+    return int(when.timestamp())
+
+
+def test_index_entries_point_at_minutes_and_keyframes(tmp_path):
+    log = tmp_path / "runlog_01.01.26_12-00-00.log"
+    offsets, _states = status_log(log)
+    with netwatch.RunlogIndex(log) as index:
+        entries = [index.entry(i) for i in range(len(index))]
+    assert [entry[0] for entry in entries] == [minute(T0 + datetime.timedelta(minutes=m)) for m in range(5)]
+    assert [entry[1] for entry in entries] == [offsets[m * 60] for m in range(5)]
+    # Кадр 12:02:10 пишется после первой строки минуты 12:02
+    assert [entry[2] for entry in entries] == [0, 0, 0, offsets[130], offsets[130]]
+
+
+def test_start_offset_bisects_to_last_keyframe(tmp_path):
+    log = tmp_path / "runlog_01.01.26_12-00-00.log"
+    offsets, _states = status_log(log)
+    with netwatch.RunlogIndex(log) as index:
+        assert index.start_offset(T0 - datetime.timedelta(minutes=5)) == 0
+        assert index.start_offset(T0 + datetime.timedelta(seconds=150)) == 0
+        assert index.start_offset(T0 + datetime.timedelta(seconds=210)) == offsets[130]
+        assert index.start_offset(T0 + datetime.timedelta(hours=1)) == offsets[130]
+    since = T0 + datetime.timedelta(seconds=210)
+    first_path, first_line = next(netwatch.iter_log_lines([log], since))
+    assert first_path == log
+    assert first_line.startswith("2026-01-01 12:02:10 | INFO  | STATUS ")
+
+
+def test_clock_going_backwards_keeps_minutes_ordered(tmp_path):
+    log = tmp_path / "runlog_01.01.26_12-00-00.log"
+    stamps = ["12:00:05", "12:01:05", "11:59:30", "12:01:40", "12:02:00"]
+    lines = [log_line(datetime.datetime.fromisoformat(f"2026-01-01T{stamp}"), "PING ok") for stamp in stamps]
+    write_log(log, lines)
+    with netwatch.RunlogIndex(log) as index:
+        minutes = [index.entry(i)[0] for i in range(len(index))]
+        offsets = [index.entry(i)[1] for i in range(len(index))]
+    assert minutes == [minute(T0), minute(T0 + datetime.timedelta(minutes=1)), minute(T0 + datetime.timedelta(minutes=2))]
+    sizes = [len(line.encode("utf-8")) for line in lines]
+    assert offsets == [0, sizes[0], sum(sizes[:4])]
+
+
+def test_compressed_segments_lose_their_index(tmp_path):
+    log = tmp_path / "runlog_01.01.26_12-00-00.log"
+    lines = [log_line(T0 + datetime.timedelta(seconds=second), "PING " + "ж" * 40) for second in range(200)]
+    writer = write_log(log, lines, max_bytes=4000, compress="gzip")
+    assert writer.rotations >= 2
+    assert writer.stats()["errors"] == 0
+    names = sorted(path.name for path in tmp_path.iterdir())
+    assert "runlog_01.01.26_12-00-00.log.idx" in names
+    assert all(name.endswith(".gz") for name in names if ".log." in name and not name.endswith("log.idx"))
+    # Сжатые сегменты читаются целиком, без индекса
+    read = [line for _path, line in netwatch.iter_log_lines(netwatch.runlog_files(tmp_path), T0)]
+    assert read == lines
+
+
+def test_show_and_report_start_from_keyframe(tmp_path, capsys):
+    log = tmp_path / "runlog_01.01.26_12-00-00.log"
+    _offsets, states = status_log(log)
+    assert netwatch.show_main(["--at", "2026-01-01T12:03:30", str(log)]) == 0
+    shown = json.loads(capsys.readouterr().out)
+    assert shown["timestamp"] == states[200]["timestamp"]
+    assert shown["ping"] == states[200]["ping"]
+    assert netwatch.show_main(["--since", "2026-01-01T12:03:00", "--until", "2026-01-01T12:04:00", str(log)]) == 0
+    period = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [state["uptime_seconds"] for state in period] == [180, 200, 220, 240]
+    assert netwatch.report_main(["--since", "2026-01-01T12:03:00", "--json", str(log)]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["records"] == 6
+    assert report["probes"]["ping/8.8.8.8"]["samples"] == 6
@@ -0,0 +1,92 @@
+"""Перцентили LatencyHistogram и скользящие окна RollingLatency."""
+
+import math
+import random
+
+import pytest
+
+import netwatch
+
+
+def exact_percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(len(ordered) * q / 100.0)) - 1]
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        [float(v) for v in range(1, 1001)],
+        [random.Random(1).lognormvariate(math.log(30.0), 0.8) for _ in range(5000)],
+        [random.Random(2).expovariate(1 / 120.0) + 0.5 for _ in range(5000)],
+    ],
+    ids=["uniform", "lognormal", "exponential"],
+)
+def test_percentiles_within_bucket_width(values):
+    hist = netwatch.LatencyHistogram()
+    for value in values:
+        hist.add(value)
+    for q in (50, 95, 99):
+        estimate, exact = hist.percentile(q), exact_percentile(values, q)
+        # Оценка — середина корзины, ошибка не больше шага сетки
+        assert abs(estimate - exact) / exact <= hist.growth - 1, q
+    summary = hist.summary()
+    assert summary["count"] == len(values)
+    assert summary["min"] == round(min(values), 3)
+    assert summary["max"] == round(max(values), 3)
+    assert summary["avg"] == pytest.approx(sum(values) / len(values), abs=1e-3)
+
+
+def test_empty_and_out_of_range():
+    hist = netwatch.LatencyHistogram(min_ms=1.0, max_ms=1000.0)
+    assert hist.percentile(50) is None
+    assert hist.summary()["p99"] is None
+    for value in (0.2, 5000.0, 9000.0):
+        hist.add(value)
+    # Значения вне сетки — в крайних корзинах, точные края остаются в min/max
+    assert hist.percentile(1) == hist.min_ms
+    assert 1000.0 / hist.growth <= hist.percentile(100) <= 9000.0
+    assert (hist.summary()["min"], hist.summary()["max"]) == (0.2, 9000.0)
+
+
+def test_merge_matches_single_histogram():
+    values = [random.Random(3).uniform(1.0, 200.0) for _ in range(2000)]
+    whole, left, right = netwatch.LatencyHistogram(), netwatch.LatencyHistogram(), netwatch.LatencyHistogram()
+    for index, value in enumerate(values):
+        whole.add(value)
+        (left if index % 2 else right).add(value)
+    left.merge(right)
+    assert left.summary() == whole.summary()
+    assert list(left.counts) == list(whole.counts)
+
+
+def test_rolling_window_expiry():
+    rolling = netwatch.RollingLatency()
+    rolling.add(100.0, now=0.0)
+    rolling.add(10.0, now=35.0)
+    # Окно 1m — шесть слотов по 10 с: замер с t=0 виден до t=60
+    assert rolling.window("1m", now=59.9).count == 2
+    assert rolling.window("1m", now=60.0).count == 1
+    assert rolling.window("1m", now=95.0).count == 0
+    assert rolling.window("15m", now=95.0).count == 2
+    # Окно 1h — слоты по 5 мин: оба замера в одном слоте и уходят вместе
+    assert rolling.window("1h", now=3599.0).count == 2
+    assert rolling.window("1h", now=3600.0).count == 0
+    # Тот же слот кольца через круг обнуляется, а не копит старое
+    rolling.add(50.0, now=60.0)
+    window = rolling.window("1m", now=60.0)
+    assert (window.count, window.min, window.max) == (2, 10.0, 50.0)
+    summary = rolling.summary(now=60.0)
+    assert summary["1m"]["count"] == 2
+    assert summary["1h"]["count"] == 3
+    assert set(summary) == {"1m", "15m", "1h", "jitter_ms"}
+
+
+def test_jitter_is_smoothed_difference():
+    rolling = netwatch.RollingLatency()
+    rolling.add(10.0, now=0.0)
+    assert rolling.jitter_ms is None
+    rolling.add(20.0, now=1.0)
+    assert rolling.jitter_ms == 10.0
+    rolling.add(20.0, now=2.0)
+    assert rolling.jitter_ms == pytest.approx(10.0 - 10.0 / 16.0)
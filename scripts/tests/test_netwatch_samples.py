@@ -0,0 +1,96 @@
+"""Двоичные ряды замеров: запись SampleStore, чтение SampleSeries, обрезка."""
+
+import netwatch
+
+PING = "ping/192.0.2.1"
+START = 1_700_000_000.0
+
+
+def make_state(second: int) -> dict:
+    failed = second % 4 == 3
+    return {
+        "ping": {"192.0.2.1": {"ok": not failed, "rtt_ms": None if failed else 10.0 + second * 0.5}},
+        "primary_http": {
+            "ok": not failed,
+            "status": 503 if failed else 204,
+            "timing": {"total_ms": 40.0 + second},
+        },
+    }
+
+
+def write_series(directory, seconds, **kwargs) -> netwatch.SampleStore:
+    store = netwatch.SampleStore(directory, keep_days=None, **kwargs)
+    store.start()
+    for second in seconds:
+        store.append(make_state(second), ts=START + second)
+    store.close()
+    return store
+
+
+def read(directory, probe, since=None, until=None):
+    with netwatch.SampleSeries(netwatch.SampleStore.series(directory)[probe]) as series:
+        return list(series.records(since, until))
+
+
+def test_record_layout():
+    assert netwatch.SampleSeries.RECORD.format == "<dfHB1x"
+    assert netwatch.SampleSeries.RECORD.size == 16
+    header = netwatch.SampleSeries.header(PING)
+    assert len(header) == netwatch.SampleSeries.HEADER_SIZE
+    assert header.startswith(b"NWTS")
+
+
+def test_write_read_round_trip(tmp_path):
+    store = write_series(tmp_path, range(12))
+    assert store.stats() == {"written": 24, "dropped": 0, "pruned": 0, "error": None}
+    assert set(netwatch.SampleStore.series(tmp_path)) == {PING, "primary"}
+    ping = read(tmp_path, PING)
+    assert [ts for ts, _rtt, _status, _ok in ping] == [START + second for second in range(12)]
+    assert ping[0] == (START, 10.0, None, True)
+    # Нет RTT — NaN в файле, None при чтении
+    assert ping[3] == (START + 3, None, None, False)
+    primary = read(tmp_path, "primary")
+    assert primary[3] == (START + 3, 43.0, 503, False)
+    assert primary[4] == (START + 4, 44.0, 204, True)
+
+
+def test_range_is_inclusive_and_uses_bisect(tmp_path):
+    write_series(tmp_path, range(10))
+    selected = read(tmp_path, PING, since=START + 3, until=START + 6)
+    assert [ts - START for ts, *_rest in selected] == [3, 4, 5, 6]
+    assert read(tmp_path, PING, since=START + 2.5, until=START + 3.5)[0][0] == START + 3
+    assert read(tmp_path, PING, since=START + 100) == []
+    with netwatch.SampleSeries(netwatch.SampleStore.series(tmp_path)[PING]) as series:
+        assert series.bisect(START + 4) == 4
+        assert series.bisect(START + 4, right=True) == 5
+
+
+def test_clock_step_back_keeps_series_ordered(tmp_path):
+    store = netwatch.SampleStore(tmp_path, keep_days=None)
+    store.start()
+    for ts in (START + 10, START + 5, START + 11):
+        store.append(make_state(0), ts=ts)
+    store.close()
+    assert [ts for ts, *_rest in read(tmp_path, PING)] == [START + 10, START + 10, START + 11]
+
+
+def test_torn_tail_is_ignored_and_trimmed(tmp_path):
+    write_series(tmp_path, range(3))
+    path = netwatch.SampleStore.series(tmp_path)[PING]
+    with path.open("ab") as fh:
+        fh.write(b"\x01\x02\x03")  # оборванная запись после сбоя
+    assert len(read(tmp_path, PING)) == 3
+    write_series(tmp_path, range(3, 5))
+    assert [ts - START for ts, *_rest in read(tmp_path, PING)] == [0, 1, 2, 3, 4]
+
+
+def test_prune_keeps_header_and_tail(tmp_path):
+    write_series(tmp_path, range(20))
+    store = netwatch.SampleStore(tmp_path, keep_days=None)
+    store.prune(START + 15)
+    assert store.pruned == 30
+    assert [ts - START for ts, *_rest in read(tmp_path, PING)] == [15, 16, 17, 18, 19]
+    assert read(tmp_path, "primary")[0] == (START + 15, 55.0, 503, False)
+    store.prune(START + 15)
+    assert store.pruned == 30
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,123 @@
+"""Свёртки SQLite: границы корзин, отметка свёртки, повторная свёртка, очистка."""
+
+import sqlite3
+
+import pytest
+
+import netwatch
+
+HOUR = 1_700_000_000 // 3600 * 3600  # начало часа
+
+
+@pytest.fixture
+def conn(tmp_path):
+    connection = netwatch.SqliteSink.connect(tmp_path / "netwatch.sqlite")
+    yield connection
+    connection.close()
+
+
+def insert(conn, rows) -> None:
+    with conn:
+        conn.executemany("INSERT INTO samples (probe, ts, ok, rtt_ms, status) VALUES (?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT OR IGNORE INTO probes (probe) VALUES (?)", {(row[0],) for row in rows})
+
+
+def table(conn, name):
+    return conn.execute(f"SELECT * FROM {name} ORDER BY probe, bucket").fetchall()
+
+
+def watermark(conn, name):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def test_rollup_row():
+    rows = [(1, float(v)) for v in range(1, 21)] + [(0, None), (0, None), (1, None)]
+    assert netwatch.rollup_row("p", 60, rows) == ("p", 60, 23, 2, 1.0, 10.5, 20.0, 19.0)
+    assert netwatch.rollup_row("p", 60, [(0, None)]) == ("p", 60, 1, 1, None, None, None, None)
+
+
+def test_bucket_boundaries_and_watermark(conn):
+    insert(
+        conn,
+        [
+            ("a", HOUR + 0.0, 1, 10.0, None),
+            ("a", HOUR + 59.999, 1, 30.0, None),
+            ("a", HOUR + 60.0, 0, None, None),  # ровно на границе — уже следующая минута
+            ("a", HOUR + 125.0, 1, 50.0, None),  # текущая, незавершённая минута
+            ("b", HOUR + 61.0, 1, 5.0, None),
+        ],
+    )
+    now = HOUR + 150.0
+    with conn:
+        assert netwatch.SqliteSink.rollup(conn, "rollup_1m", 60, now) == 3
+    assert table(conn, "rollup_1m") == [
+        ("a", HOUR, 2, 0, 10.0, 20.0, 30.0, 30.0),
+        ("a", HOUR + 60, 1, 1, None, None, None, None),
+        ("b", HOUR + 60, 1, 0, 5.0, 5.0, 5.0, 5.0),
+    ]
+    assert watermark(conn, "rollup_1m") == HOUR + 120
+    # Час ещё не закончился — часовой свёртки нет, отметка не ставится
+    with conn:
+        assert netwatch.SqliteSink.rollup(conn, "rollup_1h", 3600, now) == 0
+    assert table(conn, "rollup_1h") == []
+    assert watermark(conn, "rollup_1h") is None
+
+
+def test_rollup_is_idempotent(conn):
+    insert(conn, [("a", HOUR + second, second % 7 != 0, 10.0 + second, None) for second in range(0, 600, 5)])
+    now = HOUR + 600.0
+    with conn:
+        first = netwatch.SqliteSink.rollup(conn, "rollup_1m", 60, now)
+    snapshot = table(conn, "rollup_1m")
+    assert first == 10
+    # Повтор с той же отметкой ничего не делает
+    with conn:
+        assert netwatch.SqliteSink.rollup(conn, "rollup_1m", 60, now) == 0
+    # Пересчёт с нуля даёт те же строки (INSERT OR REPLACE, без дублей)
+    with conn:
+        conn.execute("DELETE FROM meta WHERE key = 'rollup_1m'")
+        assert netwatch.SqliteSink.rollup(conn, "rollup_1m", 60, now) == first
+    assert table(conn, "rollup_1m") == snapshot
+    # Следующий проход берёт только новые корзины
+    insert(conn, [("a", HOUR + 610.0, 1, 1.0, None)])
+    with conn:
+        assert netwatch.SqliteSink.rollup(conn, "rollup_1m", 60, HOUR + 700.0) == 1
+    assert table(conn, "rollup_1m")[:-1] == snapshot
+
+
+def test_prune_only_below_hourly_rollup(tmp_path):
+    sink = netwatch.SqliteSink(tmp_path / "netwatch.sqlite", keep_days=1.0 / 86400.0)
+    conn = sink.connect(sink.path)
+    try:
+        insert(conn, [("a", HOUR + 10.0, 1, 10.0, None), ("a", HOUR + 3610.0, 1, 20.0, None)])
+        sink._maintain(conn, HOUR + 3700.0)
+        assert [row[0] for row in conn.execute("SELECT ts FROM samples")] == [HOUR + 3610.0]
+        assert table(conn, "rollup_1h") == [("a", HOUR, 1, 0, 10.0, 10.0, 10.0, 10.0)]
+    finally:
+        conn.close()
+
+
+def test_sink_records_probes_and_drains_queue(tmp_path):
+    sink = netwatch.SqliteSink(tmp_path / "netwatch.sqlite", batch_ticks=100, keep_days=None)
+    state = {"ping": {"192.0.2.1": {"ok": True, "rtt_ms": 12.0}}, "primary_http": {"ok": False, "status": 503}}
+    for second in range(3):
+        sink.append(state, ts=HOUR + second)
+    sink._queue.put(None)
+    # Всё из очереди, маркер остановки возвращён на место
+    assert len(sink._drain()) == 6
+    assert sink._queue.get_nowait() is None
+    sink.start()
+    for second in range(3):
+        sink.append(state, ts=HOUR + second)
+    sink.close()
+    assert sink.stats() == {"inserted": 6, "dropped": 0, "error": None}
+    conn = sqlite3.connect(str(sink.path))
+    try:
+        assert [row[0] for row in conn.execute("SELECT probe FROM probes ORDER BY probe")] == [
+            "ping/192.0.2.1",
+            "primary",
+        ]
+        assert conn.execute("SELECT COUNT(*) FROM rollup_1m").fetchone()[0] == 2
+    finally:
+        conn.close()
@@ -0,0 +1,103 @@
+"""Расписание TickClock: бюджет, отставание, политики skip/catchup."""
+
+import types
+
+import pytest
+
+import netwatch
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"t": 100.0}
+    monkeypatch.setattr(netwatch, "time", types.SimpleNamespace(monotonic=lambda: now["t"]))
+
+    def make(policy: str = "skip", budget: float = 0.5):
+        tick = netwatch.TickClock(budget, policy)
+
+        def at(moment: float) -> None:
+            now["t"] = 100.0 + moment
+
+        return tick, at
+
+    return make
+
+
+def run_tick(tick, at, start: float, end: float, interval: float = 1.0) -> float:
+    at(start)
+    tick.begin()
+    at(end)
+    return tick.end(interval)
+
+
+def test_on_time_ticks_keep_the_grid(clock):
+    tick, at = clock()
+    at(0.0)
+    tick.reset()
+    assert run_tick(tick, at, 0.0, 0.3) == pytest.approx(0.7)
+    assert run_tick(tick, at, 1.0, 1.2) == pytest.approx(0.8)
+    assert (tick.overruns, tick.missed, tick.lag) == (0, 0, 0.0)
+
+
+def test_startup_is_not_lag(clock):
+    tick, at = clock()
+    # Между созданием часов и стартом цикла прошло 5 с (запуск компонентов)
+    at(5.0)
+    tick.reset()
+    assert run_tick(tick, at, 5.2, 5.4) == pytest.approx(0.6)
+    assert tick.missed == 0
+    assert tick.max_lag == 0.0
+    # Отставание первой итерации в max_lag не входит, последующих — входит
+    assert tick.lag == pytest.approx(0.2)
+    run_tick(tick, at, 6.3, 6.5)
+    assert tick.max_lag == pytest.approx(0.3)
+
+
+def test_skip_drops_overdue_ticks(clock):
+    tick, at = clock("skip")
+    at(0.0)
+    tick.reset()
+    run_tick(tick, at, 0.0, 0.2)
+    # Итерация 1..3.5 с: сроки 2 и 3 прошли — пропущены, следующая в 4
+    assert run_tick(tick, at, 1.0, 3.5) == pytest.approx(0.5)
+    assert tick.missed == 2
+    assert tick.overruns == 1
+    assert tick.snapshot()["missed_ticks"] == 2
+    assert tick.snapshot()["last_duration_ms"] == 2500.0
+
+
+def test_catchup_runs_overdue_ticks_back_to_back(clock):
+    tick, at = clock("catchup")
+    at(0.0)
+    tick.reset()
+    run_tick(tick, at, 0.0, 0.2)
+    assert run_tick(tick, at, 1.0, 3.5) == 0.0
+    assert tick.missed == 0
+    # Догоняющие итерации стартуют с отставанием от своих сроков
+    assert run_tick(tick, at, 3.5, 3.6) == 0.0
+    assert tick.lag == pytest.approx(1.5)
+    assert run_tick(tick, at, 3.6, 3.7) == pytest.approx(0.3)
+    assert tick.missed == 0
+
+
+def test_catchup_is_limited(clock):
+    tick, at = clock("catchup")
+    at(0.0)
+    tick.reset()
+    # Зависание на 25 с: догоняются не больше MAX_CATCHUP тактов, остальные пропущены
+    run_tick(tick, at, 0.0, 25.5)
+    assert netwatch.TickClock.MAX_CATCHUP == 10
+    # Просрочены сроки 1..25 с: десять из них выполнятся подряд, начиная с 16
+    assert tick.missed == 25 - 10
+    assert tick.due == pytest.approx(100.0 + 16.0)
+
+
+def test_wake_restarts_the_schedule(clock):
+    tick, at = clock()
+    at(0.0)
+    tick.reset()
+    run_tick(tick, at, 0.0, 0.1)
+    at(0.4)
+    tick.wake()
+    assert run_tick(tick, at, 0.4, 0.5) == pytest.approx(0.9)
+    assert tick.lag == 0.0